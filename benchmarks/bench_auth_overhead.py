@@ -0,0 +1,71 @@
+"""
+Per request cost of resolving the current user from an access token.
+
+Usage:
+    python benchmarks/bench_auth_overhead.py [--redis-url redis://localhost:6379/0] [--requests 20000]
+
+Without --redis-url an in-process fakeredis server stands in for Redis, so the Redis figures leave out network time.
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import sys
+import time
+from datetime import datetime
+
+import redis.asyncio as redis
+from fakeredis import FakeServer, aioredis
+from jose import jwt
+
+sys.path.append(os.getcwd())
+
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.cache import UserCache
+
+USER = User(id=1, username='deadpool', email='deadpool@example.com', password='x' * 60,
+            created_at=datetime(2023, 3, 1), confirmed=True)
+
+
+async def per_request(label: str, call, requests: int):
+    await call()
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call()
+    print(f'{label:>34}: {(time.perf_counter() - started) * 1e6 / requests:8.1f} us/request')
+
+
+async def main(redis_url: str | None, requests: int):
+    client = redis.from_url(redis_url) if redis_url else aioredis.FakeRedis(server=FakeServer())
+    token = await auth_service.create_access_token(data={'sub': USER.email}, expires_delta=7200)
+
+    # what every request paid before: signature check plus a pickled ORM instance from Redis
+    await client.set(f'pickled:{USER.email}', pickle.dumps(USER))
+
+    async def pickled():
+        jwt.decode(token, auth_service.SECRET_KEY, algorithms=[auth_service.ALGORITHM])
+        pickle.loads(await client.get(f'pickled:{USER.email}'))
+
+    auth_service.user_cache = UserCache(client, maxsize=1000, local_ttl=60, redis_ttl=86400)
+    await auth_service.user_cache.get_or_load(USER.email, lambda: asyncio.sleep(0, USER))
+
+    async def redis_tier():
+        auth_service.user_cache.local.clear()
+        await auth_service.get_current_user(token, db=None)
+
+    async def local_tier():
+        await auth_service.get_current_user(token, db=None)
+
+    await per_request('jwt + pickled user from redis', pickled, requests)
+    await per_request('get_current_user, redis tier hit', redis_tier, requests)
+    await per_request('get_current_user, local tier hit', local_tier, requests)
+    print(auth_service.user_cache.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url')
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.redis_url, args.requests))
@@ -0,0 +1,69 @@
+"""
+Confirmation emails rendered per second.
+
+Usage:
+    python benchmarks/bench_email_render.py [--messages 20000] [--batch 50]
+
+Compared: a fresh Jinja environment per message (what fastapi_mail did on every send), one compiled template
+rendered per message, and the fragment cache of EmailRenderer.render_batch in batches of --batch recipients.
+"""
+import argparse
+import os
+import sys
+import time
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+sys.path.append(os.getcwd())
+
+from src.services.email import new_message
+from src.services.email_render import TEMPLATE_FOLDERS, EmailRenderer
+
+HOST = 'http://localhost:8000/'
+
+
+def recipients(count: int) -> list[dict]:
+    return [{'username': f'user{i}', 'token': f'eyJhbGciOiJIUzI1NiJ9.{i:040d}.signature'} for i in range(count)]
+
+
+def per_second(label: str, render, messages: int, batch: int):
+    render(recipients(batch))
+    started = time.perf_counter()
+    for start in range(0, messages, batch):
+        render(recipients(min(batch, messages - start)))
+    print(f'{label:>34}: {messages / (time.perf_counter() - started):10.0f} messages/s')
+
+
+def main(messages: int, batch: int):
+    renderer = EmailRenderer()
+    template = renderer.template('email_template.html')
+
+    def environment_per_message(values):
+        for value in values:
+            env = Environment(loader=FileSystemLoader([str(folder) for folder in TEMPLATE_FOLDERS]),
+                              autoescape=select_autoescape(['html']))
+            env.get_template('email_template.html').render(host=HOST, **value)
+
+    def compiled_template(values):
+        for value in values:
+            template.render(host=HOST, **value)
+
+    def render_batch(values):
+        renderer.render_batch('email_template.html', {'host': HOST}, values)
+
+    def render_batch_and_build(values):
+        for value, html in zip(values, renderer.render_batch('email_template.html', {'host': HOST}, values)):
+            new_message(f"{value['username']}@example.com", 'Confirm your email ', html)
+
+    per_second('environment per message', environment_per_message, messages // 10, batch)
+    per_second('compiled template', compiled_template, messages, batch)
+    per_second('render_batch', render_batch, messages, batch)
+    per_second('render_batch + MIME message', render_batch_and_build, messages, batch)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+    main(args.messages, args.batch)
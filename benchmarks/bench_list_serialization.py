@@ -0,0 +1,101 @@
+"""
+Requests per second of one worker core for a page of contacts: ORM objects validated by ContactResponse
+and encoded by jsonable_encoder, versus plain rows encoded by orjson through RowsJSONResponse.
+
+Usage:
+    python benchmarks/bench_list_serialization.py [--contacts 1000] [--limit 100] [--requests 2000]
+
+Both routes run in this process on one event loop, so the numbers are per core. The database is a
+temporary SQLite file, the user is injected without a token, and rate limits are switched off.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import List
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+sys.path.append(os.getcwd())
+
+from src.database.connect_db import get_db
+from src.database.models import Base, Contact, User
+from src.routes import contacts
+from src.schemas import ContactResponse
+from src.services.auth import auth_service
+from src.services.rate_limit import rate_limiter
+
+
+def seed(path: str, count: int) -> User:
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [{'id': 1, 'username': 'bench', 'email': 'bench@example.com',
+                                          'password': 'x', 'confirmed': True}])
+        connection.execute(insert(Contact), [
+            {'first_name': f'First{i}', 'last_name': f'Last{i}', 'email': f'contact{i}@example.com',
+             'phone': f'+380{i:09d}', 'birthday': date(1980, 1, 1) + timedelta(days=i),
+             'birthday_ordinal': 101, 'user_id': 1}
+            for i in range(count)
+        ])
+    engine.dispose()
+    return User(id=1, username='bench', email='bench@example.com')
+
+
+def build_app(path: str, user: User) -> FastAPI:
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+    SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def override_get_db():
+        async with SessionLocal() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(contacts.router, prefix='/api')
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[auth_service.get_current_user] = lambda: user
+    app.dependency_overrides[auth_service.get_access_claims] = lambda: {'sub': user.email}
+    rate_limiter.policies.clear()
+
+    @app.get('/orm', response_model=List[ContactResponse])
+    async def orm_page(limit: int = 100, db: AsyncSession = Depends(get_db)):
+        stmt = select(Contact).filter(Contact.user_id == user.id).order_by(Contact.id).limit(limit)
+        return (await db.scalars(stmt)).all()
+
+    return app
+
+
+async def run(app: FastAPI, path: str, requests: int) -> tuple[float, int]:
+    async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+        response = await client.get(path)
+        response.raise_for_status()
+        started = time.perf_counter()
+        for _ in range(requests):
+            (await client.get(path)).raise_for_status()
+        return requests / (time.perf_counter() - started), len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f'{tmp}/bench.db'
+        app = build_app(path, seed(path, args.contacts))
+        for label, url in (('ORM + response_model', f'/orm?limit={args.limit}'),
+                           ('rows + orjson', f'/api/contacts/?limit={args.limit}')):
+            rps, size = asyncio.run(run(app, url, args.requests))
+            print(f'{label:>22}: {rps:8.1f} req/s, {size} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Per request overhead of the rate limiter: the Lua token bucket in Redis and the in-process fallback.
+
+Usage:
+    python benchmarks/bench_rate_limit.py [--redis-url redis://localhost:6379/0] [--requests 20000] [--clients 1000]
+
+Without --redis-url an in-process fakeredis server stands in for Redis, so the Redis figure leaves out network time
+and measures the Lua interpreter of fakeredis instead of the one in Redis.
+--clients spreads the requests over that many users, so most of them are allowed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import redis.asyncio as redis
+from fakeredis import FakeServer, aioredis
+
+sys.path.append(os.getcwd())
+
+from src.services.rate_limit import RateLimiter
+
+
+async def per_request(label: str, call, requests: int, clients: int):
+    await call('warmup')
+    started = time.perf_counter()
+    for i in range(requests):
+        await call(f'user{i % clients}@example.com')
+    print(f'{label:>24}: {(time.perf_counter() - started) * 1e6 / requests:8.1f} us/request')
+
+
+async def main(redis_url: str | None, requests: int, clients: int):
+    client = redis.from_url(redis_url) if redis_url else aioredis.FakeRedis(server=FakeServer())
+    limiter = RateLimiter(client, {'read_contacts': '60/60/user'}, local_maxsize=clients, retry_interval=5)
+
+    async def nothing(identity):
+        pass
+
+    async def in_redis(identity):
+        await limiter.hit('read_contacts', identity)
+
+    async def in_process(identity):
+        limiter.redis_down_until = float('inf')
+        await limiter.hit('read_contacts', identity)
+
+    await per_request('no limiter', nothing, requests, clients)
+    await per_request('token bucket in redis', in_redis, requests, clients)
+    await per_request('local fallback', in_process, requests, clients)
+    print(limiter.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.redis_url, args.requests, args.clients))
@@ -0,0 +1,39 @@
+"""
+Bytes on the wire and rows per second of the contacts list with all fields versus ?fields=first_name,phone.
+
+Usage:
+    python benchmarks/bench_sparse_fields.py [--contacts 1000] [--limit 100] [--requests 2000] [--fields first_name,phone]
+
+Uses the same temporary SQLite database and in-process app as bench_list_serialization.py.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from bench_list_serialization import build_app, run, seed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--fields', default='first_name,phone')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f'{tmp}/bench.db'
+        app = build_app(path, seed(path, args.contacts))
+        for label, url in (('all fields', f'/api/contacts/?limit={args.limit}'),
+                           (f'fields={args.fields}', f'/api/contacts/?limit={args.limit}&fields={args.fields}')):
+            rps, size = asyncio.run(run(app, url, args.requests))
+            print(f'{label:>26}: {size:7d} bytes/page, {size / args.limit:6.1f} bytes/row, '
+                  f'{rps * args.limit:9.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Per request cost of turning an access token into its claims, with and without the verified token cache.
+
+Usage:
+    python benchmarks/bench_token_decode.py [--requests 20000] [--tokens 1]
+
+--tokens spreads the requests over that many distinct tokens, as many users hitting one worker would.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from jose import jwt
+
+sys.path.append(os.getcwd())
+
+from src.services.auth import auth_service
+from src.services.cache import TokenCache
+
+
+def per_request(label: str, call, tokens: list[str], requests: int):
+    for token in tokens:
+        call(token)
+    started = time.perf_counter()
+    for i in range(requests):
+        call(tokens[i % len(tokens)])
+    print(f'{label:>24}: {(time.perf_counter() - started) * 1e6 / requests:8.1f} us/request')
+
+
+def main(requests: int, tokens: int):
+    encoded = [asyncio.run(auth_service.create_access_token(data={'sub': f'user{i}@example.com'}, expires_delta=7200))
+               for i in range(tokens)]
+    cache = TokenCache(maxsize=max(tokens, 1))
+
+    def decode(token):
+        return jwt.decode(token, auth_service.SECRET_KEY, algorithms=[auth_service.ALGORITHM])
+
+    def cached(token):
+        claims = cache.get(token)
+        if claims is None:
+            claims = decode(token)
+            cache.set(token, claims)
+        return claims
+
+    per_request('jwt.decode', decode, encoded, requests)
+    per_request('token cache', cached, encoded, requests)
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--tokens', type=int, default=1)
+    args = parser.parse_args()
+    main(args.requests, args.tokens)
@@ -0,0 +1,113 @@
+"""
+Login throughput and latency of an unrelated endpoint while a storm of logins is running.
+
+Usage:
+    python benchmarks/load_login_storm.py [--seconds 5] [--logins 32] [--workers 4]
+
+The app runs in process behind httpx. --logins clients log in back to back while one client
+requests GET / every 10 ms. Three setups are compared: bcrypt on the event loop (the old behaviour),
+the thread pool and the process pool. With bcrypt on the loop every login stalls the probe for the
+whole hash, with a pool the probe only waits for its own turn on the loop.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from fakeredis import FakeServer, aioredis
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+sys.path.append(os.getcwd())
+
+from src.database.connect_db import get_db
+from src.database.models import Base, User
+from src.main import app
+from src.services.auth import auth_service, hash_password
+from src.services.pool import WorkerPool
+
+EMAIL = 'storm@example.com'
+PASSWORD = '123456789'
+
+
+async def inline(fn, *args):
+    return fn(*args)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] if values else float('nan')
+
+
+async def storm(seconds: float, logins: int) -> tuple[int, list[float]]:
+    deadline = time.perf_counter() + seconds
+    completed = 0
+    probe_latencies = []
+
+    async with httpx.AsyncClient(app=app, base_url='http://bench', timeout=60) as client:
+        async def login():
+            nonlocal completed
+            while time.perf_counter() < deadline:
+                response = await client.post('/api/auth/login', data={'username': EMAIL, 'password': PASSWORD})
+                response.raise_for_status()
+                completed += 1
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                (await client.get('/')).raise_for_status()
+                probe_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(probe(), *(login() for _ in range(logins)))
+    return completed, probe_latencies
+
+
+async def main(seconds: float, logins: int, workers: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f'sqlite:///{tmp}/storm.db'
+        Base.metadata.create_all(create_engine(url))
+        engine = create_async_engine(url.replace('sqlite', 'sqlite+aiosqlite'), poolclass=NullPool)
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+        async with SessionLocal() as db:
+            db.add(User(username='storm', email=EMAIL, password=hash_password(PASSWORD), confirmed=True))
+            await db.commit()
+
+        async def override_get_db():
+            async with SessionLocal() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_db
+        auth_service.user_cache.redis = aioredis.FakeRedis(server=FakeServer())
+
+        setups = [
+            ('bcrypt on the event loop', None),
+            (f'thread pool, {workers} workers', WorkerPool('thread', workers, max_pending=logins)),
+            (f'process pool, {workers} workers', WorkerPool('process', workers, max_pending=logins)),
+        ]
+        for label, pool in setups:
+            if pool is None:
+                auth_service.run_in_password_pool = inline
+            else:
+                vars(auth_service).pop('run_in_password_pool', None)
+                auth_service.password_pool = pool
+            completed, latencies = await storm(seconds, logins)
+            print(f'{label:>28}: {completed / seconds:7.1f} logins/s, GET / p50 {percentile(latencies, 0.5) * 1000:7.1f} ms,'
+                  f' p99 {percentile(latencies, 0.99) * 1000:7.1f} ms, {len(latencies)} probes')
+            if pool is not None:
+                print(f'{"":>28}  {pool.stats()}')
+                pool.shutdown()
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--logins', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.logins, args.workers))
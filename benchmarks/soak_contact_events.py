@@ -0,0 +1,117 @@
+"""
+Soak test of the contact events feed: many open streams in one worker, a steady rate of published events
+and a share of the streams reconnecting every second.
+
+Usage:
+    python benchmarks/soak_contact_events.py [--streams 20000] [--users 5000] [--seconds 30] [--rate 500] [--churn 0.01]
+
+Redis is a fakeredis server in this process, one ContactEvents subscribes for the streams of the worker
+and a second one publishes, like another worker would. The streams are the generators that the
+/api/contacts/events route hands to StreamingResponse, read by one task each. Reported are the memory per
+open stream (tracemalloc, without the HTTP connection of the ASGI server), the delivery latency from publish
+to frame, the streams cut off as too slow and whether every subscription is gone once all streams closed.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import orjson
+from fakeredis import FakeServer, aioredis
+
+sys.path.append(os.getcwd())
+
+from src.services.events import READY, ContactEvents
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] if values else float('nan')
+
+
+async def soak(streams: int, users: int, seconds: float, rate: float, churn: float, max_queue: int):
+    server = FakeServer()
+    events = ContactEvents(aioredis.FakeRedis(server=server), max_queue=max_queue, heartbeat_interval=15,
+                           retry_interval=1)
+    publisher = ContactEvents(aioredis.FakeRedis(server=server), max_queue=max_queue, heartbeat_interval=15,
+                              retry_interval=1)
+    sent: dict[int, float] = {}
+    latencies: list[float] = []
+    received = 0
+    ready = asyncio.Semaphore(0)
+
+    async def read(user_id: int):
+        nonlocal received
+        async for frame in events.stream(user_id):
+            if frame == READY:
+                ready.release()
+            elif frame.startswith(b'event: contacts'):
+                seq = orjson.loads(frame[frame.index(b'data: ') + 6:])['ids'][0]
+                latencies.append(time.perf_counter() - sent[seq])
+                received += 1
+
+    def open_stream() -> asyncio.Task:
+        return asyncio.create_task(read(random.randrange(users)))
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    readers = [open_stream() for _ in range(streams)]
+    for _ in range(streams):
+        await ready.acquire()
+    opened = time.perf_counter() - started
+    per_stream = (tracemalloc.get_traced_memory()[0] - baseline) / streams
+    print(f'opened {streams} streams of {len(events.streams)} users in {opened:.1f}s, '
+          f'{per_stream:.0f} bytes per stream')
+
+    seq = 0
+    reconnects = 0
+    deadline = time.perf_counter() + seconds
+    next_churn = time.perf_counter() + 1
+    while time.perf_counter() < deadline:
+        sent[seq] = time.perf_counter()
+        await publisher.publish(random.randrange(users), 'update', [seq])
+        seq += 1
+        if time.perf_counter() >= next_churn:
+            for index in random.sample(range(streams), int(streams * churn)):
+                readers[index].cancel()
+                readers[index] = open_stream()
+                reconnects += 1
+            next_churn += 1
+        await asyncio.sleep(1 / rate)
+    await asyncio.sleep(0.5)
+
+    stats = events.stats()
+    print(f'published {seq} events, {received} frames delivered, {reconnects} reconnects, '
+          f'{stats["dropped"]} streams cut off, {stats["errors"]} redis errors')
+    print(f'latency p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms, '
+          f'max {max(latencies, default=float("nan")) * 1000:.2f} ms')
+    print(f'memory now {(tracemalloc.get_traced_memory()[0] - baseline) / streams:.0f} bytes per stream')
+
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.sleep(0.1)
+    stats = events.stats()
+    print(f'after closing: {stats["streams"]} streams of {stats["users"]} users open, '
+          f'{len(events.pubsub.channels) if events.pubsub else 0} channels subscribed')
+    await events.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--rate', type=float, default=500, help='events published per second')
+    parser.add_argument('--churn', type=float, default=0.01, help='share of the streams reconnecting every second')
+    parser.add_argument('--max-queue', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(soak(args.streams, args.users, args.seconds, args.rate, args.churn, args.max_queue))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""contacts updated_at and users contacts_version
+
+Revision ID: 5a8e2c1f9b47
+Revises: 3d9c5b7e2f81
+Create Date: 2026-10-18 18:21:44.906127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a8e2c1f9b47'
+down_revision = '3d9c5b7e2f81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'sqlite':
+        # SQLite adds no column with a non-constant default, the existing rows are stamped by an UPDATE instead
+        # and the column stays nullable; the application always sets it
+        op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute("UPDATE contacts SET updated_at = CURRENT_TIMESTAMP")
+    else:
+        op.add_column('contacts', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'),
+                                            nullable=False))
+    op.add_column('users', sa.Column('contacts_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'contacts_version')
+    op.drop_column('contacts', 'updated_at')
@@ -0,0 +1,33 @@
+"""contacts birthday ordinal
+
+Revision ID: 7b3f0e9d51a6
+Revises: c4e1d7a2b9f3
+Create Date: 2026-10-18 11:02:17.584301
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3f0e9d51a6'
+down_revision = 'c4e1d7a2b9f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('birthday_ordinal', sa.SmallInteger(), nullable=True))
+    contacts = sa.table('contacts', sa.column('birthday', sa.Date()), sa.column('birthday_ordinal', sa.SmallInteger()))
+    op.execute(
+        contacts.update()
+        .where(contacts.c.birthday.isnot(None))
+        .values(birthday_ordinal=sa.cast(sa.extract('month', contacts.c.birthday) * 100
+                                         + sa.extract('day', contacts.c.birthday), sa.SmallInteger()))
+    )
+    op.create_index('ix_contacts_user_id_birthday_ordinal', 'contacts', ['user_id', 'birthday_ordinal'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_birthday_ordinal', table_name='contacts')
+    op.drop_column('contacts', 'birthday_ordinal')
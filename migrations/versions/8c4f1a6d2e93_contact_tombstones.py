@@ -0,0 +1,37 @@
+"""contact tombstones and contacts updated_at index
+
+Revision ID: 8c4f1a6d2e93
+Revises: 5a8e2c1f9b47
+Create Date: 2026-10-18 20:07:12.514382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4f1a6d2e93'
+down_revision = '5a8e2c1f9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_user_id_updated_at', 'contacts', ['user_id', 'updated_at'], unique=False)
+    op.create_table(
+        'contact_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('contact_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_contact_tombstones_user_id_deleted_at', 'contact_tombstones', ['user_id', 'deleted_at'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_tombstones_user_id_deleted_at', table_name='contact_tombstones')
+    op.drop_table('contact_tombstones')
+    op.drop_index('ix_contacts_user_id_updated_at', table_name='contacts')
@@ -0,0 +1,24 @@
+"""users tombstones_purged_until
+
+Revision ID: a4c7e2b95d38
+Revises: f61b8e3d7a05
+Create Date: 2026-10-18 22:31:18.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c7e2b95d38'
+down_revision = 'f61b8e3d7a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('tombstones_purged_until', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'tombstones_purged_until')
@@ -0,0 +1,25 @@
+"""drop users refresh_token
+
+Revision ID: b7d2e5a90c14
+Revises: 8c4f1a6d2e93
+Create Date: 2026-10-18 21:14:05.208311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e5a90c14'
+down_revision = '8c4f1a6d2e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # refresh tokens live in the session store since the rotation of refresh tokens, nothing reads this column
+    op.drop_column('users', 'refresh_token')
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('refresh_token', sa.String(length=255), nullable=True))
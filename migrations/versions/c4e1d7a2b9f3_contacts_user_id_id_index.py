@@ -0,0 +1,24 @@
+"""contacts user_id id index
+
+Revision ID: c4e1d7a2b9f3
+Revises: a591c9bace5b
+Create Date: 2026-10-18 10:12:41.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1d7a2b9f3'
+down_revision = 'a591c9bace5b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_user_id_id', 'contacts', ['user_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_id', table_name='contacts')
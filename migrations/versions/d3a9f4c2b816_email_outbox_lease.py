@@ -0,0 +1,26 @@
+"""email outbox lease
+
+Revision ID: d3a9f4c2b816
+Revises: b7d2e5a90c14
+Create Date: 2026-10-18 21:42:37.640915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9f4c2b816'
+down_revision = 'b7d2e5a90c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('email_outbox', sa.Column('locked_until', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    # messages claimed by a worker that did not report back are handed out again
+    op.execute("UPDATE email_outbox SET status = 'pending' WHERE status = 'sending'")
+    op.drop_column('email_outbox', 'locked_until')
@@ -0,0 +1,69 @@
+"""contacts search index
+
+Revision ID: e2a86c0f4d17
+Revises: 7b3f0e9d51a6
+Create Date: 2026-10-18 12:40:55.102934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a86c0f4d17'
+down_revision = '7b3f0e9d51a6'
+branch_labels = None
+depends_on = None
+
+
+# SQLite has no tsvector: an external content FTS5 table kept in sync by triggers, as created by
+# the after_create listeners of the contacts table in src/database/models.py
+SQLITE_FTS_COLUMNS = 'first_name, last_name, email, phone'
+SQLITE_FTS_TRIGGERS = ('contacts_fts_ai', 'contacts_fts_ad', 'contacts_fts_au')
+
+
+def upgrade_sqlite() -> None:
+    op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5({SQLITE_FTS_COLUMNS}, "
+               f"content='contacts', content_rowid='id')")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+               f"INSERT INTO contacts_fts(rowid, {SQLITE_FTS_COLUMNS}) "
+               f"VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+               f"INSERT INTO contacts_fts(contacts_fts, rowid, {SQLITE_FTS_COLUMNS}) "
+               f"VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); END")
+    op.execute(f"CREATE TRIGGER IF NOT EXISTS contacts_fts_au AFTER UPDATE OF {SQLITE_FTS_COLUMNS} ON contacts BEGIN "
+               f"INSERT INTO contacts_fts(contacts_fts, rowid, {SQLITE_FTS_COLUMNS}) "
+               f"VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); "
+               f"INSERT INTO contacts_fts(rowid, {SQLITE_FTS_COLUMNS}) "
+               f"VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END")
+    # index the contacts that already exist
+    op.execute("INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')")
+
+
+def upgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == 'sqlite':
+        upgrade_sqlite()
+        return
+    if dialect != 'postgresql':
+        return
+    # the expression must stay identical to contact_search_vector in src/database/models.py
+    op.execute(
+        "CREATE INDEX ix_contacts_search ON contacts USING gin ("
+        "(setweight(to_tsvector('simple', coalesce(first_name, '')), 'A') "
+        "|| setweight(to_tsvector('simple', coalesce(last_name, '')), 'A') "
+        "|| setweight(to_tsvector('simple', coalesce(translate(email, '@.', '  '), '')), 'B') "
+        "|| setweight(to_tsvector('simple', coalesce(translate(phone, '+-().', '     '), '')), 'C')))"
+    )
+
+
+def downgrade() -> None:
+    dialect = op.get_context().dialect.name
+    if dialect == 'sqlite':
+        for trigger in SQLITE_FTS_TRIGGERS:
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS contacts_fts")
+        return
+    if dialect != 'postgresql':
+        return
+    op.drop_index('ix_contacts_search', table_name='contacts')
@@ -0,0 +1,26 @@
+"""email outbox dedupe key
+
+Revision ID: f61b8e3d7a05
+Revises: d3a9f4c2b816
+Create Date: 2026-10-18 22:05:51.372049
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f61b8e3d7a05'
+down_revision = 'd3a9f4c2b816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('email_outbox', sa.Column('dedupe_key', sa.String(length=100), nullable=True))
+    op.create_index('ix_email_outbox_dedupe_key', 'email_outbox', ['dedupe_key'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_email_outbox_dedupe_key', table_name='email_outbox')
+    op.drop_column('email_outbox', 'dedupe_key')
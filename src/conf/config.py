@@ -10,11 +10,70 @@ class Settings(BaseSettings):
     mail_from: str = "example@meta.ua"
     mail_port: int = 465
     mail_server: str = "smtp.meta.ua"
+    mail_ssl_tls: bool = True
+    mail_starttls: bool = False
+    smtp_pool_size: int = 2
+    outbox_batch_size: int = 50
+    outbox_poll_interval: float = 1.0
+    outbox_max_attempts: int = 8
+    # seconds a worker may take to send a claimed batch before another worker claims it again
+    outbox_lease: float = 300
+    outbox_backoff_base: float = 30
+    outbox_backoff_max: float = 3600
+    birthday_digest_days: int = 7
+    birthday_digest_hour: int = 8
+    birthday_digest_max_contacts: int = 50
+    birthday_digest_batch_size: int = 500
+    birthday_digest_fetch_size: int = 2000
+    # bearer token of GET /api/metrics/, the route answers 404 while it is empty
+    metrics_token: str = ''
     redis_host: str = "localhost"
     redis_port: int = 6379
+    user_cache_size: int = 10000
+    user_cache_local_ttl: int = 60
+    user_cache_redis_ttl: int = 86400
+    token_cache_size: int = 10000
+    contacts_cache_ttl: int = 300
+    contacts_cache_max_entry_bytes: int = 256 * 1024
+    contacts_cache_retry_interval: float = 5
+    contact_events_max_queue: int = 100
+    contact_events_heartbeat_interval: float = 15
+    contact_events_retry_interval: float = 5
+    password_pool_kind: str = 'thread'
+    password_pool_workers: int = 4
+    password_pool_max_pending: int = 64
+    session_store: str = 'redis'
+    refresh_token_ttl: int = 7 * 24 * 3600
+    revocation_filter_capacity: int = 100000
+    revocation_filter_error_rate: float = 0.001
+    revocation_sync_interval: float = 5
+    # policy name: times/seconds/by, where by is user or ip
+    rate_limits: dict[str, str] = {
+        "read_contacts": "60/60/user",
+        "update_contact": "30/60/user",
+        "login": "10/60/ip",
+    }
+    rate_limit_local_size: int = 10000
+    rate_limit_retry_interval: float = 5
     cloudinary_name: str = 'name'
     cloudinary_api_key: int = 5555555555
     cloudinary_api_secret: str = 'secret'
+    avatar_storage: str = 'cloudinary'
+    avatar_local_root: str = 'avatars'
+    avatar_local_url: str = '/avatars'
+    avatar_size: int = 250
+    avatar_max_bytes: int = 10 * 1024 * 1024
+    avatar_max_pixels: int = 50_000_000
+    avatar_upload_chunk_size: int = 64 * 1024
+    avatar_pool_kind: str = 'process'
+    avatar_pool_workers: int = 2
+    avatar_pool_max_pending: int = 16
+    contacts_import_chunk_size: int = 1000
+    contacts_import_max_errors: int = 1000
+    contacts_bulk_chunk_size: int = 500
+    contacts_bulk_max_ids: int = 100000
+    contacts_sync_retention_days: int = 30
+    contacts_sync_page_size: int = 500
 
     class Config:
         env_file = ".env"
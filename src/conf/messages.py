@@ -17,4 +17,16 @@ NOT_VALIDATE_CREDENTIALS = 'Could not validate credentials'
 DB_CONFIG_ERROR = "Database is not configured correctly"
 DB_CONNECT_ERROR = "Error connecting to the database"
 WELCOME_MESSAGE = "Welcome to FastAPI!"
-TOO_MANY_REQUESTS = 'No more than 10 requests per minute'
\ No newline at end of file
+TOO_MANY_REQUESTS = 'Too many requests, try again later'
+PASSWORD_POOL_BUSY = "Too many logins in progress, try again later"
+SESSION_STORE_UNAVAILABLE = "Session store is unavailable, try again later"
+INVALID_CURSOR = "Invalid pagination cursor"
+UNKNOWN_FIELDS = "Unknown fields"
+INVALID_SYNC_TOKEN = "Invalid sync token"
+SYNC_TOKEN_EXPIRED = "Sync token expired, sync again without since"
+INVALID_IMAGE = "Uploaded file is not a supported image"
+IMAGE_TOO_LARGE = "Uploaded image is too large"
+AVATAR_POOL_BUSY = "Too many avatar uploads in progress, try again later"
+
+UNSUPPORTED_IMPORT_FORMAT = "Unsupported file format, expected csv or ndjson"
+TOO_MANY_IDS = "Too many ids in one request"
\ No newline at end of file
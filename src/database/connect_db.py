@@ -1,25 +1,53 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from src.conf.config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.sqlalchemy_database_url
 
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    The to_async_url function swaps the blocking DBAPI driver of a database url for its asyncio counterpart.
+        postgresql+psycopg2 becomes postgresql+asyncpg and sqlite becomes sqlite+aiosqlite,
+        urls that already name an async driver are returned unchanged.
+
+    :param url: str: The database url from the settings
+    :return: The same url with an asyncio driver
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name())
+    if drivername is None or url.drivername in ASYNC_DRIVERS.values():
+        return url.render_as_string(hide_password=False)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+ASYNC_SQLALCHEMY_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# blocking engine, kept for alembic and command line scripts
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 # Dependency
-def get_db():
+async def get_db():
     """
-    The get_db function opens a new database connection if there is none yet for the current application context.
-    It will also create the database tables if they don't exist yet.
-    
-    :return: A database session object
+    The get_db function opens a new asynchronous database session for the current request.
+    The session is closed once the request has been handled, so its connection goes back to the pool.
+
+    :return: An AsyncSession object
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -1,10 +1,60 @@
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String,  func
+from sqlalchemy import (DDL, JSON, Boolean, Column, DateTime, ForeignKey, Index, Integer, SmallInteger, String, Text, event,
+    func, literal_column)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.sql.sqltypes import Date
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+
+def _literal(value: str):
+    # inline constants, an expression index is only used when the query repeats it with the same literals
+    return literal_column(f"'{value}'")
+
+
+def _weighted_vector(column, weight: str):
+    return func.setweight(func.to_tsvector(_literal('simple'), func.coalesce(column, _literal(''))), _literal(weight))
+
+
+def contact_search_vector(first_name, last_name, email, phone):
+    # PostgreSQL full text document of a contact: names rank above email, email above phone.
+    # Email and phone are split on their punctuation, the same way the SQLite FTS5 tokenizer splits them.
+    return (
+        _weighted_vector(first_name, 'A')
+        .op('||')(_weighted_vector(last_name, 'A'))
+        .op('||')(_weighted_vector(func.translate(email, _literal('@.'), _literal('  ')), 'B'))
+        .op('||')(_weighted_vector(func.translate(phone, _literal('+-().'), _literal('     ')), 'C'))
+    )
+
+
+class utc_now(FunctionElement):
+    """
+    The time of the database clock in UTC when the statement runs, with microseconds where the backend keeps them.
+    Rows stamped by it are ordered by one clock, however many hosts write them.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utc_now)
+def _utc_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utc_now, 'postgresql')
+def _utc_now_postgresql(element, compiler, **kw):
+    # not now(), the start of the transaction, which can be before a lock it waited for was granted
+    return "timezone('utc', clock_timestamp())"
+
+
+@compiles(utc_now, 'sqlite')
+def _utc_now_sqlite(element, compiler, **kw):
+    # milliseconds, padded to the microseconds SQLAlchemy writes, as SQLite compares the values as text
+    return "(strftime('%Y-%m-%d %H:%M:%f', 'now') || '000')"
+
+
 class Contact(Base):
     __tablename__ = "contacts"
     id = Column(Integer, primary_key=True)
@@ -13,9 +63,54 @@ class Contact(Base):
     email = Column(String(50))
     phone = Column(String(50))
     birthday = Column(Date())
+    # month * 100 + day of the birthday, so upcoming birthdays are a range scan
+    birthday_ordinal = Column(SmallInteger)
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
+    # stamped by the database clock in the statement that writes the contact, after the row lock of the user,
+    # so the changes feed sees the writes of a user in commit order
+    updated_at = Column(DateTime, nullable=False, default=utc_now(), onupdate=utc_now(), server_default=func.now())
     user = relationship('User', backref="contacts")
 
+    __table_args__ = (
+        # keyset pagination seeks on (user_id, id)
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        Index('ix_contacts_user_id_birthday_ordinal', 'user_id', 'birthday_ordinal'),
+        # the changes feed seeks on (user_id, updated_at)
+        Index('ix_contacts_user_id_updated_at', 'user_id', 'updated_at'),
+        Index('ix_contacts_search', contact_search_vector(first_name, last_name, email, phone),
+              postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
+
+# SQLite has no tsvector, an external content FTS5 table kept in sync by triggers stands in for it
+SQLITE_FTS_COLUMNS = 'first_name, last_name, email, phone'
+for statement in (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5({SQLITE_FTS_COLUMNS}, content='contacts', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ai AFTER INSERT ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(rowid, {SQLITE_FTS_COLUMNS}) VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_ad AFTER DELETE ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(contacts_fts, rowid, {SQLITE_FTS_COLUMNS}) "
+    f"VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); END",
+    f"CREATE TRIGGER IF NOT EXISTS contacts_fts_au AFTER UPDATE OF {SQLITE_FTS_COLUMNS} ON contacts BEGIN "
+    f"INSERT INTO contacts_fts(contacts_fts, rowid, {SQLITE_FTS_COLUMNS}) "
+    f"VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone); "
+    f"INSERT INTO contacts_fts(rowid, {SQLITE_FTS_COLUMNS}) VALUES (new.id, new.first_name, new.last_name, new.email, new.phone); END",
+):
+    event.listen(Contact.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Contact.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS contacts_fts").execute_if(dialect='sqlite'))
+
+
+class ContactTombstone(Base):
+    # left behind by a deleted contact, so the changes feed can report the deletion
+    __tablename__ = "contact_tombstones"
+    __table_args__ = (
+        Index('ix_contact_tombstones_user_id_deleted_at', 'user_id', 'deleted_at'),
+    )
+    id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, nullable=False)
+    user_id = Column(ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    deleted_at = Column(DateTime, nullable=False, default=utc_now())
+
 
 class User(Base):
     __tablename__ = "users"
@@ -25,5 +120,31 @@ class User(Base):
     password = Column(String(255), nullable=False)
     avatar = Column(String(255), nullable=True)
     created_at = Column('created_at', DateTime, default=func.now())
-    refresh_token = Column(String(255), nullable=True)
-    confirmed = Column(Boolean, default=False)
\ No newline at end of file
+    confirmed = Column(Boolean, default=False)
+    # incremented in the transaction of every write to the contacts of the user, the version of the list ETags
+    contacts_version = Column(Integer, nullable=False, default=0, server_default='0')
+    # deleted_at of the newest tombstone dropped after the retention, a sync token from before it may miss a deletion
+    tombstones_purged_until = Column(DateTime, nullable=True)
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # the sender worker polls for due messages in this order
+        Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        Index('ix_email_outbox_dedupe_key', 'dedupe_key', unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    recipient = Column(String(250), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String(20), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=func.now())
+    # end of the lease of the worker sending the message, while its status is sending
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+    # set for messages a job must queue only once, e.g. birthday_digest:{user_id}:{date}
+    dedupe_key = Column(String(100), nullable=True)
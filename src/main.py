@@ -1,12 +1,12 @@
 import uvicorn
-import redis.asyncio as redis
 from fastapi import FastAPI
-from fastapi_limiter import FastAPILimiter
 from fastapi.middleware.cors import CORSMiddleware
 
-from src.conf.config import settings
 from src.conf.messages import WELCOME_MESSAGE
-from src.routes import contacts, auth, users
+from src.routes import contacts, auth, users, metrics
+from src.services.auth import auth_service
+from src.services.avatars import avatar_pipeline
+from src.services.events import contact_events
 
 
 origins = [ 
@@ -23,15 +23,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
-@app.on_event("startup")
-async def startup():
-    redis_cache = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(redis_cache)
-    
+@app.on_event("shutdown")
+async def shutdown():
+    auth_service.password_pool.shutdown()
+    avatar_pipeline.pool.shutdown()
+    await contact_events.close()
+
     
 @app.get("/", name="Main root")
 def read_root():
@@ -46,6 +47,7 @@ def read_root():
 app.include_router(auth.router, prefix='/api')
 app.include_router(contacts.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(metrics.router, prefix='/api')
 
 
 
@@ -1,123 +1,458 @@
-from typing import List
-from datetime import datetime, timedelta
+import binascii
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import AsyncIterator, Iterator, List, NamedTuple, Sequence, Tuple
+from datetime import date, datetime, timedelta
 
-from sqlalchemy import extract, func
-from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from sqlalchemy import Row, cast, column, delete, func, insert, literal_column, null, or_, select, table, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import and_
 
-from src.database.models import Contact, User
-from src.schemas import ContactModel, ContactUpdate
+from src.database.models import Contact, ContactTombstone, User, contact_search_vector
+from src.schemas import ContactModel, ContactPatch, ContactUpdate
+from src.services.cache import contacts_cache
+from src.services.events import contact_events
 
+# columns of ContactResponse, the list queries select them as plain rows instead of loading Contact objects
+CONTACT_COLUMNS = (Contact.id, Contact.first_name, Contact.last_name, Contact.email, Contact.phone, Contact.birthday)
+CONTACT_FIELDS = {column.key: column for column in CONTACT_COLUMNS}
 
-async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[Contact]:
+# the changes feed orders events by (changed_at, kind, id), an upsert sorts before a deletion of the same instant
+CHANGE_UPSERT, CHANGE_DELETE = 0, 1
+SYNC_EPOCH = datetime(1970, 1, 1)
+
+
+class ChangePosition(NamedTuple):
+    # contacts_version of the user when the position was handed out, -1 while more changes are pending
+    version: int
+    changed_at: datetime
+    kind: int
+    id: int
+
+
+class ChangesPage(NamedTuple):
+    upserts: List[dict]
+    deleted: List[int]
+    position: ChangePosition
+    more: bool
+
+
+class SyncTokenExpired(Exception):
+    pass
+
+
+def contact_columns(fields: str | None) -> tuple:
+    """
+    The contact_columns function turns the comma separated field names of a ?fields= parameter into the columns to select.
+        The id is always selected, it identifies the contact and is the pagination cursor. Order follows CONTACT_COLUMNS.
+
+    :param fields: str | None: Field names such as 'first_name,phone', None or empty for all fields
+    :return: A tuple of columns
+    :raises ValueError: If a name is not a field of ContactResponse
+    """
+    if not fields:
+        return CONTACT_COLUMNS
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = names - CONTACT_FIELDS.keys()
+    if unknown:
+        raise ValueError(', '.join(sorted(unknown)))
+    return tuple(column for column in CONTACT_COLUMNS if column.key == 'id' or column.key in names)
+
+
+def encode_cursor(contact_id: int) -> str:
+    """
+    The encode_cursor function turns the id of the last contact on a page into an opaque pagination token.
+
+    :param contact_id: int: The id of the last contact returned
+    :return: A url safe cursor string
+    """
+    return urlsafe_b64encode(f'id:{contact_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
     """
-    The get_contacts function returns a list of contacts for the user.
+    The decode_cursor function reads the contact id back out of a token made by encode_cursor.
+
+    :param cursor: str: The cursor sent by the client
+    :return: The id after which the next page starts
+    :raises ValueError: If the cursor is malformed
+    """
+    try:
+        prefix, contact_id = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split(':')
+    except (binascii.Error, UnicodeDecodeError) as err:
+        raise ValueError(cursor) from err
+    if prefix != 'id':
+        raise ValueError(cursor)
+    return int(contact_id)
+
+
+async def get_contacts(skip: int, limit: int, user: User, db: AsyncSession, after_id: int | None = None,
+                       columns: tuple = CONTACT_COLUMNS) -> Sequence[Row]:
+    """
+    The get_contacts function returns a list of contacts for the user, as plain rows of the selected columns.
+        Contacts are ordered by id. When after_id is given the page starts right after that contact (keyset pagination),
+        which is a range scan on the (user_id, id) index and costs the same for every page. Otherwise skip is used as an offset.
     
     
     :param skip: int: Skip the first n records
     :param limit: int: Limit the number of contacts returned
     :param user: User: Get the user_id from the user model
-    :param db: Session: Access the database
-    :return: A list of contacts
+    :param db: AsyncSession: Access the database
+    :param after_id: int | None: Id of the last contact of the previous page
+    :param columns: tuple: Columns to select, see contact_columns
+    :return: A list of contact rows
     """
-    return db.query(Contact).filter(Contact.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(*columns).filter(Contact.user_id == user.id).order_by(Contact.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.filter(Contact.id > after_id)
+    else:
+        stmt = stmt.offset(skip)
+    return (await db.execute(stmt)).all()
 
-async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
+async def stream_contacts(user: User, db: AsyncSession, batch_size: int = 500) -> AsyncIterator[Sequence[Row]]:
+    """
+    The stream_contacts function yields all contacts of the user in batches of plain rows, ordered by id.
+        Rows come from a server side cursor and no ORM objects are built, so memory stays flat for any address book size.
+    
+    :param user: User: Get the user_id from the user model
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: How many rows are fetched from the cursor at a time
+    :return: An async iterator of row batches with the id, first_name, last_name, email, phone and birthday columns
+    """
+    stmt = select(*CONTACT_COLUMNS).filter(Contact.user_id == user.id).order_by(Contact.id) \
+        .execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for partition in result.partitions():
+        yield partition
+
+async def get_contact(contact_id: int, user: User, db: AsyncSession) -> Contact:
     """
     The get_contact function returns a contact from the database.
         Args:
             contact_id (int): The id of the contact to be returned.
             user (User): The user who owns the requested Contact object.
-            db (Session): A database session for querying and updating data in a relational database.
+            db (AsyncSession): A database session for querying and updating data in a relational database.
     
     :param contact_id: int: Get the contact with that id
     :param user: User: Get the user_id of the contact
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object
     """
-    return db.query(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)).first()
+    return await db.scalar(select(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)))
+
+async def read_contact(contact_id: int, user: User, db: AsyncSession, columns: tuple = CONTACT_COLUMNS) -> Row | None:
+    """
+    The read_contact function returns the selected columns of a contact as a plain row, for responses.
+        Use get_contact to change the contact.
+
+    :param contact_id: int: Get the contact with that id
+    :param user: User: Get the user_id of the contact
+    :param db: AsyncSession: Access the database
+    :param columns: tuple: Columns to select, see contact_columns
+    :return: A contact row, or None
+    """
+    stmt = select(*columns).filter(and_(Contact.user_id == user.id, Contact.id == contact_id))
+    return (await db.execute(stmt)).first()
 
-async def get_contacts_by_fname(first_name: str, user: User, db: Session) -> List[Contact]:
+async def get_contact_updated_at(contact_id: int, user: User, db: AsyncSession) -> datetime | None:
+    """
+    The get_contact_updated_at function returns when a contact last changed, without loading the contact.
+        It is the version of the contact in its ETag.
+
+    :param contact_id: int: Get the contact with that id
+    :param user: User: Get the user_id of the contact
+    :param db: AsyncSession: Access the database
+    :return: The updated_at of the contact, or None if the user has no such contact
+    """
+    return await db.scalar(select(Contact.updated_at).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)))
+
+async def get_contacts_version(user: User, db: AsyncSession) -> int:
+    """
+    The get_contacts_version function returns the contacts_version of the user, which changes with every write
+        to the user's contacts. It is the version of the list ETags.
+
+    :param user: User: Get the id of the user
+    :param db: AsyncSession: Access the database
+    :return: The current version
+    """
+    return await db.scalar(select(User.contacts_version).filter(User.id == user.id)) or 0
+
+async def _bump_contacts_version(user: User, db: AsyncSession) -> None:
+    # the first statement of every write: the version and the contacts change in one transaction, and the row lock
+    # on the user serializes the writes of a user. updated_at and deleted_at are taken from the database clock
+    # by the statements after it, so they follow the commit order of the user's writes whichever host sent them
+    await db.execute(update(User).filter(User.id == user.id).values(contacts_version=User.contacts_version + 1)
+                     .execution_options(synchronize_session=False))
+
+async def _changed(user: User, op: str, ids: List[int]) -> None:
+    # after the commit: drop the cached reads of the user and tell the user's other devices
+    await contacts_cache.invalidate(user.id)
+    await contact_events.publish(user.id, op, ids)
+
+async def get_contacts_by_fname(first_name: str, user: User, db: AsyncSession) -> Sequence[Row]:
     """
     The get_contacts_by_fname function returns a list of contacts that match the first name provided.
         
     
     :param first_name: str: Filter the contacts by first name
     :param user: User: Get the user_id from the user object
-    :param db: Session: Pass the database session to the function
-    :return: A list of contacts with the matching first name
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list of contact rows with the matching first name
     """
-    return db.query(Contact).filter(and_(Contact.user_id == user.id, func.lower(Contact.first_name).like(f'%{first_name.lower()}%'))).all()
+    stmt = select(*CONTACT_COLUMNS).filter(and_(Contact.user_id == user.id, func.lower(Contact.first_name).like(f'%{first_name.lower()}%')))
+    return (await db.execute(stmt)).all()
 
-async def get_contacts_by_lname(last_name: str, user: User, db: Session) -> List[Contact]:
+async def get_contacts_by_lname(last_name: str, user: User, db: AsyncSession) -> Sequence[Row]:
     """
     The get_contacts_by_lname function returns a list of contacts that match the last name provided.
         
     
     :param last_name: str: Define the last name of the contact you are searching for
     :param user: User: Get the user_id from the user object
-    :param db: Session: Access the database
-    :return: A list of contacts with the last name matching the query
+    :param db: AsyncSession: Access the database
+    :return: A list of contact rows with the last name matching the query
     """
-    return db.query(Contact).filter(and_(Contact.user_id == user.id, func.lower(Contact.last_name).like(f'%{last_name.lower()}%'))).all()
+    stmt = select(*CONTACT_COLUMNS).filter(and_(Contact.user_id == user.id, func.lower(Contact.last_name).like(f'%{last_name.lower()}%')))
+    return (await db.execute(stmt)).all()
     
 
-async def get_contacts_by_email(email: str, user: User, db: Session) -> List[Contact]:
+async def get_contacts_by_email(email: str, user: User, db: AsyncSession) -> Sequence[Row]:
     """
     The get_contacts_by_email function returns a list of contacts that match the email provided.
         
     
     :param email: str: Filter the contacts by email
     :param user: User: Get the user id from the database
-    :param db: Session: Access the database
-    :return: A list of contacts that match the email
+    :param db: AsyncSession: Access the database
+    :return: A list of contact rows that match the email
     :doc-author: Trelent
     """
-    return db.query(Contact).filter(and_(Contact.user_id == user.id, Contact.email.like(f'%{email}%'))).all()
+    stmt = select(*CONTACT_COLUMNS).filter(and_(Contact.user_id == user.id, Contact.email.like(f'%{email}%')))
+    return (await db.execute(stmt)).all()
+
+def search_terms(query: str) -> List[str]:
+    """
+    The search_terms function splits a search query into lower case word terms.
+        Anything that is not a letter or digit separates terms, so user input never reaches the full text query syntax.
+
+    :param query: str: The raw search string
+    :return: A list of terms
+    """
+    return re.findall(r'[^\W_]+', query.lower())
+
+
+async def search_contacts(query: str, limit: int, user: User, db: AsyncSession,
+                          columns: tuple = CONTACT_COLUMNS) -> Sequence[Row]:
+    """
+    The search_contacts function finds the user's contacts whose first name, last name, email or phone contain words
+    starting with every term of the query, best matches first.
+        On PostgreSQL it matches the GIN indexed tsvector of the contact, on SQLite the contacts_fts FTS5 table.
+        Names weigh more than the email, and the email more than the phone.
 
-async def get_contacts_by_birthday(user: User, db: Session) -> List[Contact]:
+    :param query: str: The search string
+    :param limit: int: Limit the number of contacts returned
+    :param user: User: Get the user_id from the user model
+    :param db: AsyncSession: Access the database
+    :param columns: tuple: Columns to select, see contact_columns
+    :return: A list of contact rows ordered by rank
     """
-    The get_contacts_by_birthday function returns a list of contacts whose birthday is within the next week.
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if db.get_bind().dialect.name == 'sqlite':
+        fts = table('contacts_fts', column('rowid'))
+        rank = func.bm25(literal_column('contacts_fts'), 10.0, 10.0, 5.0, 1.0)
+        stmt = select(*columns).join(fts, fts.c.rowid == Contact.id).filter(and_(Contact.user_id == user.id,
+            literal_column('contacts_fts').op('MATCH')(' '.join(f'"{term}"*' for term in terms)),
+        )).order_by(rank, Contact.id)
+    else:
+        vector = contact_search_vector(Contact.first_name, Contact.last_name, Contact.email, Contact.phone)
+        tsquery = func.to_tsquery(literal_column("'simple'"), ' & '.join(f'{term}:*' for term in terms))
+        stmt = select(*columns).filter(and_(Contact.user_id == user.id, vector.op('@@')(tsquery))) \
+            .order_by(func.ts_rank(vector, tsquery).desc(), Contact.id)
+    return (await db.execute(stmt.limit(limit))).all()
+
+
+def birthday_ordinal(birthday: date | None) -> int | None:
+    """
+    The birthday_ordinal function maps a birthday to month * 100 + day, e.g. 14 March becomes 314.
+        The value ignores the year and sorts in calendar order, which is what the indexed birthday_ordinal column stores.
+
+    :param birthday: date | None: The birthday of a contact
+    :return: The ordinal of the birthday, or None when the birthday is unknown
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+
+def birthday_today() -> date:
+    """
+    The birthday_today function returns the day birthday windows start from, the current UTC date.
+        The birthday route and the birthday digest job both ask it, so they agree on the day around midnight.
+
+    :return: The current UTC date
+    """
+    return datetime.utcnow().date()
+
+
+def birthday_windows(start: date, days: int) -> List[Tuple[int, int]]:
+    """
+    The birthday_windows function returns the inclusive birthday_ordinal ranges covering start and the following days.
+        A window that runs past 31 December is split in two, one range up to the end of the year
+        and one from 1 January, so the wrap-around stays a pair of index range scans.
+
+    :param start: date: The first day of the window
+    :param days: int: How many days after start the window reaches
+    :return: A list of (low, high) ordinal ranges
+    """
+    if days >= 365:
+        return [(101, 1231)]
+    low = birthday_ordinal(start)
+    high = birthday_ordinal(start + timedelta(days=days))
+    if low <= high:
+        return [(low, high)]
+    return [(low, 1231), (101, high)]
+
+
+async def get_contacts_by_birthday(user: User, db: AsyncSession, days: int = 7,
+                                   today: date | None = None) -> Sequence[Row]:
+    """
+    The get_contacts_by_birthday function returns a list of contacts whose birthday is within the next days.
+        The lookup runs on the (user_id, birthday_ordinal) index and handles windows crossing the end of a month or year,
+        contacts are ordered by how soon their birthday comes.
     
     
     :param user: User: Get the user's id, which is used to filter out contacts that belong to other users
-    :param db: Session: Pass in the database session
-    :return: A list of contacts whose birthday is within the next 7 days
+    :param db: AsyncSession: Pass in the database session
+    :param days: int: Size of the window in days, today included
+    :param today: date | None: The first day of the window, defaults to birthday_today
+    :return: A list of contact rows whose birthday is within the next days
     """
-    today = datetime.today().date()
-    next_week = today + timedelta(days=7)
+    windows = birthday_windows(today or birthday_today(), days)
 
-    contacts = db.query(Contact).filter(and_(Contact.user_id == user.id, 
-        extract('month', Contact.birthday) == next_week.month,
-        extract('day', Contact.birthday) <= next_week.day,
-        extract('day', Contact.birthday) >= today.day,
-    )).all()
+    stmt = select(*CONTACT_COLUMNS).filter(and_(Contact.user_id == user.id,
+        or_(*(Contact.birthday_ordinal.between(low, high) for low, high in windows)),
+    )).order_by(Contact.birthday_ordinal < windows[0][0], Contact.birthday_ordinal)
+    return (await db.execute(stmt)).all()
 
-    upcoming_birthday_contacts = []
-    for contact in contacts:
-        bday_this_year = contact.birthday.replace(year=today.year)
-        if bday_this_year >= today:
-            upcoming_birthday_contacts.append(contact)
-    return upcoming_birthday_contacts
+async def stream_upcoming_birthdays(start: date, days: int, db: AsyncSession, after_user_id: int = 0,
+                                    batch_size: int = 2000) -> AsyncIterator[Sequence[Row]]:
+    """
+    The stream_upcoming_birthdays function yields the contacts of all confirmed users whose birthday is within the window,
+        in batches of plain rows ordered by user_id and birthday_ordinal. That is the order of the (user_id, birthday_ordinal)
+        index, so the whole table is read in one pass from a server side cursor, without a sort and with flat memory.
+        Within a user the rows come in calendar order, a window crossing 31 December starts with the January rows.
+
+    :param start: date: The first day of the window
+    :param days: int: How many days after start the window reaches
+    :param db: AsyncSession: Access the database
+    :param after_user_id: int: Only users with a larger id are read, to resume an interrupted run
+    :param batch_size: int: How many rows are fetched from the cursor at a time
+    :return: An async iterator of row batches with the user_id, email, username, first_name, last_name, birthday
+        and birthday_ordinal columns
+    """
+    windows = birthday_windows(start, days)
+    stmt = select(Contact.user_id, User.email, User.username, Contact.first_name, Contact.last_name, Contact.birthday,
+                  Contact.birthday_ordinal) \
+        .join(User, User.id == Contact.user_id) \
+        .filter(Contact.user_id > after_user_id, User.confirmed.is_(True),
+                or_(*(Contact.birthday_ordinal.between(low, high) for low, high in windows))) \
+        .order_by(Contact.user_id, Contact.birthday_ordinal).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    async for partition in result.partitions():
+        yield partition
 
-async def create_contact(body: ContactModel, user: User, db: Session) -> Contact:
+async def create_contact(body: ContactModel, user: User, db: AsyncSession) -> Contact:
     """
     The create_contact function creates a new contact in the database.
         
     
     :param body: ContactModel: Pass in the json data from the request body
     :param user: User: Get the user_id from the user model
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = Contact(first_name=body.first_name, last_name=body.last_name, email=body.email, phone=body.phone, birthday=body.birthday, user_id=user.id)
+    await _bump_contacts_version(user, db)
+    contact = Contact(first_name=body.first_name, last_name=body.last_name, email=body.email, phone=body.phone, birthday=body.birthday,
+                      birthday_ordinal=birthday_ordinal(body.birthday), user_id=user.id)
     db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    await db.commit()
+    await db.refresh(contact)
+    await _changed(user, 'create', [contact.id])
+    return contact
+
+def contact_values(body: BaseModel, exclude_unset: bool = False) -> dict:
+    """
+    The contact_values function turns a contact body into column values, adding the birthday_ordinal of the birthday.
+
+    :param body: BaseModel: ContactModel, ContactUpdate or ContactPatch
+    :param exclude_unset: bool: Leave out the fields the client did not send
+    :return: A dict of column values
+    """
+    values = body.dict(exclude_unset=exclude_unset)
+    if 'birthday' in values:
+        values['birthday_ordinal'] = birthday_ordinal(values['birthday'])
+    return values
+
+
+async def create_contacts(bodies: List[ContactModel], user: User, db: AsyncSession) -> int:
+    """
+    The create_contacts function inserts many contacts with one batched INSERT statement and commits them.
+        
+    
+    :param bodies: List[ContactModel]: Validated contacts to insert
+    :param user: User: Get the user_id from the user model
+    :param db: AsyncSession: Connect to the database
+    :return: The number of contacts inserted
+    """
+    if not bodies:
+        return 0
+    await _bump_contacts_version(user, db)
+    values = [dict(contact_values(body), user_id=user.id) for body in bodies]
+    created = []
+    if db.get_bind().dialect.insert_executemany_returning:
+        created = (await db.scalars(insert(Contact).returning(Contact.id), values)).all()
+    else:
+        # the ids of a batch are not known without RETURNING, the event carries none and the devices resync
+        await db.execute(insert(Contact), values)
+    await db.commit()
+    await _changed(user, 'create', created)
+    return len(bodies)
+
+async def update_contact_values(contact_id: int, values: dict, user: User, db: AsyncSession) -> Contact | None:
+    """
+    The update_contact_values function changes the given columns of one contact with a single UPDATE ... RETURNING.
+        Backends without RETURNING get the same result from an UPDATE followed by a SELECT of the changed row.
+
+    :param contact_id: int: Identify which contact to update
+    :param values: dict: Column values to set
+    :param user: User: Get the user id of the current user
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The updated contact, or None if the user has no such contact
+    """
+    if not values:
+        return await get_contact(contact_id, user, db)
+    await _bump_contacts_version(user, db)
+    stmt = update(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)).values(**values) \
+        .execution_options(synchronize_session=False)
+    if db.get_bind().dialect.update_returning:
+        contact = await db.scalar(stmt.returning(Contact))
+    else:
+        result = await db.execute(stmt)
+        contact = await db.scalar(select(Contact).filter(Contact.id == contact_id)
+                                  .execution_options(populate_existing=True)) if result.rowcount else None
+    if contact is None:
+        await db.rollback()
+        return None
+    await db.commit()
+    await _changed(user, 'update', [contact.id])
     return contact
 
-async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: Session) -> Contact | None:
+
+async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: AsyncSession) -> Contact | None:
     """
     The update_contact function updates a contact in the database.
         Args:
@@ -130,39 +465,247 @@ async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: S
     :param note_id: int: Identify which contact to update
     :param body: ContactUpdate: Pass the json data to the function
     :param user: User: Get the user id of the current user
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A contact object, which is a model
     """
-    contact = db.query(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)).first()
-    if contact:
-        contact.first_name = body.first_name
-        contact.last_name = body.last_name
-        contact.email = body.email
-        contact.phone = body.phone
-        contact.birthday = body.birthday
-        db.commit()
-    return contact
+    return await update_contact_values(contact_id, contact_values(body), user, db)
+
+
+async def patch_contact(contact_id: int, body: ContactPatch, user: User, db: AsyncSession) -> Contact | None:
+    """
+    The patch_contact function updates only the fields of a contact that are present in the request body.
+    
+    :param contact_id: int: Identify which contact to update
+    :param body: ContactPatch: The fields to change
+    :param user: User: Get the user id of the current user
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The updated contact, or None if the user has no such contact
+    """
+    return await update_contact_values(contact_id, contact_values(body, exclude_unset=True), user, db)
+
 
-async def remove_contact(contact_id: int, user: User, db: Session) -> Contact | None:
+async def remove_contact(contact_id: int, user: User, db: AsyncSession, retention_days: int = 30) -> Contact | None:
     """
     The remove_contact function removes a contact from the database.
+        It is a single DELETE ... RETURNING, backends without RETURNING select the row before deleting it.
+        The deleted contact leaves a tombstone for the changes feed.
         Args:
             contact_id (int): The id of the contact to be removed.
             user (User): The user who owns the contacts list.
-            db (Session): A session object for interacting with a SQLAlchemy database engine.
+            db (AsyncSession): A session object for interacting with a SQLAlchemy database engine.
         Returns: 
             Contact | None: If successful, returns an instance of Contact; otherwise, returns None.
     
     :param contact_id: int: Identify the contact to be removed
     :param user: User: Get the user_id from the user object
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param retention_days: int: Tombstones older than this are dropped
     :return: A contact object
     """
-    contact = db.query(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)).first()
-    if contact:
-        db.delete(contact)
-        db.commit()
+    await _bump_contacts_version(user, db)
+    stmt = delete(Contact).filter(and_(Contact.user_id == user.id, Contact.id == contact_id)) \
+        .execution_options(synchronize_session=False)
+    if db.get_bind().dialect.delete_returning:
+        contact = await db.scalar(stmt.returning(Contact))
+    else:
+        contact = await get_contact(contact_id, user, db)
+        if contact:
+            await db.execute(stmt)
+    if contact is None:
+        await db.rollback()
+        return None
+    await _add_tombstones([contact.id], user, db, retention_days)
+    await db.commit()
+    await _changed(user, 'delete', [contact.id])
     return contact
 
 
+async def _add_tombstones(contact_ids: List[int], user: User, db: AsyncSession, retention_days: int) -> None:
+    # written in the transaction of the delete; the user's tombstones past the retention go at the same time,
+    # and get_contact_changes refuses the sync tokens from before the newest of them
+    await db.execute(insert(ContactTombstone), [{'contact_id': contact_id, 'user_id': user.id} for contact_id in contact_ids])
+    expired = and_(ContactTombstone.user_id == user.id,
+                   ContactTombstone.deleted_at < datetime.utcnow() - timedelta(days=retention_days))
+    purged_until = await db.scalar(select(func.max(ContactTombstone.deleted_at)).filter(expired))
+    if purged_until is None:
+        return
+    await db.execute(delete(ContactTombstone).filter(expired).execution_options(synchronize_session=False))
+    await db.execute(update(User).filter(User.id == user.id).values(tombstones_purged_until=purged_until)
+                     .execution_options(synchronize_session=False))
+
+
+def _id_chunks(ids: List[int], chunk_size: int) -> Iterator[List[int]]:
+    # sorted, so concurrent bulk calls lock rows in the same order
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size]
+
+
+async def update_contacts(ids: List[int], body: ContactPatch, user: User, db: AsyncSession, chunk_size: int) -> int:
+    """
+    The update_contacts function applies the same changes to many contacts of the user.
+        Every chunk of ids is one set based UPDATE ... WHERE user_id = :u AND id IN (...) committed on its own,
+        so a large request never holds row locks for long. Ids of other users' contacts are ignored.
+    
+    :param ids: List[int]: Ids of the contacts to update
+    :param body: ContactPatch: The fields to change
+    :param user: User: Get the user id of the current user
+    :param db: AsyncSession: Pass the database session to the function
+    :param chunk_size: int: How many contacts one statement updates at most
+    :return: The number of updated contacts
+    """
+    values = contact_values(body, exclude_unset=True)
+    if not values:
+        return 0
+    affected = 0
+    for chunk in _id_chunks(ids, chunk_size):
+        await _bump_contacts_version(user, db)
+        condition = and_(Contact.user_id == user.id, Contact.id.in_(chunk))
+        stmt = update(Contact).filter(condition).values(**values).execution_options(synchronize_session=False)
+        if db.get_bind().dialect.update_returning:
+            updated = (await db.execute(stmt.returning(Contact.id))).scalars().all()
+        else:
+            updated = (await db.scalars(select(Contact.id).filter(condition))).all()
+            if updated:
+                await db.execute(stmt)
+        if not updated:
+            await db.rollback()
+            continue
+        await db.commit()
+        await _changed(user, 'update', updated)
+        affected += len(updated)
+    return affected
+
+
+async def remove_contacts(ids: List[int], user: User, db: AsyncSession, chunk_size: int, retention_days: int = 30) -> int:
+    """
+    The remove_contacts function deletes many contacts of the user.
+        Every chunk of ids is one set based DELETE committed on its own. Ids of other users' contacts are ignored.
+        Deleted contacts leave tombstones for the changes feed.
+    
+    :param ids: List[int]: Ids of the contacts to delete
+    :param user: User: Get the user id of the current user
+    :param db: AsyncSession: Pass the database session to the function
+    :param chunk_size: int: How many contacts one statement deletes at most
+    :param retention_days: int: Tombstones older than this are dropped
+    :return: The number of deleted contacts
+    """
+    affected = 0
+    for chunk in _id_chunks(ids, chunk_size):
+        await _bump_contacts_version(user, db)
+        condition = and_(Contact.user_id == user.id, Contact.id.in_(chunk))
+        stmt = delete(Contact).filter(condition).execution_options(synchronize_session=False)
+        if db.get_bind().dialect.delete_returning:
+            deleted = (await db.execute(stmt.returning(Contact.id))).scalars().all()
+        else:
+            deleted = (await db.scalars(select(Contact.id).filter(condition))).all()
+            if deleted:
+                await db.execute(stmt)
+        if not deleted:
+            await db.rollback()
+            continue
+        await _add_tombstones(deleted, user, db, retention_days)
+        await db.commit()
+        await _changed(user, 'delete', deleted)
+        affected += len(deleted)
+    return affected
+
+
+def encode_sync_token(position: ChangePosition) -> str:
+    """
+    The encode_sync_token function turns a position in the changes feed into an opaque token for the client.
+
+    :param position: ChangePosition: The position after the last change the client received
+    :return: A url safe token string
+    """
+    micros = (position.changed_at - SYNC_EPOCH) // timedelta(microseconds=1)
+    raw = f'sync:{position.version}:{micros}:{position.kind}:{position.id}'
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_sync_token(token: str) -> ChangePosition:
+    """
+    The decode_sync_token function reads the position back out of a token made by encode_sync_token.
+
+    :param token: str: The since parameter sent by the client
+    :return: The position to continue from
+    :raises ValueError: If the token is malformed
+    """
+    try:
+        prefix, version, micros, kind, row_id = urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().split(':')
+    except (binascii.Error, UnicodeDecodeError) as err:
+        raise ValueError(token) from err
+    if prefix != 'sync' or int(kind) not in (CHANGE_UPSERT, CHANGE_DELETE):
+        raise ValueError(token)
+    return ChangePosition(int(version), SYNC_EPOCH + timedelta(microseconds=int(micros)), int(kind), int(row_id))
+
+
+def _after(changed_at, row_id, kind: int, position: ChangePosition):
+    # the events of one kind that come after the position in (changed_at, kind, id) order
+    if kind < position.kind:
+        return changed_at > position.changed_at
+    if kind > position.kind:
+        return changed_at >= position.changed_at
+    return or_(changed_at > position.changed_at, and_(changed_at == position.changed_at, row_id > position.id))
+
+
+async def get_contact_changes(since: ChangePosition | None, limit: int, user: User, db: AsyncSession) -> ChangesPage:
+    """
+    The get_contact_changes function returns the contacts of the user created, changed or deleted after a position.
+        Upserts are read from the (user_id, updated_at) index and deletions from the tombstones, both as keyset scans
+        merged by one UNION ALL in (changed_at, kind, id) order. When the contacts_version of the user still equals the one in the
+        position nothing has changed, and the answer costs only that lookup.
+        Within a page only the last event of a contact counts, so a contact is either upserted or deleted.
+
+    :param since: ChangePosition | None: Where the previous page ended, None for a full sync
+    :param limit: int: The number of events per page
+    :param user: User: Get the user_id from the user model
+    :param db: AsyncSession: Access the database
+    :return: The fields of the upserted contacts, the deleted contact ids, the next position and whether more changes follow
+    :raises SyncTokenExpired: If something changed since the position and a tombstone after it was purged
+    """
+    version = await get_contacts_version(user, db)
+    if since is not None and since.version == version:
+        return ChangesPage([], [], since, False)
+    if since is not None:
+        purged_until = await db.scalar(select(User.tombstones_purged_until).filter(User.id == user.id))
+        # a tombstone at the very time of the position may come after it, so that one counts as missed too
+        if purged_until is not None and since.changed_at <= purged_until:
+            raise SyncTokenExpired()
+    position = since or ChangePosition(-1, SYNC_EPOCH, CHANGE_UPSERT, 0)
+
+    # one statement, so both scans read the same snapshot: with two, a write committed in between could put
+    # a tombstone after an upsert that the first scan missed, and the position would skip that upsert for good
+    upserts = select(literal_column(str(CHANGE_UPSERT)).label('kind'), Contact.id.label('row_id'), *CONTACT_COLUMNS,
+                     Contact.updated_at) \
+        .filter(Contact.user_id == user.id, _after(Contact.updated_at, Contact.id, CHANGE_UPSERT, position)) \
+        .order_by(Contact.updated_at, Contact.id).limit(limit + 1).subquery()
+    tombstones = select(literal_column(str(CHANGE_DELETE)).label('kind'), ContactTombstone.id.label('row_id'),
+                        ContactTombstone.contact_id.label('id'),
+                        *(cast(null(), column.type).label(column.key) for column in CONTACT_COLUMNS[1:]),
+                        ContactTombstone.deleted_at.label('updated_at')) \
+        .filter(ContactTombstone.user_id == user.id,
+                _after(ContactTombstone.deleted_at, ContactTombstone.id, CHANGE_DELETE, position)) \
+        .order_by(ContactTombstone.deleted_at, ContactTombstone.id).limit(limit + 1).subquery()
+    changes = union_all(select(upserts), select(tombstones))
+    events = (await db.execute(
+        changes.order_by(changes.selected_columns.updated_at, changes.selected_columns.kind,
+                         changes.selected_columns.row_id).limit(limit + 1)
+    )).all()
+    more = len(events) > limit
+    events = events[:limit]
 
+    # the fields of ContactChange, a deletion leaves them empty but for the id of the contact
+    keys = [column.key for column in CONTACT_COLUMNS] + ['updated_at']
+    latest = {}
+    for event in events:
+        latest[event.id] = event
+    page_upserts = [{key: event._mapping[key] for key in keys} for event in latest.values() if event.kind == CHANGE_UPSERT]
+    page_deleted = [event.id for event in latest.values() if event.kind == CHANGE_DELETE]
+    if events:
+        last = events[-1]
+        # a version is only handed out with the last page, before that the next call has to read on
+        position = ChangePosition(-1 if more else version, last.updated_at, last.kind, last.row_id)
+    else:
+        position = position._replace(version=version)
+    return ChangesPage(page_upserts, page_deleted, position, more)
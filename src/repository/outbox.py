@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import EmailOutbox
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# INSERT ... ON CONFLICT DO NOTHING of the dialects that have it
+INSERT_IGNORING_CONFLICTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def enqueue_email(kind: str, recipient: str, payload: dict, db: AsyncSession) -> EmailOutbox:
+    """
+    The enqueue_email function adds a message to the outbox without committing.
+        The message is stored by the commit of the caller, so it is written in the same transaction as the change
+        that caused it and is never lost or sent for a change that was rolled back.
+
+    :param kind: str: Name of the message builder, e.g. confirm_email
+    :param recipient: str: Email address of the recipient
+    :param payload: dict: Values for the message template
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The new outbox row
+    """
+    message = EmailOutbox(kind=kind, recipient=recipient, payload=payload, status=PENDING, attempts=0,
+                          next_attempt_at=datetime.utcnow())
+    db.add(message)
+    return message
+
+
+async def enqueue_emails_once(kind: str, messages: List[Tuple[str, str, dict]], db: AsyncSession) -> int:
+    """
+    The enqueue_emails_once function adds the messages whose dedupe key is not in the outbox yet and commits.
+        The key is unique in the table, so a job that runs twice for the same day, or two instances of it
+        running at once, queue every message only once.
+
+    :param kind: str: Name of the message builder, e.g. birthday_digest
+    :param messages: List[Tuple[str, str, dict]]: Dedupe key, recipient and payload of every message
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The number of messages added
+    """
+    if not messages:
+        return 0
+    now = datetime.utcnow()
+    rows = [dict(kind=kind, recipient=recipient, payload=payload, status=PENDING, attempts=0, next_attempt_at=now,
+                 created_at=now, dedupe_key=key) for key, recipient, payload in messages]
+    make_insert = INSERT_IGNORING_CONFLICTS.get(db.get_bind().dialect.name)
+    if make_insert is not None:
+        result = await db.execute(make_insert(EmailOutbox).values(rows).on_conflict_do_nothing(
+            index_elements=[EmailOutbox.dedupe_key]))
+        added = result.rowcount
+    else:
+        # without ON CONFLICT the unique index still rejects a key that a concurrent run added meanwhile
+        queued = set((await db.scalars(select(EmailOutbox.dedupe_key).where(
+            EmailOutbox.dedupe_key.in_([row['dedupe_key'] for row in rows])))).all())
+        rows = [row for row in rows if row['dedupe_key'] not in queued]
+        if rows:
+            await db.execute(insert(EmailOutbox), rows)
+        added = len(rows)
+    await db.commit()
+    return added
+
+
+async def claim_batch(limit: int, lease: float, db: AsyncSession, now: datetime | None = None) -> List[EmailOutbox]:
+    """
+    The claim_batch function leases the oldest due messages to the caller and commits.
+        Due are pending messages past their next attempt and messages whose lease ran out because the worker
+        sending them never reported back. The rows are marked sending until the lease ends, so the caller sends
+        them outside of any transaction and no other worker claims them meanwhile. On PostgreSQL rows that another
+        worker is claiming at the same moment are skipped.
+
+    :param limit: int: Maximum number of messages
+    :param lease: float: Seconds the messages stay with the caller
+    :param db: AsyncSession: Pass the database session to the function
+    :param now: datetime | None: The current time, defaults to utcnow
+    :return: A list of outbox rows
+    """
+    now = now or datetime.utcnow()
+    stmt = (
+        select(EmailOutbox)
+        .where(or_(and_(EmailOutbox.status == PENDING, EmailOutbox.next_attempt_at <= now),
+                   and_(EmailOutbox.status == SENDING, EmailOutbox.locked_until <= now)))
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    messages = list((await db.scalars(stmt)).all())
+    locked_until = now + timedelta(seconds=lease)
+    for message in messages:
+        message.status = SENDING
+        message.locked_until = locked_until
+    await db.commit()
+    return messages
+
+
+async def leased(messages: List[EmailOutbox], db: AsyncSession) -> List[EmailOutbox]:
+    """
+    The leased function loads the rows of claimed messages again to record how sending them went.
+        Rows whose lease ran out and that another worker claimed since then are left out.
+
+    :param messages: List[EmailOutbox]: The messages returned by claim_batch
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The rows still leased by the caller
+    """
+    claimed = {message.id: message.locked_until for message in messages}
+    stmt = (
+        select(EmailOutbox)
+        .where(EmailOutbox.id.in_(claimed), EmailOutbox.status == SENDING)
+        .with_for_update()
+    )
+    return [row for row in (await db.scalars(stmt)).all() if row.locked_until == claimed[row.id]]
+
+
+def mark_sent(message: EmailOutbox, now: datetime | None = None) -> None:
+    message.status = SENT
+    message.locked_until = None
+    message.attempts += 1
+    message.sent_at = now or datetime.utcnow()
+    message.last_error = None
+
+
+def mark_attempt_failed(message: EmailOutbox, error: str, max_attempts: int, backoff_base: float, backoff_max: float,
+                        now: datetime | None = None) -> None:
+    """
+    The mark_attempt_failed function schedules the next attempt of a message with exponential backoff,
+        or gives up on it after max_attempts.
+
+    :param message: EmailOutbox: The message that could not be sent
+    :param error: str: Description of the error
+    :param max_attempts: int: Attempts before the message is marked failed
+    :param backoff_base: float: Seconds before the second attempt, doubled for every further one
+    :param backoff_max: float: Upper bound of the delay in seconds
+    :param now: datetime | None: The current time, defaults to utcnow
+    :return: None
+    """
+    message.attempts += 1
+    message.last_error = error[:1000]
+    message.locked_until = None
+    if message.attempts >= max_attempts:
+        message.status = FAILED
+        return
+    message.status = PENDING
+    delay = min(backoff_base * 2 ** (message.attempts - 1), backoff_max)
+    message.next_attempt_at = (now or datetime.utcnow()) + timedelta(seconds=delay)
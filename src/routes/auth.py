@@ -1,14 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
+from fastapi import APIRouter, HTTPException, Depends, status, Security, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.services.email import send_email
 from src.database.connect_db import get_db
 from src.schemas import UserModel, UserResponse, TokenModel
 from src.repository import users as repository_users
+from src.repository import outbox as repository_outbox
 from src.services.auth import auth_service
+from src.services.rate_limit import rate_limit
 from src.conf.messages import (ALREADY_EXISTS, EMAIL_ALREADY_CONFIRMED, EMAIL_CONFIRMED,
-    EMAIL_NOT_CONFIRMED, INVALID_EMAIL, INVALID_PASSWORD, INVALID_TOKEN, SUCCESS_CREATE_USER,
+    EMAIL_NOT_CONFIRMED, INVALID_EMAIL, INVALID_PASSWORD, SUCCESS_CREATE_USER,
     VERIFICATION_ERROR)
 
 
@@ -17,35 +18,35 @@ security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse,  status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, request: Request, db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes an email, username and password as input parameters.
         The function then checks if the email is already registered with another account. If it is, it returns a 409 error code (conflict). 
         Otherwise, it hashes the password using bcrypt and stores both username and hashed password in the database.
+        The confirmation email is written to the outbox in the same transaction and sent by the outbox worker.
     
     :param body: UserModel: Get the user information from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the application
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A dict with two keys: user and detail
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=ALREADY_EXISTS)
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
+    repository_outbox.enqueue_email("confirm_email", body.email, {"username": body.username, "host": str(request.base_url)}, db)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
     return {"user": new_user, "detail": SUCCESS_CREATE_USER}
 
 
-@router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post("/login", response_model=TokenModel, dependencies=[rate_limit("login")])
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
     
     :param body: OAuth2PasswordRequestForm: Validate the request body
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A dict with the access_token, refresh_token and token type
     """
     user = await repository_users.get_user_by_email(body.username, db)
@@ -53,42 +54,46 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_EMAIL)
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=EMAIL_NOT_CONFIRMED)
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_PASSWORD)
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email}, expires_delta=7200)
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    sid, refresh_token = await auth_service.open_session(user.email)
+    access_token = await auth_service.create_access_token(data={"sub": user.email, "sid": sid}, expires_delta=7200)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """
     The refresh_token function is used to refresh the access token.
     It takes in a refresh token and returns an access_token, a new refresh_token, and the type of token (bearer).
-    
+    The session of the refresh token lives in the session store, so refreshing does not touch the database.
     
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Pass the database session to the function
     :return: A dictionary with the access_token, refresh_token and token_type
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_TOKEN)
-
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    email, sid, refresh_token = await auth_service.rotate_refresh_token(credentials.credentials)
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(credentials: HTTPAuthorizationCredentials = Security(security),
+                 claims: dict = Depends(auth_service.get_access_claims)):
+    """
+    The logout function revokes the access token of the request right away, instead of at its exp,
+    and ends the refresh token session of the device.
+
+    :param credentials: HTTPAuthorizationCredentials: Get the access token from the request header
+    :param claims: dict: The claims of the access token
+    :return: None
+    """
+    await auth_service.logout(credentials.credentials, claims)
+
+
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes in the token that was sent to the user's email and uses it to get their email address.
@@ -97,7 +102,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
         Finally, we set confirmed = True for them in our database.
 
     :param token: str: Get the token from the url
-    :param db: Session: Get the database connection
+    :param db: AsyncSession: Get the database connection
     :return: A dictionary with the message &quot;email confirmed&quot;
     """
 
@@ -1,154 +1,396 @@
-from typing import List
+from typing import Awaitable, Callable, List, Sequence
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, File, Header, Query, UploadFile, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.services.auth import auth_service
 from src.database.connect_db import get_db
-from src.schemas import ContactModel, ContactResponse
+from src.conf.config import settings
+from src.schemas import (ContactBulkDelete, ContactBulkResult, ContactBulkUpdate, ContactChanges, ContactImportReport,
+    ContactModel, ContactPatch, ContactResponse)
 from src.database.models import User
 from src.repository import contacts as repository_contacts
-from src.conf.messages import TOO_MANY_REQUESTS, NOT_FOUND
+from src.services import contacts_io
+from src.services.cache import contacts_cache
+from src.services.events import contact_events
+from src.services.rate_limit import rate_limit
+from src.services.responses import RowsJSONResponse, etag_matches, not_modified, weak_etag
+from src.conf.messages import (TOO_MANY_REQUESTS, NOT_FOUND, INVALID_CURSOR, UNSUPPORTED_IMPORT_FORMAT, TOO_MANY_IDS,
+    UNKNOWN_FIELDS, INVALID_SYNC_TOKEN, SYNC_TOKEN_EXPIRED)
 
 router = APIRouter(prefix='/contacts', tags=["contacts"])
 
 
-@router.get("/", response_model=List[ContactResponse]) 
-    # description=TOO_MANY_REQUESTS, dependencies=[Depends(RateLimiter(times=10, seconds=60))]
-async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+def selected_columns(fields: str | None = Query(default=None, example='first_name,phone',
+                     description='Comma separated fields to return, the id is always included')) -> tuple:
+    """
+    The selected_columns function is a dependency reading the ?fields= parameter into the columns to select,
+        so that only the requested columns are read from the database and written to the response.
+
+    :param fields: str | None: Comma separated field names, all fields when omitted
+    :return: A tuple of columns
+    """
+    try:
+        return repository_contacts.contact_columns(fields)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{UNKNOWN_FIELDS}: {err}")
+
+
+async def cached_rows(user: User, db: AsyncSession, if_none_match: str | None, route: str, params: dict,
+                      query: Callable[[], Awaitable[Sequence[Row]]],
+                      headers: Callable[[Sequence[Row]], dict] = lambda rows: {}) -> Response:
+    """
+    The cached_rows function answers a list route from the contacts cache, and runs query on a miss.
+        The ETag is built from the contacts_version of the user and the parameters. A client that sends the current one
+        in If-None-Match gets 304 Not Modified: on a cache hit without any query, on a miss after reading
+        only the version. An empty result is answered with 404 and is not cached.
+
+    :param user: User: The current user
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param if_none_match: str | None: The If-None-Match header of the request
+    :param route: str: Name of the route in the cache key
+    :param params: dict: Every parameter the result depends on
+    :param query: Callable[[], Awaitable[Sequence[Row]]]: Reads the rows from the database
+    :param headers: Callable[[Sequence[Row]], dict]: Extra response headers for the rows
+    :return: A JSON response with the rows, or 304
+    """
+    async def load() -> Response:
+        etag = weak_etag(route, await repository_contacts.get_contacts_version(user, db), params)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        contacts = await query()
+        if not contacts:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+        return RowsJSONResponse(contacts, headers={**headers(contacts), 'ETag': etag})
+
+    response = await contacts_cache.get_or_load(user.id, route, params, load)
+    # a cached response is current, its generation changes together with contacts_version
+    if response.status_code == 200 and etag_matches(if_none_match, response.headers['ETag']):
+        return not_modified(response.headers['ETag'])
+    return response
+
+
+@router.get("/", response_model=List[ContactResponse], description=TOO_MANY_REQUESTS,
+            dependencies=[rate_limit("read_contacts")])
+async def read_contacts(skip: int = 0, limit: int = 100, cursor: str | None = None,
+                    columns: tuple = Depends(selected_columns), if_none_match: str | None = Header(default=None),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contacts function returns a list of contacts.
         The function takes in an optional skip and limit parameter to paginate the results.
+        When a page is full, an opaque token for the next page is sent in the X-Next-Cursor header;
+        passing it back as cursor continues after the last contact, and skip is then ignored.
+        The fields parameter limits the columns that are read and returned. Pages are served from the contacts cache.
         
     
     :param skip: int: Skip the first n contacts
     :param limit: int: Limit the number of contacts returned
-    :param db: Session: Pass the database session to the repository layer
+    :param cursor: str | None: Token from the X-Next-Cursor header of the previous page
+    :param columns: tuple: Columns from the fields parameter
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user
     :return: A list of contact objects
     """
+    after_id = None
+    if cursor is not None:
+        try:
+            after_id = repository_contacts.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=INVALID_CURSOR)
+
+    def next_cursor(contacts: Sequence[Row]) -> dict:
+        if len(contacts) < limit:
+            return {}
+        return {'X-Next-Cursor': repository_contacts.encode_cursor(contacts[-1].id)}
+
+    params = {'skip': skip if after_id is None else 0, 'limit': limit, 'after_id': after_id,
+              'fields': [column.key for column in columns]}
+    return await cached_rows(current_user, db, if_none_match, 'read_contacts', params,
+                             lambda: repository_contacts.get_contacts(skip, limit, current_user,  db, after_id, columns),
+                             next_cursor)
+
+
+@router.get("/search", response_model=List[ContactResponse])
+async def search_contacts(q: str = Query(min_length=1, max_length=100), limit: int = Query(default=50, ge=1, le=100),
+                    columns: tuple = Depends(selected_columns), if_none_match: str | None = Header(default=None),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function searches the first name, last name, email and phone of the user's contacts at once.
+        Every word of the query has to start a word in one of those fields, the best ranked contacts come first.
     
-    contacts = await repository_contacts.get_contacts(skip, limit, current_user,  db)
-    if not contacts:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contacts
+    :param q: str: The search string
+    :param limit: int: Limit the number of contacts returned
+    :param columns: tuple: Columns from the fields parameter
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: A list of contacts ordered by relevance
+    """
+    params = {'q': ' '.join(repository_contacts.search_terms(q)), 'limit': limit,
+              'fields': [column.key for column in columns]}
+    return await cached_rows(current_user, db, if_none_match, 'search', params,
+                             lambda: repository_contacts.search_contacts(q, limit, current_user, db, columns))
 
 
-@router.get("/by_fname/{first_name}", response_model=List[ContactResponse])
-async def read_contacts_with_fname(first_name: str, db: Session = Depends(get_db),
+@router.get("/changes", response_model=ContactChanges)
+async def read_contact_changes(since: str | None = Query(default=None, description='The next token of the previous answer'),
+                    limit: int = Query(default=settings.contacts_sync_page_size, ge=1, le=1000),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The read_contact_changes function returns the contacts created, changed or deleted since the since token,
+        so a client keeps its copy of the address book in sync without downloading it again.
+        Without since every contact is returned. The client applies the upserts and deletions and sends next as since
+        on the following call, right away while more is true. A client that is up to date gets an empty answer
+        for the price of one lookup. Deletions are kept for contacts_sync_retention_days; a token from before
+        a deletion dropped since then is answered with 410 Gone and the client has to sync again without since.
+    
+    :param since: str | None: The next token of the previous answer
+    :param limit: int: The number of changes per answer
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: The upserted contacts, the ids of the deleted ones and the next token
+    """
+    position = None
+    if since is not None:
+        try:
+            position = repository_contacts.decode_sync_token(since)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=INVALID_SYNC_TOKEN)
+    try:
+        changes = await repository_contacts.get_contact_changes(position, limit, current_user, db)
+    except repository_contacts.SyncTokenExpired:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=SYNC_TOKEN_EXPIRED)
+    return RowsJSONResponse({'upserts': changes.upserts, 'deleted': changes.deleted,
+                             'next': repository_contacts.encode_sync_token(changes.position), 'more': changes.more})
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def contact_events_stream(db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
+    The contact_events_stream function pushes the changes of the user's contacts as server-sent events,
+        so other devices of the user learn about a change without polling. Every contacts event carries
+        the op (create, update or delete) and the ids of the contacts, then the client reads the changes
+        from /api/contacts/changes. After a resync event, and on the ready event that opens the stream,
+        the client reads /api/contacts/changes as well. Comments are sent as heartbeats.
+    
+    :param db: AsyncSession: The session of the authentication, closed before the stream starts
+    :param current_user: User: Get the current user
+    :return: A text/event-stream response that stays open
+    """
+    # the stream outlives the request, it must not keep a pooled database connection all that time
+    await db.close()
+    return StreamingResponse(contact_events.stream(current_user.id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contacts(format: str = Query(default='ndjson', regex='^(ndjson|csv|vcf)$'),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts function downloads the whole address book of the user as ndjson, csv or vCard.
+        Contacts are read from a server side cursor and every batch is encoded and sent as soon as it arrives.
+    
+    :param format: str: ndjson, csv or vcf
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: A streaming response with the encoded contacts
+    """
+    batches = repository_contacts.stream_contacts(current_user, db)
+    return StreamingResponse(contacts_io.export_contacts(batches, format),
+                             media_type=contacts_io.EXPORT_MEDIA_TYPES[format],
+                             headers={'Content-Disposition': f'attachment; filename="contacts.{format}"'})
+
+
+@router.get("/by_fname/{first_name}", response_model=List[ContactResponse])
+async def read_contacts_with_fname(first_name: str, if_none_match: str | None = Header(default=None),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
     The read_contacts_with_name function returns a list of contacts with the given first name.
         The function takes in a string representing the first name and returns a list of contacts.
     
     :param first_name: str: Pass the first name of a contact to be searched for
-    :param db: Session: Get the database connection
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Get the database connection
     :param current_user: User: Get the current user from the database
     :return: A list of contacts with the specified first name
     """
-    contacts = await repository_contacts.get_contacts_by_fname(first_name, current_user, db)
-    if not contacts:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contacts
+    return await cached_rows(current_user, db, if_none_match, 'by_fname', {'first_name': first_name.lower()},
+                             lambda: repository_contacts.get_contacts_by_fname(first_name, current_user, db))
 
 
 @router.get("/by_lname/{last_name}", response_model=List[ContactResponse])
-async def read_contacts_with_lname(last_name: str, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def read_contacts_with_lname(last_name: str, if_none_match: str | None = Header(default=None),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contacts_with_lname function returns a list of contacts with the specified last name.
         The function takes in a string representing the last name and returns a list of contacts.
     
     :param last_name: str: Pass the last name of the contact to be searched for
-    :param db: Session: Pass the database session to the repository layer
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the database
     :return: A list of contacts with the specified last name
     """
-    contacts = await repository_contacts.get_contacts_by_lname(last_name, current_user, db)
-    if not contacts:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contacts
+    return await cached_rows(current_user, db, if_none_match, 'by_lname', {'last_name': last_name.lower()},
+                             lambda: repository_contacts.get_contacts_by_lname(last_name, current_user, db))
 
 
 @router.get("/by_email/{email}", response_model=List[ContactResponse])
-async def read_contacts_with_email(email: str, db: Session = Depends(get_db),
-                    current_user: User = Depends(auth_service.get_current_user)):
+async def read_contacts_with_email(email: str, if_none_match: str | None = Header(default=None),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contacts_with_email function returns a list of contacts with the specified email address.
         The current_user is used to determine if the user has access to this information.
     
     :param email: str: Filter the contacts by email
-    :param db: Session: Pass the database session to the function
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the database
     :return: A list of contacts
     """
 
-    contacts = await repository_contacts.get_contacts_by_email(email, current_user,  db)
-    if not contacts:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contacts
+    return await cached_rows(current_user, db, if_none_match, 'by_email', {'email': email},
+                             lambda: repository_contacts.get_contacts_by_email(email, current_user,  db))
 
 
 @router.get("/by_id/{contact_id}", response_model=ContactResponse)
-async def read_contact(contact_id: int, db: Session = Depends(get_db),
+async def read_contact(contact_id: int, columns: tuple = Depends(selected_columns),
+                    if_none_match: str | None = Header(default=None), db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contact function returns a contact by its id.
         If the user is not logged in, it will return an error message.
         If the user is logged in but does not have access to this contact, it will return an error message.
+        The ETag comes from the updated_at of the contact, a matching If-None-Match is answered with 304
+        before the contact is read.
     
     :param contact_id: int: Identify the contact that is to be read
-    :param db: Session: Get the database session
+    :param columns: tuple: Columns from the fields parameter
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the auth_service
     :return: A contact object
     """
-    contact = await repository_contacts.get_contact(contact_id, current_user, db)
+    updated_at = await repository_contacts.get_contact_updated_at(contact_id, current_user, db)
+    if updated_at is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+    etag = weak_etag('contact', contact_id, updated_at, [column.key for column in columns])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    contact = await repository_contacts.read_contact(contact_id, current_user, db, columns)
     if not contact:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contact
+    return RowsJSONResponse(contact, headers={'ETag': etag})
     
     
 @router.get("/birthday/", response_model=List[ContactResponse])
-async def read_contact_by_birthday(db: Session = Depends(get_db),
+@router.get("/birthday", response_model=List[ContactResponse], include_in_schema=False)
+async def read_contact_by_birthday(days: int = Query(default=7, ge=0, le=366),
+                    if_none_match: str | None = Header(default=None), db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contact_by_birthday function returns a contact by birthday.
         Args:
-            db (Session, optional): SQLAlchemy Session. Defaults to Depends(get_db).
+            days (int): How many days ahead to look for birthdays. Defaults to 7.
+            db (AsyncSession, optional): SQLAlchemy Session. Defaults to Depends(get_db).
             current_user (User, optional): User object from auth_service.get_current_user(). Defaults to Depends(auth_service.get_current_user).
         Returns:
             Contact: A single contact object matching the birthday provided in the request body or an HTTP 404 error if no match is found.
     
-    :param db: Session: Pass the database session to the function
+    :param days: int: Size of the birthday window in days
+    :param if_none_match: str | None: ETag of the copy the client already has
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the database
     :return: A list of contacts
     """
-    contacts = await repository_contacts.get_contacts_by_birthday(current_user, db)
-    if not contacts :
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
-    return contacts
+    # the window moves with the date, so today is part of the key
+    today = repository_contacts.birthday_today()
+    return await cached_rows(current_user, db, if_none_match, 'birthday', {'days': days, 'today': today.isoformat()},
+                             lambda: repository_contacts.get_contacts_by_birthday(current_user, db, days, today))
     
 
 @router.post("/", response_model=ContactResponse)
-async def create_contact(body: ContactModel, db: Session = Depends(get_db),
+async def create_contact(body: ContactModel, db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_contact function creates a new contact in the database.
         The function takes a ContactModel object as input, and returns the newly created contact.
     
     :param body: ContactModel: Validate the data that is passed to the function
-    :param db: Session: Get the database connection from the dependency injection
+    :param db: AsyncSession: Get the database connection from the dependency injection
     :param current_user: User: Get the user_id from the token
     :return: A contactmodel object, which is a pydantic model
     """
     return await repository_contacts.create_contact(body, current_user,  db)
 
 
-@router.put("/{contact_id}", response_model=ContactResponse)
-#  description=TOO_MANY_REQUESTS,  dependencies=[Depends(RateLimiter(times=10, seconds=60))]
-async def update_contact(body: ContactModel, contact_id: int, db: Session = Depends(get_db),
+@router.post("/import", response_model=ContactImportReport)
+async def import_contacts(file: UploadFile = File(), format: str | None = Query(default=None, regex='^(csv|ndjson)$'),
+                    db: AsyncSession = Depends(get_db), current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The import_contacts function adds every contact of an uploaded csv or ndjson file to the user's address book.
+        The format is taken from the format parameter, or else from the file name or content type.
+        A csv file needs a header line with the ContactModel field names, ndjson has one JSON object per line.
+        Rows that do not validate are skipped and listed in the report with their row number.
+    
+    :param file: UploadFile: The csv or ndjson file
+    :param format: str | None: Force the format of the file
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user
+    :return: The import report
+    """
+    fmt = format or contacts_io.detect_format(file.filename, file.content_type)
+    if fmt not in contacts_io.IMPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=UNSUPPORTED_IMPORT_FORMAT)
+    return await contacts_io.import_contacts(contacts_io.decode_lines(file.file), fmt, current_user, db,
+                                             settings.contacts_import_chunk_size, settings.contacts_import_max_errors)
+
+
+@router.post("/bulk/update", response_model=ContactBulkResult)
+async def update_contacts(body: ContactBulkUpdate, db: AsyncSession = Depends(get_db),
+                    current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The update_contacts function applies the same changes to every listed contact of the current user.
+        Large requests are split into chunks that are committed one by one.
+    
+    :param body: ContactBulkUpdate: The contact ids and the fields to change
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the auth_service
+    :return: The number of updated contacts
+    """
+    if len(body.ids) > settings.contacts_bulk_max_ids:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=TOO_MANY_IDS)
+    affected = await repository_contacts.update_contacts(body.ids, body.changes, current_user, db,
+                                                         settings.contacts_bulk_chunk_size)
+    return {"affected": affected}
+
+
+@router.post("/bulk/delete", response_model=ContactBulkResult)
+async def remove_contacts(body: ContactBulkDelete, db: AsyncSession = Depends(get_db),
+                    current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The remove_contacts function deletes every listed contact of the current user.
+        Large requests are split into chunks that are committed one by one.
+    
+    :param body: ContactBulkDelete: The contact ids
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the auth_service
+    :return: The number of deleted contacts
+    """
+    if len(body.ids) > settings.contacts_bulk_max_ids:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=TOO_MANY_IDS)
+    affected = await repository_contacts.remove_contacts(body.ids, current_user, db, settings.contacts_bulk_chunk_size,
+                                                         settings.contacts_sync_retention_days)
+    return {"affected": affected}
+
+
+@router.put("/{contact_id}", response_model=ContactResponse, description=TOO_MANY_REQUESTS,
+            dependencies=[rate_limit("update_contact")])
+async def update_contact(body: ContactModel, contact_id: int, db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_contact function updates a contact in the database.
@@ -160,7 +402,7 @@ async def update_contact(body: ContactModel, contact_id: int, db: Session = Depe
     
     :param body: ContactModel: Pass the contact information to be updated
     :param contact_id: int: Identify the contact to be updated
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user from the auth_service
     :return: A contactmodel object
     """
@@ -170,8 +412,26 @@ async def update_contact(body: ContactModel, contact_id: int, db: Session = Depe
     return contact
 
 
+@router.patch("/{contact_id}", response_model=ContactResponse)
+async def patch_contact(body: ContactPatch, contact_id: int, db: AsyncSession = Depends(get_db),
+                    current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The patch_contact function changes only the fields of a contact that are sent in the request body.
+    
+    :param body: ContactPatch: The fields to change
+    :param contact_id: int: Identify the contact to be updated
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the auth_service
+    :return: The updated contact
+    """
+    contact = await repository_contacts.patch_contact(contact_id, body, current_user,  db)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+    return contact
+
+
 @router.delete("/{contact_id}", response_model=ContactResponse)
-async def remove_contact(contact_id: int, db: Session = Depends(get_db),
+async def remove_contact(contact_id: int, db: AsyncSession = Depends(get_db),
                     current_user: User = Depends(auth_service.get_current_user)):
     """
     The remove_contact function removes a contact from the database.
@@ -179,11 +439,11 @@ async def remove_contact(contact_id: int, db: Session = Depends(get_db),
         and returns a dictionary containing information about that contact.
     
     :param contact_id: int: Specify the contact id of the contact to be removed
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user from the database
     :return: A contact object
     """
-    contact = await repository_contacts.remove_contact(contact_id, current_user,  db)
+    contact = await repository_contacts.remove_contact(contact_id, current_user,  db, settings.contacts_sync_retention_days)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
     return contact
\ No newline at end of file
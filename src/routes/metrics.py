@@ -0,0 +1,53 @@
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException, Security, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from src.conf.config import settings
+from src.conf.messages import NOT_FOUND, NOT_VALIDATE_CREDENTIALS
+from src.services.auth import auth_service
+from src.services.avatars import avatar_pipeline
+from src.services.cache import contacts_cache
+from src.services.events import contact_events
+from src.services.rate_limit import rate_limiter
+
+security = HTTPBearer()
+
+
+def require_metrics_token(credentials: HTTPAuthorizationCredentials = Security(security)) -> None:
+    """
+    The require_metrics_token function is a dependency admitting only requests that carry the metrics_token
+        of the settings, the operations token of the deployment. User access tokens are not accepted.
+
+    :param credentials: HTTPAuthorizationCredentials: The bearer token of the request
+    :return: None
+    """
+    if not settings.metrics_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NOT_FOUND)
+    if not secrets.compare_digest(credentials.credentials.encode(), settings.metrics_token.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=NOT_VALIDATE_CREDENTIALS)
+
+
+router = APIRouter(prefix='/metrics', tags=["metrics"], dependencies=[Depends(require_metrics_token)])
+
+
+@router.get("/")
+async def read_metrics():
+    """
+    The read_metrics function returns the counters of the in-process caches and pools of this worker.
+        Only callers with the metrics_token get them.
+
+    :return: A dictionary of counters per subsystem
+    """
+    return {
+        "user_cache": auth_service.user_cache.stats(),
+        "token_cache": auth_service.token_cache.stats(),
+        "password_pool": auth_service.password_pool.stats(),
+        "revocation": auth_service.revocations.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "avatar_pool": avatar_pipeline.pool.stats(),
+        "contacts_cache": contacts_cache.stats(),
+        "contact_events": contact_events.stats(),
+        # server-wide, not the share of the contacts cache
+        "redis_server_memory": await contacts_cache.memory(),
+    }
@@ -1,13 +1,11 @@
-import cloudinary
-import cloudinary.uploader
 from fastapi import APIRouter, Depends, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.connect_db import get_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
-from src.conf.config import settings
+from src.services.avatars import avatar_pipeline
 from src.schemas import UserDb
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -33,30 +31,20 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 
 @router.patch('/avatar', response_model=UserDb)
 async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
         Args:
             file (UploadFile): The image to be uploaded as an avatar.
             current_user (User): The user whose avatar is being updated. 
                                  This is passed in by the auth_service dependency, which uses JWT tokens to authenticate users and get their information from the database.
-            db (Session): A connection to our PostgreSQL database, passed in by the get_db dependency function.
+            db (AsyncSession): A connection to our PostgreSQL database, passed in by the get_db dependency function.
     
-    :param file: UploadFile: Upload the file to cloudinary
+    :param file: UploadFile: The image, cropped to a square and stored through the avatar storage
     :param current_user: User: Get the current user from the database
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: The user object
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-    
-
-    cloudinary.uploader.upload(file.file, public_id=f'ContactsApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'ContactsApp/{current_user.username}')\
-                        .build_url(width=250, height=250, crop='fill')
+    src_url = await avatar_pipeline.store(file, f'ContactsApp/{current_user.username}')
     user = await repository_users.update_avatar(current_user.email, src_url, db)
-    return user
\ No newline at end of file
+    return user
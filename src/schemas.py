@@ -1,5 +1,6 @@
 from datetime import datetime, date
-from pydantic import BaseModel, Field, EmailStr
+from typing import Any, List, Optional
+from pydantic import BaseModel, Field, EmailStr, validator
 
 class ContactBase(BaseModel):
     first_name: str = Field(max_length=50)
@@ -17,6 +18,32 @@ class ContactUpdate(ContactModel):
     pass
 
 
+class ContactPatch(BaseModel):
+    first_name: Optional[str] = Field(max_length=50)
+    last_name: Optional[str] = Field(max_length=50)
+    email: Optional[str] = Field(max_length=50)
+    phone: Optional[str] = Field(max_length=50)
+    birthday: Optional[date] = Field()
+
+    @validator('*', pre=True)
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError('may be omitted but not null')
+        return value
+
+
+class ContactBulkDelete(BaseModel):
+    ids: List[int] = Field(min_items=1)
+
+
+class ContactBulkUpdate(ContactBulkDelete):
+    changes: ContactPatch
+
+
+class ContactBulkResult(BaseModel):
+    affected: int
+
+
 class ContactResponse(ContactBase):
     id: int
 
@@ -24,6 +51,28 @@ class ContactResponse(ContactBase):
         orm_mode = True
 
 
+class ContactChange(ContactResponse):
+    updated_at: datetime
+
+
+class ContactChanges(BaseModel):
+    upserts: List[ContactChange]
+    deleted: List[int]
+    next: str
+    more: bool
+
+
+class ContactImportError(BaseModel):
+    row: int
+    errors: List[Any]
+
+
+class ContactImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: List[ContactImportError] = []
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
@@ -40,6 +89,11 @@ class UserDb(BaseModel):
         orm_mode = True
 
 
+class UserCached(UserDb):
+    avatar: Optional[str] = None
+    confirmed: Optional[bool] = False
+
+
 class UserResponse(BaseModel):
     user: UserDb
     detail: str = "User successfully created"
@@ -1,51 +1,92 @@
-import pickle
+import uuid
 from typing import Optional
 
-import redis
+from redis.exceptions import RedisError
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.connect_db import get_db
 from src.repository import users as repository_users
 from src.conf.config import settings
-from src.conf.messages import FAIL_EMAIL_VERIFICATION, INVALID_SCOPE, NOT_VALIDATE_CREDENTIALS 
+from src.conf.messages import (FAIL_EMAIL_VERIFICATION, INVALID_SCOPE, INVALID_TOKEN, NOT_VALIDATE_CREDENTIALS,
+    PASSWORD_POOL_BUSY, SESSION_STORE_UNAVAILABLE)
+from src.services.cache import TokenCache, user_cache
+from src.services.pool import PoolBusy, WorkerPool
+from src.services.revocation import RevocationList
+from src.services.sessions import ROTATED, build_session_store
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# module level, so that a process pool can pickle them by name
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
 
 class Auth:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = pwd_context
+    password_pool = WorkerPool(settings.password_pool_kind, workers=settings.password_pool_workers,
+                               max_pending=settings.password_pool_max_pending)
+    session_store = build_session_store(settings.session_store)
+    revocations = RevocationList(user_cache.redis, capacity=settings.revocation_filter_capacity,
+                                 error_rate=settings.revocation_filter_error_rate,
+                                 sync_interval=settings.revocation_sync_interval)
     SECRET_KEY = settings.secret_key
     ALGORITHM = settings.algorithm
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
     
-    redis_cache = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    user_cache = user_cache
+    token_cache = TokenCache(settings.token_cache_size)
+
+    async def run_in_password_pool(self, fn, *args):
+        """
+        The run_in_password_pool function runs a bcrypt call in the password pool, so it does not block the event loop.
+            A full pool answers with 503 Service Unavailable instead of queueing the request.
 
-    def verify_password(self, plain_password, hashed_password):
+        :param self: Represent the instance of the class
+        :param fn: The module level function to call
+        :param args: Arguments of fn
+        :return: The result of fn
+        """
+        try:
+            return await self.password_pool.run(fn, *args)
+        except PoolBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=PASSWORD_POOL_BUSY,
+                                headers={"Retry-After": "1"})
+
+
+    async def verify_password(self, plain_password, hashed_password):
         """
         The verify_password function takes a plain-text password and the hashed version of that password,
             and returns True if they match, False otherwise. This is used to verify that the user's login
-            credentials are correct.
+            credentials are correct. bcrypt runs in the password pool.
         
         :param self: Represent the instance of the class
         :param plain_password: Store the password that is entered by the user
         :param hashed_password: Check if the password is correct
         :return: A boolean value
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return await self.run_in_password_pool(check_password, plain_password, hashed_password)
 
 
-    def get_password_hash(self, password: str):
+    async def get_password_hash(self, password: str):
         """
         The get_password_hash function takes a password as input and returns the hash of that password.
-            The function uses the pwd_context object to generate a hash from the given password.
+            The function uses the pwd_context object to generate a hash from the given password in the password pool.
         
         :param self: Represent the instance of the class
         :param password: str: Get the password from the user
         :return: A hash of the password
         """
-        return self.pwd_context.hash(password)
+        return await self.run_in_password_pool(hash_password, password)
 
 
     # define a function to generate a new access token
@@ -57,14 +98,14 @@ class Auth:
         :param self: Represent the instance of the class
         :param data: dict: Pass the data that will be encoded in the access token
         :param expires_delta: Optional[float]: Set the expiration time of the token
-        :return: A jwt token that is encoded with the user's information
+        :return: A jwt token that is encoded with the user's information, carrying a unique jti so it can be revoked
         """
         to_encode = data.copy()
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token", "jti": uuid.uuid4().hex})
         encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
 
@@ -87,7 +128,7 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(days=7)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "email_token"})
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
@@ -122,58 +163,137 @@ class Auth:
         :param refresh_token: str: Pass the refresh token to the function
         :return: The email of the user
         """
+        return (await self.decode_refresh_claims(refresh_token))['sub']
+
+
+    async def decode_refresh_claims(self, refresh_token: str) -> dict:
+        """
+        The decode_refresh_claims function checks a refresh token like decode_refresh_token does,
+            but returns all of its claims, including the session id (sid) and token id (jti).
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: Pass the refresh token to the function
+        :return: The claims of the token
+        """
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+                return payload
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_SCOPE)
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=NOT_VALIDATE_CREDENTIALS)
 
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def open_session(self, email: str) -> tuple[str, str]:
         """
-        The get_current_user function is a dependency that will be called by the FastAPI framework to retrieve the current user.
-        It uses the token provided in the Authorization header of each request and validates it against our JWT secret key.
-        If successful, it returns an instance of User with all its properties populated from our database.
-        
+        The open_session function starts a new refresh token session for a device of the user.
+            Every login gets its own session, so a user can stay logged in on several devices at once.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user that logged in
+        :return: The id of the session and its first refresh token
+        """
+        jti = self.session_store.new_id()
+        try:
+            sid = await self.session_store.create(email, jti, settings.refresh_token_ttl)
+        except RedisError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=SESSION_STORE_UNAVAILABLE)
+        return sid, await self.create_refresh_token(data={"sub": email, "sid": sid, "jti": jti},
+                                                    expires_delta=settings.refresh_token_ttl)
+
+
+    async def rotate_refresh_token(self, refresh_token: str) -> tuple[str, str, str]:
+        """
+        The rotate_refresh_token function exchanges a refresh token for the next one of its session.
+            Only the latest token of a session can be exchanged. Presenting an older one means the token was copied,
+            so the session is revoked and the device that holds the current token has to log in again too.
+
+        :param self: Represent the instance of the class
+        :param refresh_token: str: The refresh token sent by the client
+        :return: The email of the user, the id of the session and the new refresh token
+        """
+        claims = await self.decode_refresh_claims(refresh_token)
+        if not claims.get('sid') or not claims.get('jti'):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_TOKEN)
+        jti = self.session_store.new_id()
+        try:
+            result = await self.session_store.rotate(claims['sid'], claims['jti'], jti, settings.refresh_token_ttl)
+        except RedisError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=SESSION_STORE_UNAVAILABLE)
+        if result != ROTATED:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=INVALID_TOKEN)
+        new_token = await self.create_refresh_token(data={"sub": claims['sub'], "sid": claims['sid'], "jti": jti},
+                                                    expires_delta=settings.refresh_token_ttl)
+        return claims['sub'], claims['sid'], new_token
+
+
+    async def get_access_claims(self, token: str = Depends(oauth2_scheme)) -> dict:
+        """
+        The get_access_claims function is a dependency that validates an access token and returns its claims.
+        A token that was already validated is taken from the token cache until it expires,
+        and a token whose jti is on the revocation list is refused.
+
         :param self: Represent the instance of a class
         :param token: str: Get the token from the header of a request
-        :param db: Session: Get the database session
-        :return: The user object
+        :return: The claims of the token
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=NOT_VALIDATE_CREDENTIALS
         )
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
+        payload = self.token_cache.get(token)
+        if payload is None:
+            try:
+                # Decode JWT
+                payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            except JWTError as e:
                 raise credentials_exception
-        except JWTError as e:
+            if payload.get('scope') != 'access_token' or payload.get('sub') is None:
+                raise credentials_exception
+            self.token_cache.set(token, payload)
+        if payload.get('jti') and await self.revocations.is_revoked(payload['jti']):
             raise credentials_exception
+        return payload
+
 
-        user = self.redis_cache.get(f'user:{email}')
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+        """
+        The get_current_user function is a dependency that will be called by the FastAPI framework to retrieve the current user.
+        It uses the token provided in the Authorization header of each request and validates it with get_access_claims.
+        If successful, it returns an instance of User from the user cache, or from our database on a cache miss.
+        
+        :param self: Represent the instance of a class
+        :param token: str: Get the token from the header of a request
+        :param db: AsyncSession: Get the database session
+        :return: The user object
+        """
+        email = (await self.get_access_claims(token))["sub"]
+        user = await self.user_cache.get_or_load(email, lambda: repository_users.get_user_by_email(email, db))
         if user is None:
-            print("USER POSTGRES")
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
-                raise credentials_exception
-            self.redis_cache.set(f'user:{email}', pickle.dumps(user))
-            self.redis_cache.expire(f'user:{email}', 900)
-        else:
-            print("USER CACHE")
-            user = pickle.loads(user)
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=NOT_VALIDATE_CREDENTIALS)
         return user
 
 
+    async def logout(self, token: str, claims: dict) -> None:
+        """
+        The logout function revokes the access token before its exp, together with the refresh token session it belongs to.
+
+        :param self: Represent the instance of a class
+        :param token: str: The access token
+        :param claims: dict: The claims of the access token
+        :return: None
+        """
+        try:
+            if claims.get('jti'):
+                await self.revocations.revoke(claims['jti'], claims['exp'])
+            if claims.get('sid'):
+                await self.session_store.revoke(claims['sid'])
+        except RedisError:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=SESSION_STORE_UNAVAILABLE)
+        self.token_cache.revoke(token)
+
+
     async def get_email_from_token(self, token: str):
         """
         The get_email_from_token function takes a token as an argument and returns the email associated with that token.
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from src.conf.config import settings
+from src.conf.messages import AVATAR_POOL_BUSY, IMAGE_TOO_LARGE, INVALID_IMAGE
+from src.services.pool import PoolBusy, WorkerPool
+
+
+class ImageTooLarge(Exception):
+    """Raised when an upload is larger than max_bytes."""
+
+
+# module level, so that a process pool can pickle it by name
+def resize_avatar(path: str, size: int, max_pixels: int) -> bytes:
+    """
+    The resize_avatar function crops the image in path to a size x size square around its centre and encodes it as JPEG.
+
+    :param path: str: Path of the uploaded image
+    :param size: int: Width and height of the avatar in pixels
+    :param max_pixels: int: Larger images are refused before they are decoded
+    :return: The JPEG bytes
+    :raises ValueError: If the file is not an image or has more than max_pixels pixels
+    """
+    try:
+        with Image.open(path) as image:
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"image of {image.width}x{image.height} pixels is too large")
+            # lets the JPEG decoder skip straight to a reduced scale, much less work for photos from a camera
+            image.draft("RGB", (size * 2, size * 2))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            avatar = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as err:
+        raise ValueError(str(err)) from err
+    out = io.BytesIO()
+    avatar.save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue()
+
+
+def spool_upload(source: BinaryIO, max_bytes: int, chunk_size: int) -> str:
+    """
+    The spool_upload function copies an upload to a temporary file chunk by chunk, never holding more than one chunk.
+
+    :param source: BinaryIO: The file of the upload
+    :param max_bytes: int: Uploads larger than this are refused
+    :param chunk_size: int: Bytes copied at a time
+    :return: Path of the temporary file, the caller removes it
+    :raises ImageTooLarge: If the upload has more than max_bytes
+    """
+    copied = 0
+    with tempfile.NamedTemporaryFile(prefix="avatar-", delete=False) as target:
+        try:
+            while chunk := source.read(chunk_size):
+                copied += len(chunk)
+                if copied > max_bytes:
+                    raise ImageTooLarge()
+                target.write(chunk)
+        except BaseException:
+            target.close()
+            os.unlink(target.name)
+            raise
+    return target.name
+
+
+class AvatarStorage(ABC):
+    """Where the encoded avatars are kept. save returns the public URL of the stored image."""
+
+    @abstractmethod
+    async def save(self, key: str, data: bytes) -> str:
+        ...
+
+
+class CloudinaryStorage(AvatarStorage):
+    """
+    Uploads avatars to Cloudinary. The SDK is synchronous, so uploads run in a thread.
+    The returned URL carries the version of the upload, so clients never see the previous image from a cache.
+    """
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str):
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+
+    async def save(self, key: str, data: bytes) -> str:
+        result = await asyncio.to_thread(cloudinary.uploader.upload, data, public_id=key, overwrite=True,
+                                         resource_type="image")
+        return result["secure_url"]
+
+
+class LocalStorage(AvatarStorage):
+    """
+    Writes avatars below root, for development and tests. The files are expected to be served under base_url,
+    e.g. by the reverse proxy, or from a bucket mounted at root.
+    """
+
+    def __init__(self, root: str | Path, base_url: str):
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".part")
+        partial.write_bytes(data)
+        partial.replace(path)
+
+    async def save(self, key: str, data: bytes) -> str:
+        path = (self.root / f"{key}.jpg").resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"avatar key {key!r} leaves the storage root")
+        await asyncio.to_thread(self._write, path, data)
+        version = hashlib.sha1(data).hexdigest()[:12]
+        return f"{self.base_url}/{path.relative_to(self.root).as_posix()}?v={version}"
+
+
+def build_avatar_storage(kind: str) -> AvatarStorage:
+    """
+    The build_avatar_storage function creates the avatar storage named by the avatar_storage setting.
+
+    :param kind: str: cloudinary or local
+    :return: An AvatarStorage
+    """
+    if kind == "cloudinary":
+        return CloudinaryStorage(settings.cloudinary_name, str(settings.cloudinary_api_key),
+                                 settings.cloudinary_api_secret)
+    if kind == "local":
+        return LocalStorage(settings.avatar_local_root, settings.avatar_local_url)
+    raise ValueError(f"unknown avatar storage {kind!r}, expected cloudinary or local")
+
+
+class AvatarPipeline:
+    """
+    Turns an uploaded image into an avatar without blocking the event loop: the upload is copied to a temporary file
+    in a thread, decoded, cropped and encoded in the image pool, and stored through the storage.
+    """
+
+    def __init__(self, storage: AvatarStorage, pool: WorkerPool, size: int, max_bytes: int, max_pixels: int,
+                 chunk_size: int):
+        self.storage = storage
+        self.pool = pool
+        self.size = size
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.chunk_size = chunk_size
+
+    async def store(self, file: UploadFile, key: str) -> str:
+        """
+        The store function resizes the uploaded image and stores it under key.
+            Errors of the upload are answered with 413 or 400, a full image pool with 503.
+
+        :param self: Represent the instance of the class
+        :param file: UploadFile: The uploaded image
+        :param key: str: Name of the avatar in the storage
+        :return: The public URL of the avatar
+        """
+        try:
+            path = await asyncio.to_thread(spool_upload, file.file, self.max_bytes, self.chunk_size)
+        except ImageTooLarge:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=IMAGE_TOO_LARGE)
+        try:
+            data = await self.pool.run(resize_avatar, path, self.size, self.max_pixels)
+        except PoolBusy:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=AVATAR_POOL_BUSY)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=INVALID_IMAGE)
+        finally:
+            await asyncio.to_thread(os.unlink, path)
+        return await self.storage.save(key, data)
+
+
+avatar_pipeline = AvatarPipeline(
+    build_avatar_storage(settings.avatar_storage),
+    WorkerPool(settings.avatar_pool_kind, workers=settings.avatar_pool_workers,
+               max_pending=settings.avatar_pool_max_pending),
+    size=settings.avatar_size,
+    max_bytes=settings.avatar_max_bytes,
+    max_pixels=settings.avatar_max_pixels,
+    chunk_size=settings.avatar_upload_chunk_size,
+)
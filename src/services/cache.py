@@ -0,0 +1,418 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import orjson
+from fastapi.responses import Response
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database.models import User
+from src.schemas import UserCached
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    A bounded in-process cache. The least recently used entry is dropped once maxsize is reached,
+    and entries older than ttl seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        The get function returns the cached value of key and marks it as recently used.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :return: The cached value, or None if it is missing or expired
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """
+        The set function stores value under key, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: Hashable: The cache key
+        :param value: Any: The value to cache
+        :param ttl: float | None: Seconds the entry stays valid, defaults to the ttl of the cache
+        :return: None
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class UserCache:
+    """
+    Two tier cache of authenticated users: a small LRU in every worker in front of Redis.
+    Users are stored as the JSON of their UserCached fields, never as pickled ORM instances,
+    and come back as detached User objects. Redis errors count as misses, so an unavailable
+    Redis slows requests down to a database lookup instead of failing them.
+
+    Redis entries are versioned: a copy lives under user:{email}:v{n}, where n is read from
+    user:{email}:version before the database is queried. A write bumps the version, so a reader
+    that raced the write stores its old copy under a version nobody reads any more.
+    """
+
+    def __init__(self, redis: Redis, maxsize: int, local_ttl: float, redis_ttl: int):
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        self.local = LRUCache(maxsize, local_ttl)
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def version_key(email: str) -> str:
+        return f"user:{email}:version"
+
+    @staticmethod
+    def key(email: str, version: int) -> str:
+        return f"user:{email}:v{version}"
+
+    @staticmethod
+    def dumps(user: User) -> bytes:
+        return UserCached.from_orm(user).json().encode()
+
+    @staticmethod
+    def loads(data: bytes | str) -> User:
+        return User(**UserCached.parse_raw(data).dict())
+
+    async def _lookup(self, email: str) -> tuple[User | None, int | None]:
+        """
+        The _lookup function reads the current version of the user and the copy stored under it.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: The cached user or None, and the version it was looked up under, None if Redis failed
+        """
+        try:
+            version = int(await self.redis.get(self.version_key(email)) or 0)
+            data = await self.redis.get(self.key(email, version))
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.warning("user cache: redis get failed: %s", err)
+            return None, None
+        if data is None:
+            self.redis_misses += 1
+            return None, version
+        self.redis_hits += 1
+        return self.loads(data), version
+
+    async def get(self, email: str) -> User | None:
+        """
+        The get function looks the user up in the local tier first and in Redis second.
+        A Redis hit is copied into the local tier.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: A detached User, or None on a miss in both tiers
+        """
+        user = self.local.get(email)
+        if user is not None:
+            return user
+        user, _ = await self._lookup(email)
+        if user is not None:
+            self.local.set(email, user)
+        return user
+
+    async def get_or_load(self, email: str, loader: Callable[[], Awaitable[User | None]]) -> User | None:
+        """
+        The get_or_load function returns the cached user, calling loader on a miss in both tiers.
+        The loaded user is stored under the version that was current before loader ran,
+        so a copy read before a concurrent write can never replace the fresh one.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :param loader: Callable[[], Awaitable[User | None]]: Loads the user from the database
+        :return: A User, or None if loader found nothing
+        """
+        user = self.local.get(email)
+        if user is not None:
+            return user
+        user, version = await self._lookup(email)
+        if user is None:
+            user = await loader()
+            if user is None:
+                return None
+            data = self.dumps(user)
+            if version is not None:
+                try:
+                    await self.redis.set(self.key(email, version), data, ex=self.redis_ttl)
+                except RedisError as err:
+                    self.redis_errors += 1
+                    logger.warning("user cache: redis set failed: %s", err)
+            user = self.loads(data)
+        self.local.set(email, user)
+        return user
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function drops the user from this worker and bumps its version in Redis,
+        which orphans every copy stored so far. Other workers keep their local copy for at most local_ttl seconds.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the changed user
+        :return: None
+        """
+        self.local.delete(email)
+        self.invalidations += 1
+        try:
+            await self.redis.incr(self.version_key(email))
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.warning("user cache: redis invalidate failed: %s", err)
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats(),
+            "redis": {"hits": self.redis_hits, "misses": self.redis_misses, "errors": self.redis_errors},
+            "invalidations": self.invalidations,
+        }
+
+
+class TokenCache:
+    """
+    Claims of access tokens whose signature has already been checked, keyed by the sha256 digest of the token.
+    An entry expires at the exp claim of its token, so a cached token is never accepted for longer than jwt.decode would.
+    """
+
+    def __init__(self, maxsize: int):
+        self.entries = LRUCache(maxsize, ttl=0)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        return self.entries.get(self.digest(token))
+
+    def set(self, token: str, claims: dict) -> None:
+        """
+        The set function remembers the verified claims of token until its exp claim.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :param claims: dict: The claims returned by jwt.decode
+        :return: None
+        """
+        ttl = claims["exp"] - time.time()
+        if ttl > 0:
+            self.entries.set(self.digest(token), claims, ttl=ttl)
+
+    def revoke(self, token: str) -> None:
+        self.entries.delete(self.digest(token))
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+
+user_cache = UserCache(
+    Redis(host=settings.redis_host, port=settings.redis_port, db=0),
+    maxsize=settings.user_cache_size,
+    local_ttl=settings.user_cache_local_ttl,
+    redis_ttl=settings.user_cache_redis_ttl,
+)
+
+
+class ContactsCache:
+    """
+    Results of the contact read routes in Redis, keyed by user, route and normalized parameters:
+    contacts:{user_id}:g{generation}:{route}:{digest of the parameters}. Every write to the contacts of a user
+    increments contacts:{user_id}:generation, after which none of the stored results is read again;
+    they expire after ttl seconds, so no key is ever scanned or deleted.
+
+    An entry holds the finished response, the JSON of its extra headers, a newline and the body,
+    so a hit is answered without touching rows or serializing anything. After a Redis error the cache
+    is bypassed for retry_interval seconds and every request goes to the database.
+    A user whose generation could not be incremented is bypassed by this worker until the increment
+    reaches Redis, which is retried before the next lookup, or until the results of the old generation expired.
+    """
+
+    def __init__(self, redis: Redis, ttl: int, max_entry_bytes: int, retry_interval: float):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.retry_interval = retry_interval
+        self.redis_down_until = 0.0
+        # user id: time.monotonic() at which the results stored before the failed invalidation have expired
+        self.uninvalidated: Dict[int, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.stored = 0
+        self.stored_bytes = 0
+
+    @staticmethod
+    def generation_key(user_id: int) -> str:
+        return f"contacts:{user_id}:generation"
+
+    @staticmethod
+    def key(user_id: int, generation: int, route: str, params: dict) -> str:
+        digest = hashlib.sha1(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        return f"contacts:{user_id}:g{generation}:{route}:{digest}"
+
+    @staticmethod
+    def dumps(response: Response) -> bytes:
+        headers = {name: value for name, value in response.headers.items()
+                   if name not in ("content-length", "content-type")}
+        return orjson.dumps(headers) + b"\n" + response.body
+
+    @staticmethod
+    def loads(data: bytes) -> Response:
+        headers, body = data.split(b"\n", 1)
+        return Response(body, media_type="application/json", headers=orjson.loads(headers))
+
+    def _failed(self, action: str, err: RedisError) -> None:
+        self.errors += 1
+        self.redis_down_until = time.monotonic() + self.retry_interval
+        logger.warning("contacts cache: redis %s failed, bypassing the cache: %s", action, err)
+
+    async def get_or_load(self, user_id: int, route: str, params: dict,
+                          loader: Callable[[], Awaitable[Response]]) -> Response:
+        """
+        The get_or_load function returns the cached response of the route, calling loader on a miss.
+            The generation is read before loader runs and the result is stored under it,
+            so a result read before a concurrent write is never served after that write.
+            Only 200 responses are cached, not a loader that raises.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user whose contacts are read
+        :param route: str: Name of the route
+        :param params: dict: The parameters the result depends on, values must be JSON serializable
+        :param loader: Callable[[], Awaitable[Response]]: Queries the database and builds the response
+        :return: The response
+        """
+        if time.monotonic() < self.redis_down_until:
+            return await loader()
+        if self.uninvalidated:
+            await self._retry_invalidations()
+        if user_id in self.uninvalidated:
+            return await loader()
+        try:
+            generation = int(await self.redis.get(self.generation_key(user_id)) or 0)
+            key = self.key(user_id, generation, route, params)
+            data = await self.redis.get(key)
+        except RedisError as err:
+            self._failed("get", err)
+            return await loader()
+        if data is not None:
+            self.hits += 1
+            return self.loads(data)
+        self.misses += 1
+        response = await loader()
+        data = self.dumps(response)
+        if response.status_code == 200 and len(data) <= self.max_entry_bytes:
+            try:
+                await self.redis.set(key, data, ex=self.ttl)
+            except RedisError as err:
+                self._failed("set", err)
+            else:
+                self.stored += 1
+                self.stored_bytes += len(data)
+        return response
+
+    async def invalidate(self, user_id: int) -> None:
+        """
+        The invalidate function starts a new generation for the user, which orphans all of the user's cached results.
+            If Redis is unavailable the user is remembered as uninvalidated: this worker answers the user from the
+            database and increments the generation once Redis is back.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user whose contacts changed
+        :return: None
+        """
+        self.invalidations += 1
+        try:
+            await self.redis.incr(self.generation_key(user_id))
+        except RedisError as err:
+            self.uninvalidated[user_id] = time.monotonic() + self.ttl
+            self._failed("invalidate", err)
+        else:
+            self.uninvalidated.pop(user_id, None)
+
+    async def _retry_invalidations(self) -> None:
+        now = time.monotonic()
+        for user_id, expires in list(self.uninvalidated.items()):
+            if expires <= now:
+                del self.uninvalidated[user_id]
+                continue
+            try:
+                await self.redis.incr(self.generation_key(user_id))
+            except RedisError as err:
+                self._failed("invalidate", err)
+                return
+            del self.uninvalidated[user_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+            "stored": self.stored,
+            "stored_bytes": self.stored_bytes,
+            "avg_entry_bytes": self.stored_bytes // self.stored if self.stored else None,
+            "redis_down": time.monotonic() < self.redis_down_until,
+            "uninvalidated_users": len(self.uninvalidated),
+        }
+
+    async def memory(self) -> dict:
+        """
+        The memory function reports the memory of the whole Redis server, which other users of the server
+        share with this cache. It is not the memory of this cache: that is bounded by the stored_bytes of
+        all workers during the last ttl seconds, as every entry expires after ttl seconds.
+
+        :param self: Represent the instance of the class
+        :return: The used_memory and maxmemory of Redis in bytes, or an empty dict if Redis is unavailable
+        """
+        try:
+            info = await self.redis.info("memory")
+        except RedisError:
+            return {}
+        return {"used_memory": info.get("used_memory"), "maxmemory": info.get("maxmemory")}
+
+
+contacts_cache = ContactsCache(
+    Redis(host=settings.redis_host, port=settings.redis_port, db=0),
+    ttl=settings.contacts_cache_ttl,
+    max_entry_bytes=settings.contacts_cache_max_entry_bytes,
+    retry_interval=settings.contacts_cache_retry_interval,
+)
@@ -0,0 +1,197 @@
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+from typing import IO, AsyncIterator, Callable, Iterable, Iterator, Sequence, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactImportError, ContactImportReport, ContactModel
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+EXPORT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'vcf': 'text/vcard',
+}
+
+CSV_FIELDS = ('id', 'first_name', 'last_name', 'email', 'phone', 'birthday')
+
+FORMAT_BY_EXTENSION = {
+    'csv': 'csv',
+    'ndjson': 'ndjson',
+    'jsonl': 'ndjson',
+}
+
+FORMAT_BY_CONTENT_TYPE = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+def detect_format(filename: str | None, content_type: str | None) -> str | None:
+    """
+    The detect_format function guesses the format of an uploaded address book from its file name or content type.
+
+    :param filename: str | None: Name of the uploaded file
+    :param content_type: str | None: Content type sent with the file
+    :return: 'csv', 'ndjson' or None if the format is unknown
+    """
+    if filename and '.' in filename:
+        fmt = FORMAT_BY_EXTENSION.get(filename.rsplit('.', 1)[1].lower())
+        if fmt:
+            return fmt
+    if content_type:
+        return FORMAT_BY_CONTENT_TYPE.get(content_type.split(';')[0].strip().lower())
+    return None
+
+
+def decode_lines(binary: IO[bytes]) -> Iterator[str]:
+    """
+    The decode_lines function decodes an uploaded file line by line as UTF-8, a byte order mark is dropped
+        and undecodable bytes are replaced. Line endings are kept, as the csv module expects.
+
+    :param binary: IO[bytes]: The binary file of the upload
+    :return: An iterator of text lines
+    """
+    return (line for line in codecs.iterdecode(binary, 'utf-8-sig', errors='replace') if line)
+
+
+def read_rows(stream: Iterable[str], fmt: str) -> Iterator[Tuple[int, dict | str]]:
+    """
+    The read_rows function lazily reads contacts from a csv (with a header line) or ndjson text stream.
+        Only one line is held in memory at a time. A line that cannot be parsed is yielded as an error message
+        instead of a dict, so one broken line does not stop the import.
+
+    :param stream: Iterable[str]: Text lines of the uploaded file
+    :param fmt: str: 'csv' or 'ndjson'
+    :return: An iterator of (row number, row dict or error message) pairs, row numbers start at 1
+    """
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            if None in row:
+                yield number, 'Too many fields'
+            else:
+                yield number, row
+        return
+
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as err:
+            yield number, f'Invalid JSON: {err}'
+            continue
+        yield number, row if isinstance(row, dict) else 'Expected a JSON object'
+
+
+async def import_contacts(stream: Iterable[str], fmt: str, user: User, db: AsyncSession,
+                          chunk_size: int, max_errors: int) -> ContactImportReport:
+    """
+    The import_contacts function streams contacts from an uploaded file into the user's address book.
+        The file is read chunk_size rows at a time in a worker thread, each chunk is validated against ContactModel
+        and its valid rows are written with one batched INSERT, so memory use does not grow with the file.
+        Every chunk is committed on its own, rows of earlier chunks stay imported if a later chunk fails.
+
+    :param stream: Iterable[str]: Text lines of the uploaded file
+    :param fmt: str: 'csv' or 'ndjson'
+    :param user: User: The owner of the imported contacts
+    :param db: AsyncSession: Connect to the database
+    :param chunk_size: int: How many rows are validated and inserted together
+    :param max_errors: int: How many row errors are reported in detail, further ones are only counted
+    :return: A report with the number of imported and failed rows and the errors of the failed rows
+    """
+    report = ContactImportReport()
+    rows = read_rows(stream, fmt)
+    while chunk := await run_in_threadpool(lambda: list(islice(rows, chunk_size))):
+        bodies = []
+        for number, row in chunk:
+            try:
+                if isinstance(row, str):
+                    raise ValueError(row)
+                bodies.append(ContactModel(**row))
+            except (ValidationError, ValueError) as err:
+                report.failed += 1
+                if len(report.errors) < max_errors:
+                    details = err.errors() if isinstance(err, ValidationError) else [{'msg': str(err)}]
+                    report.errors.append(ContactImportError(row=number, errors=details))
+        report.imported += await repository_contacts.create_contacts(bodies, user, db)
+    return report
+
+
+def encode_ndjson(rows: Sequence[Row]) -> str:
+    return ''.join(json.dumps({
+        'id': row.id,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'email': row.email,
+        'phone': row.phone,
+        'birthday': row.birthday.isoformat() if row.birthday else None,
+    }, ensure_ascii=False) + '\n' for row in rows)
+
+
+def encode_csv(rows: Sequence[Row]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _vcard_escape(value: str | None) -> str:
+    if not value:
+        return ''
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;').replace('\n', '\\n')
+
+
+def encode_vcard(rows: Sequence[Row]) -> str:
+    cards = []
+    for row in rows:
+        first_name, last_name = _vcard_escape(row.first_name), _vcard_escape(row.last_name)
+        lines = [
+            'BEGIN:VCARD',
+            'VERSION:3.0',
+            f'N:{last_name};{first_name};;;',
+            f'FN:{" ".join(name for name in (first_name, last_name) if name)}',
+        ]
+        if row.email:
+            lines.append(f'EMAIL;TYPE=INTERNET:{_vcard_escape(row.email)}')
+        if row.phone:
+            lines.append(f'TEL:{_vcard_escape(row.phone)}')
+        if row.birthday:
+            lines.append(f'BDAY:{row.birthday.isoformat()}')
+        lines.append('END:VCARD')
+        cards.append('\r\n'.join(lines) + '\r\n')
+    return ''.join(cards)
+
+
+ENCODERS: dict[str, Callable[[Sequence[Row]], str]] = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+    'vcf': encode_vcard,
+}
+
+
+async def export_contacts(batches: AsyncIterator[Sequence[Row]], fmt: str) -> AsyncIterator[str]:
+    """
+    The export_contacts function encodes batches of contact rows as they arrive, so a StreamingResponse can send
+    each one before the next is fetched.
+
+    :param batches: AsyncIterator[Sequence[Row]]: Row batches from repository.stream_contacts
+    :param fmt: str: 'ndjson', 'csv' or 'vcf'
+    :return: An async iterator of encoded text chunks
+    """
+    encode = ENCODERS[fmt]
+    if fmt == 'csv':
+        yield ','.join(CSV_FIELDS) + '\r\n'
+    async for rows in batches:
+        yield encode(rows)
@@ -1,51 +1,162 @@
-from pathlib import Path
+import asyncio
+from collections import defaultdict
+from datetime import date
+from email.message import Message
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from typing import Callable, List
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
+import aiosmtplib
 
 from src.services.auth import auth_service
+from src.services.email_render import renderer
 from src.conf.config import settings
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=EmailStr(settings.mail_from),
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Rest API application",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
-
-async def send_email(email: EmailStr, username: str, host: str):
+MAIL_FROM_NAME = "Rest API application"
+
+
+def new_message(recipient: str, subject: str, html: str) -> Message:
+    # MIMEText builds a message about 15 times faster than EmailMessage.set_content
+    message = MIMEText(html, "html", "utf-8")
+    message["From"] = formataddr((MAIL_FROM_NAME, settings.mail_from))
+    message["To"] = recipient
+    message["Subject"] = subject
+    return message
+
+
+def build_confirmation_emails(batch: List[tuple[str, dict]]) -> List[Message]:
     """
-    The send_email function sends an email to the user with a link to confirm their email address.
-        The function takes in three arguments:
-            -email: the user's email address, which is used as a unique identifier for them.
-            -username: the username of the user who is registering. This will be displayed in 
-                their confirmation message so they know it was sent to them and not someone else.
-            -host: this is where we are hosting our application, which will be used as part of 
-                our confirmation link.
-    
-    :param email: EmailStr: Validate the email address
-    :param username: str: Pass in the username of the user who is registering
-    :param host: str: Pass in the host name of the server
-    :return: A coroutine object
+    The build_confirmation_emails function renders the messages with the link that confirms the email address of new users.
+        Messages pointing to the same host are rendered together by the batch renderer.
+        The token is created when the message is sent, so it stays valid for three days from delivery, not from signup.
+
+    :param batch: List[tuple[str, dict]]: Email address of every new user and the payload of its outbox row,
+        the username of the user and the host the link points to
+    :return: The messages, in the order of batch
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    by_host = defaultdict(list)
+    for position, (recipient, payload) in enumerate(batch):
+        by_host[payload["host"]].append(position)
+    messages = [None] * len(batch)
+    for host, positions in by_host.items():
+        recipients = [
+            {"username": batch[position][1]["username"],
+             "token": auth_service.create_email_token({"sub": batch[position][0]})}
+            for position in positions
+        ]
+        for position, html in zip(positions, renderer.render_batch("email_template.html", {"host": host}, recipients)):
+            messages[position] = new_message(batch[position][0], "Confirm your email ", html)
+    return messages
+
+
+def build_birthday_digests(batch: List[tuple[str, dict]]) -> List[Message]:
+    """
+    The build_birthday_digests function renders the messages listing the upcoming birthdays of the contacts of a user.
+        Every digest has its own list of contacts, so the messages are rendered one by one from the compiled template.
+
+    :param batch: List[tuple[str, dict]]: Email address of every user and the payload of its outbox row,
+        the username, the size of the window in days, the contacts with their birthday and how many more were left out
+    :return: The messages, in the order of batch
+    """
+    template = renderer.template("birthday_digest.html")
+    messages = []
+    for recipient, payload in batch:
+        contacts = [
+            {**contact, "day": f"{date.fromisoformat(contact['birthday']):%d %B}".lstrip("0")}
+            for contact in payload["contacts"]
+        ]
+        html = template.render(username=payload["username"], days=payload["days"], contacts=contacts,
+                               more=payload.get("more", 0))
+        messages.append(new_message(recipient, "Upcoming birthdays", html))
+    return messages
+
+
+# outbox kind: function building the messages of a batch of outbox rows from their recipients and payloads
+MESSAGE_BUILDERS: dict[str, Callable[[List[tuple[str, dict]]], List[Message]]] = {
+    "confirm_email": build_confirmation_emails,
+    "birthday_digest": build_birthday_digests,
+}
+
+
+class SMTPPool:
+    """
+    A fixed number of SMTP connections that stay open between messages, so the TCP, TLS and AUTH handshake
+    is paid once per connection instead of once per message. A connection is opened on first use,
+    and reopened once if the server closed it while it was idle.
+    """
+
+    def __init__(self, size: int, **smtp_options):
+        self.size = size
+        self.smtp_options = smtp_options
+        self.connects = 0
+        self.sent = 0
+        self._idle: asyncio.Queue | None = None
+
+    def _connections(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                self._idle.put_nowait(None)
+        return self._idle
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(**self.smtp_options)
+        await smtp.connect()
+        self.connects += 1
+        return smtp
+
+    async def send(self, message: Message) -> None:
+        """
+        The send function sends the message over an idle connection of the pool, waiting for one if all are busy.
+
+        :param self: Represent the instance of the class
+        :param message: Message: The message to send
+        :return: None
+        """
+        connections = self._connections()
+        smtp = await connections.get()
+        try:
+            if smtp is None or not smtp.is_connected:
+                smtp = await self._connect()
+            try:
+                await smtp.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                smtp = await self._connect()
+                await smtp.send_message(message)
+            self.sent += 1
+        except aiosmtplib.SMTPResponseException:
+            # the server refused this message, the connection itself is fine
+            raise
+        except BaseException:
+            if smtp is not None:
+                smtp.close()
+            smtp = None
+            raise
+        finally:
+            connections.put_nowait(smtp)
+
+    async def close(self) -> None:
+        connections = self._connections()
+        while not connections.empty():
+            smtp = connections.get_nowait()
+            if smtp is not None and smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.SMTPException:
+                    smtp.close()
+        self._idle = None
+
+    def stats(self) -> dict:
+        return {"size": self.size, "connects": self.connects, "sent": self.sent}
+
+
+def smtp_pool_from_settings() -> SMTPPool:
+    return SMTPPool(
+        settings.smtp_pool_size,
+        hostname=settings.mail_server,
+        port=settings.mail_port,
+        username=settings.mail_username or None,
+        password=settings.mail_password or None,
+        use_tls=settings.mail_ssl_tls,
+        start_tls=settings.mail_starttls,
+    )
@@ -0,0 +1,93 @@
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, List
+
+from jinja2 import Environment, FileSystemLoader, Template, select_autoescape
+from markupsafe import Markup, escape
+
+TEMPLATE_FOLDERS = [
+    Path(__file__).parent / 'templates',
+    Path(__file__).parents[2] / 'templates',
+]
+
+SLOT = re.compile("\x00(\\d+)\x00")
+
+
+class EmailRenderer:
+    """
+    Renders the email templates. Templates are read and compiled once per process, and never checked on disk again.
+
+    render_batch renders a template for many recipients at once: the template runs a single time with the values
+    shared by all recipients and a placeholder for every per recipient value. The resulting static fragments
+    are cached, and every message is joined from them and the escaped values of its recipient.
+    Per recipient values must therefore only be printed by the template, e.g. {{ username }},
+    never tested, looped over or passed through filters.
+    """
+
+    def __init__(self, folders: Iterable[Path] = TEMPLATE_FOLDERS, cache_size: int = 256):
+        self.env = Environment(
+            loader=FileSystemLoader([str(folder) for folder in folders]),
+            autoescape=select_autoescape(['html']),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        self.cache_size = cache_size
+        self._fragments: OrderedDict[tuple, tuple[list[str], list[int]]] = OrderedDict()
+
+    def template(self, name: str) -> Template:
+        return self.env.get_template(name)
+
+    def render(self, name: str, **context) -> str:
+        return self.template(name).render(**context)
+
+    def fragments(self, name: str, shared: dict, variables: tuple[str, ...]) -> tuple[list[str], list[int]]:
+        """
+        The fragments function splits the template rendered with the shared values around the per recipient variables.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the template
+        :param shared: dict: Values that are the same for every recipient
+        :param variables: tuple[str, ...]: Names of the per recipient variables
+        :return: The static fragments and, between each two of them, the index of the variable printed there
+        """
+        key = (name, tuple(sorted(shared.items())), variables)
+        cached = self._fragments.get(key)
+        if cached is not None:
+            self._fragments.move_to_end(key)
+            return cached
+        placeholders = {variable: Markup(f"\x00{i}\x00") for i, variable in enumerate(variables)}
+        parts = SLOT.split(self.render(name, **shared, **placeholders))
+        cached = parts[::2], [int(slot) for slot in parts[1::2]]
+        self._fragments[key] = cached
+        while len(self._fragments) > self.cache_size:
+            self._fragments.popitem(last=False)
+        return cached
+
+    def render_batch(self, name: str, shared: dict, recipients: List[dict]) -> List[str]:
+        """
+        The render_batch function renders the template once per recipient from the cached static fragments.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the template
+        :param shared: dict: Values that are the same for every recipient
+        :param recipients: List[dict]: The per recipient values, every dict with the same keys
+        :return: The rendered messages, in the order of recipients
+        """
+        if not recipients:
+            return []
+        variables = tuple(recipients[0])
+        static, slots = self.fragments(name, shared, variables)
+        quote = escape if self.env.autoescape(name) else str
+        rendered = []
+        for values in recipients:
+            printed = [quote(values[variable]) for variable in variables]
+            out = [static[0]]
+            for slot, fragment in zip(slots, static[1:]):
+                out.append(printed[slot])
+                out.append(fragment)
+            rendered.append("".join(out))
+        return rendered
+
+
+renderer = EmailRenderer()
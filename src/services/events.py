@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Set
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+READY = b"retry: 5000\nevent: ready\ndata: {}\n\n"
+RESYNC = b"event: resync\ndata: {}\n\n"
+HEARTBEAT = b": heartbeat\n\n"
+
+
+class ContactEvents:
+    """
+    Create, update and delete events of contacts. The repository publishes them to the Redis pub/sub channel
+    contacts:{user_id}:events, every worker pushes them to the server-sent event streams of its own clients.
+
+    A worker keeps one pub/sub connection for all of its streams. It subscribes to the channel of a user when the
+    first stream of that user opens and unsubscribes when the last one closes, so it only receives events somebody
+    listens to. One listener task reads the connection and hands every event, encoded once, to the queues of the
+    user's streams; the same task puts a heartbeat in every queue each heartbeat_interval seconds. An idle stream
+    therefore costs a queue and a suspended generator, without a timer or a connection of its own.
+    A stream is handed out once Redis confirmed the subscription, so no event published after that is missed.
+
+    Pub/sub does not keep events, they only tell a client that it should read /api/contacts/changes.
+    A stream that falls max_queue frames behind, and every stream after the pub/sub connection was lost, gets
+    a resync event instead of the events it missed. If no stream is open any more when the connection is back,
+    the listener stops until the next stream subscribes.
+    """
+
+    def __init__(self, redis: Redis, max_queue: int, heartbeat_interval: float, retry_interval: float):
+        self.redis = redis
+        self.max_queue = max_queue
+        self.heartbeat_interval = heartbeat_interval
+        self.retry_interval = retry_interval
+        self.streams: Dict[int, Set[asyncio.Queue]] = {}
+        # resolved when Redis confirms the subscription to the channel of the user
+        self.subscribed: Dict[int, asyncio.Future] = {}
+        self.lock = asyncio.Lock()
+        self.pubsub = None
+        self.listener: asyncio.Task | None = None
+        self.published = 0
+        self.publish_errors = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @staticmethod
+    def channel(user_id: int) -> str:
+        return f"contacts:{user_id}:events"
+
+    @staticmethod
+    def frame(data: bytes) -> bytes:
+        return b"event: contacts\ndata: " + data + b"\n\n"
+
+    async def publish(self, user_id: int, op: str, ids: List[int]) -> None:
+        """
+        The publish function announces a change of the user's contacts to every worker.
+            It runs after the commit of the change. A Redis error is logged and swallowed, the change itself
+            already happened and clients still find it in /api/contacts/changes.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user whose contacts changed
+        :param op: str: create, update or delete
+        :param ids: List[int]: Ids of the changed contacts, empty when they are not known
+        :return: None
+        """
+        try:
+            await self.redis.publish(self.channel(user_id), orjson.dumps({"op": op, "ids": ids}))
+        except RedisError as err:
+            self.publish_errors += 1
+            logger.warning("contact events: redis publish failed: %s", err)
+        else:
+            self.published += 1
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int) -> AsyncIterator[asyncio.Queue]:
+        """
+        The subscribe function opens a stream of the user's events for as long as the context is open.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user
+        :return: A queue of SSE frames, None after the last one
+        """
+        queue = asyncio.Queue()
+        queues = self.streams.setdefault(user_id, set())
+        queues.add(queue)
+        try:
+            if len(queues) == 1:
+                self.subscribed[user_id] = asyncio.get_running_loop().create_future()
+                await self._command("subscribe", self.channel(user_id))
+            # shielded, the other streams of the user wait for the same confirmation
+            await asyncio.shield(self.subscribed[user_id])
+            yield queue
+        finally:
+            queues.discard(queue)
+            if not queues and self.streams.get(user_id) is queues:
+                del self.streams[user_id]
+                self.subscribed.pop(user_id).cancel()
+                await self._command("unsubscribe", self.channel(user_id))
+
+    async def stream(self, user_id: int) -> AsyncIterator[bytes]:
+        """
+        The stream function yields the server-sent event frames of the user until the client goes away
+            or falls too far behind. It starts with a ready event, after which the client reads
+            /api/contacts/changes once, so nothing committed before the subscription is missed.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user
+        :return: An async iterator of SSE frames
+        """
+        async with self.subscribe(user_id) as queue:
+            yield READY
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    return
+                yield frame
+
+    def _offer(self, queue: asyncio.Queue, frame: bytes) -> None:
+        if queue.qsize() < self.max_queue:
+            queue.put_nowait(frame)
+            return
+        # a client that stops reading is cut off rather than buffered, it resyncs when it reconnects
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+        queue.put_nowait(None)
+        self.dropped += 1
+
+    def _broadcast(self, frame: bytes) -> None:
+        for queues in self.streams.values():
+            for queue in queues:
+                self._offer(queue, frame)
+
+    async def _command(self, name: str, *channels: str) -> None:
+        # one command at a time, the connection of the pub/sub is set up by the first one
+        async with self.lock:
+            if self.pubsub is None:
+                self.pubsub = self.redis.pubsub()
+            try:
+                await getattr(self.pubsub, name)(*channels)
+            except RedisError as err:
+                # the listener reconnects and subscribes to the channels of all open streams
+                self.errors += 1
+                logger.warning("contact events: redis %s failed: %s", name, err)
+            if self.listener is None or self.listener.done():
+                self.listener = asyncio.create_task(self._listen())
+
+    async def _reconnect(self) -> None:
+        await asyncio.sleep(self.retry_interval)
+        async with self.lock:
+            try:
+                await self.pubsub.reset()
+            except RedisError:
+                pass
+            # without open streams there is nothing to subscribe to, the next subscribe sets up a new pub/sub
+            self.pubsub = None
+            if self.streams:
+                self.pubsub = self.redis.pubsub()
+                await self.pubsub.subscribe(*(self.channel(user_id) for user_id in self.streams))
+        # events published while the connection was down are lost
+        self._broadcast(RESYNC)
+
+    def _confirmed(self, channel: bytes) -> None:
+        future = self.subscribed.get(int(channel.split(b":")[1]))
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def _listen(self) -> None:
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while True:
+            if self.pubsub is None or self.pubsub.connection is None:
+                # a command that is setting up the connection finishes first
+                async with self.lock:
+                    if self.pubsub is None:
+                        # idle rather than lost, the next subscribe starts another listener
+                        return
+            try:
+                if self.pubsub.connection is None:
+                    raise ConnectionError("pub/sub is not connected")
+                message = await self.pubsub.get_message(timeout=max(next_heartbeat - time.monotonic(), 0))
+            except (RedisError, ConnectionError) as err:
+                self.errors += 1
+                logger.warning("contact events: pub/sub connection lost, reconnecting: %s", err)
+                try:
+                    await self._reconnect()
+                except RedisError:
+                    pass
+                continue
+            if message is not None and message["type"] == "subscribe":
+                self._confirmed(message["channel"])
+            elif message is not None and message["type"] == "message":
+                user_id = int(message["channel"].split(b":")[1])
+                frame = self.frame(message["data"])
+                for queue in self.streams.get(user_id, ()):
+                    self._offer(queue, frame)
+                    self.delivered += 1
+            if time.monotonic() >= next_heartbeat:
+                self._broadcast(HEARTBEAT)
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+
+    async def close(self) -> None:
+        if self.listener is not None:
+            self.listener.cancel()
+        if self.pubsub is not None:
+            try:
+                await self.pubsub.reset()
+            except RedisError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.streams),
+            "streams": sum(len(queues) for queues in self.streams.values()),
+            "published": self.published,
+            "publish_errors": self.publish_errors,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+
+contact_events = ContactEvents(
+    Redis(host=settings.redis_host, port=settings.redis_port, db=0),
+    max_queue=settings.contact_events_max_queue,
+    heartbeat_interval=settings.contact_events_heartbeat_interval,
+    retry_interval=settings.contact_events_retry_interval,
+)
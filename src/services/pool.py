@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+class PoolBusy(Exception):
+    """Raised when a pool already holds max_pending calls."""
+
+
+def _timed(fn: Callable, *args) -> tuple[float, Any]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+class WorkerPool:
+    """
+    Runs blocking, CPU bound calls off the event loop in a thread or process pool.
+    At most max_pending calls may be queued or running at once; further calls are refused with PoolBusy
+    instead of piling up behind a backlog the pool can never catch up with.
+    Functions sent to a process pool must be importable module level functions.
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        if kind not in EXECUTORS:
+            raise ValueError(f"unknown pool kind {kind!r}, expected one of {', '.join(EXECUTORS)}")
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor: Executor = EXECUTORS[kind](max_workers=workers)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """
+        The run function calls fn(*args) in a worker and waits for the result without blocking the event loop.
+
+        :param self: Represent the instance of the class
+        :param fn: Callable: The blocking function
+        :param args: Positional arguments for fn
+        :return: The return value of fn
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolBusy()
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            duration, result = await asyncio.get_running_loop().run_in_executor(self.executor, _timed, fn, *args)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.run_seconds += duration
+        self.wait_seconds += max(time.perf_counter() - submitted - duration, 0.0)
+        return result
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds * 1000 / completed, 3),
+            "avg_run_ms": round(self.run_seconds * 1000 / completed, 3),
+        }
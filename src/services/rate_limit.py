@@ -0,0 +1,186 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Depends, HTTPException, Request, status
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.conf.messages import TOO_MANY_REQUESTS
+from src.services.auth import auth_service
+
+logger = logging.getLogger(__name__)
+
+# token bucket: refill by elapsed time, take one token if there is one, report the wait for the next one otherwise
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(retry_after)
+"""
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    times: int
+    seconds: float
+    by: str = "user"
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateLimitPolicy":
+        """
+        The parse function reads a policy written as times/seconds[/by], e.g. 10/60/user or 5/60/ip.
+
+        :param spec: str: The policy from the settings
+        :return: A RateLimitPolicy
+        """
+        times, seconds, *by = spec.split("/")
+        policy = cls(int(times), float(seconds), *by)
+        if policy.by not in ("user", "ip") or policy.times < 1 or policy.seconds <= 0:
+            raise ValueError(f"invalid rate limit policy {spec!r}")
+        return policy
+
+    @property
+    def rate(self) -> float:
+        return self.times / self.seconds
+
+
+class LocalBuckets:
+    """
+    Token buckets of this process, used while Redis is unavailable. The least recently used keys are dropped
+    beyond maxsize. Every worker counts on its own, so the effective limit is per worker rather than global.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def hit(self, key: str, policy: RateLimitPolicy, now: float) -> float:
+        tokens, ts = self._buckets.get(key, (policy.times, now))
+        tokens = min(policy.times, tokens + max(0.0, now - ts) * policy.rate)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / policy.rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class RateLimiter:
+    """
+    Token bucket rate limits per route policy, enforced atomically in Redis by a Lua script so that all workers share them.
+    After a Redis error the limiter uses LocalBuckets for retry_interval seconds before it tries Redis again,
+    so an outage costs one failed round trip per interval instead of one per request.
+    """
+
+    def __init__(self, redis: Redis, policies: dict[str, str], local_maxsize: int, retry_interval: float):
+        self.redis = redis
+        self.policies = {name: RateLimitPolicy.parse(spec) for name, spec in policies.items()}
+        self.local = LocalBuckets(local_maxsize)
+        self.retry_interval = retry_interval
+        self.redis_down_until = 0.0
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self.allowed = 0
+        self.limited = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def key(name: str, identity: str) -> str:
+        return f"rate:{name}:{identity}"
+
+    async def hit(self, name: str, identity: str) -> float:
+        """
+        The hit function takes one token from the bucket of identity under the policy called name.
+
+        :param self: Represent the instance of the class
+        :param name: str: Name of the policy
+        :param identity: str: Email of the user or address of the client
+        :return: 0 if the request may proceed, otherwise the seconds until the next token
+        """
+        policy = self.policies[name]
+        key = self.key(name, identity)
+        now = time.time()
+        if time.monotonic() >= self.redis_down_until:
+            try:
+                retry_after = float(await self._script(keys=[key], args=[policy.times, policy.rate, now],
+                                                       client=self.redis))
+            except RedisError as err:
+                logger.warning("rate limiter: redis failed, limiting in process: %s", err)
+                self.redis_down_until = time.monotonic() + self.retry_interval
+            else:
+                return self._count(retry_after)
+        self.fallbacks += 1
+        return self._count(self.local.hit(key, policy, now))
+
+    def _count(self, retry_after: float) -> float:
+        if retry_after > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    async def check(self, name: str, identity: str) -> None:
+        retry_after = await self.hit(name, identity)
+        if retry_after > 0:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=TOO_MANY_REQUESTS,
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+    def stats(self) -> dict:
+        return {
+            "policies": {name: f"{p.times}/{p.seconds:g}/{p.by}" for name, p in self.policies.items()},
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "local_fallbacks": self.fallbacks,
+            "redis_down": time.monotonic() < self.redis_down_until,
+        }
+
+
+rate_limiter = RateLimiter(
+    Redis(host=settings.redis_host, port=settings.redis_port, db=0),
+    policies=settings.rate_limits,
+    local_maxsize=settings.rate_limit_local_size,
+    retry_interval=settings.rate_limit_retry_interval,
+)
+
+
+def rate_limit(name: str) -> Depends:
+    """
+    The rate_limit function returns a route dependency enforcing the policy called name from the rate_limits setting.
+        Policies keyed by user count per authenticated email, policies keyed by ip per client address.
+        A name without a policy in the settings is not limited.
+
+    :param name: str: Name of the policy
+    :return: A dependency for the dependencies argument of a route
+    """
+    async def by_user(claims: dict = Depends(auth_service.get_access_claims)):
+        if name in rate_limiter.policies:
+            await rate_limiter.check(name, claims["sub"])
+
+    async def by_ip(request: Request):
+        if name in rate_limiter.policies:
+            await rate_limiter.check(name, request.client.host if request.client else "unknown")
+
+    policy = rate_limiter.policies.get(name)
+    return Depends(by_user if policy is not None and policy.by == "user" else by_ip)
@@ -0,0 +1,58 @@
+import hashlib
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+from sqlalchemy import Row
+
+
+def _encode_row(value: Any) -> Any:
+    if isinstance(value, Row):
+        return value._asdict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class RowsJSONResponse(Response):
+    """
+    A JSON response encoded by orjson, for rows selected by the repository.
+    Routes return it directly, so FastAPI skips the response_model validation and jsonable_encoder
+    for every row; response_model stays on the route for the OpenAPI schema only.
+    The rows must therefore hold exactly the fields of the response model, e.g. the CONTACT_COLUMNS of a contact.
+    Dates and datetimes are written in ISO format, like jsonable_encoder does.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_encode_row)
+
+
+def weak_etag(*parts: Any) -> str:
+    """
+    The weak_etag function builds a weak ETag from the version of a resource and everything else its body depends on.
+
+    :param parts: Any: Values that change whenever the body changes, e.g. a version and the query parameters
+    :return: The ETag, quoted and prefixed with W/
+    """
+    digest = hashlib.sha1(orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function compares the If-None-Match header of a request with the current ETag.
+        GET requests use the weak comparison, so the W/ prefix is ignored on both sides.
+
+    :param if_none_match: str | None: The header, a list of ETags or *
+    :param etag: str: The current ETag
+    :return: True if the client already has the current version
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
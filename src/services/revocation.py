@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import math
+import time
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    A set that answers "maybe" or "definitely not" for a fixed number of bits per item.
+    False positives happen at about error_rate once capacity items are added, false negatives never.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """
+    Ids (jti) of access tokens revoked before their exp.
+    Redis holds the authoritative list, a sorted set of jti scored by the exp of the token, and a version counter
+    bumped on every revocation. Every worker mirrors the list in a Bloom filter it reloads at most once per
+    sync_interval seconds, and only when the version changed, so checking a token that was not revoked costs
+    no network round trip. A positive answer of the filter is confirmed in Redis.
+    Another worker may accept a freshly revoked token until its next sync.
+    """
+
+    key = "revoked:tokens"
+    version_key = "revoked:version"
+
+    def __init__(self, redis: Redis, capacity: int, error_rate: float, sync_interval: float):
+        self.redis = redis
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.filter = BloomFilter(capacity, error_rate)
+        self.version = None
+        self.next_sync = 0.0
+        self.checks = 0
+        self.maybe = 0
+        self.confirmed = 0
+        self.syncs = 0
+        self.redis_errors = 0
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        """
+        The revoke function adds the token id to the list until the token would have expired anyway.
+
+        :param self: Represent the instance of the class
+        :param jti: str: Id of the access token
+        :param exp: float: The exp claim of the token
+        :return: None
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.key, {jti: exp})
+            pipe.zremrangebyscore(self.key, "-inf", time.time())
+            pipe.incr(self.version_key)
+            await pipe.execute()
+        self.filter.add(jti)
+
+    async def sync(self) -> None:
+        """
+        The sync function rebuilds the Bloom filter from Redis if another worker revoked a token since the last sync.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        self.next_sync = time.monotonic() + self.sync_interval
+        try:
+            version = await self.redis.get(self.version_key)
+            if version == self.version:
+                return
+            jtis = await self.redis.zrangebyscore(self.key, time.time(), "+inf")
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.warning("revocation list: sync failed: %s", err)
+            return
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti.decode() if isinstance(jti, bytes) else jti)
+        self.filter = bloom
+        self.version = version
+        self.syncs += 1
+
+    async def is_revoked(self, jti: str) -> bool:
+        """
+        The is_revoked function tells whether the access token with this id was revoked.
+        If Redis cannot confirm a positive answer of the filter, the token is treated as revoked.
+
+        :param self: Represent the instance of the class
+        :param jti: str: Id of the access token
+        :return: True if the token was revoked
+        """
+        if time.monotonic() >= self.next_sync:
+            await self.sync()
+        self.checks += 1
+        if jti not in self.filter:
+            return False
+        self.maybe += 1
+        try:
+            exp = await self.redis.zscore(self.key, jti)
+        except RedisError as err:
+            self.redis_errors += 1
+            logger.warning("revocation list: confirm failed: %s", err)
+            return True
+        if exp is None or exp < time.time():
+            return False
+        self.confirmed += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "filter_items": self.filter.count,
+            "filter_bits": self.filter.size,
+            "checks": self.checks,
+            "maybe_revoked": self.maybe,
+            "revoked": self.confirmed,
+            "syncs": self.syncs,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,190 @@
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from redis.asyncio import Redis
+
+from src.conf.config import settings
+
+ROTATED = "rotated"
+REUSED = "reused"
+MISSING = "missing"
+
+# swap the token id of a session only if the presented one is current; a stale one kills the session
+ROTATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'jti')
+if not current then
+    return 0
+end
+if current ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return -1
+end
+redis.call('HSET', KEYS[1], 'jti', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+ROTATE_RESULTS = {1: ROTATED, 0: MISSING, -1: REUSED}
+
+
+class SessionStore(ABC):
+    """
+    Refresh token sessions, one per logged in device.
+    A session remembers the id (jti) of the only refresh token that may be exchanged next.
+    Every refresh replaces it, and presenting an older token of the session revokes the whole session,
+    because the token must have been copied.
+    """
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    @abstractmethod
+    async def create(self, email: str, jti: str, ttl: int) -> str:
+        ...
+
+    @abstractmethod
+    async def rotate(self, sid: str, jti: str, new_jti: str, ttl: int) -> str:
+        ...
+
+    @abstractmethod
+    async def revoke(self, sid: str) -> None:
+        ...
+
+    @abstractmethod
+    async def sessions(self, email: str) -> list[str]:
+        ...
+
+    async def revoke_all(self, email: str) -> None:
+        for sid in await self.sessions(email):
+            await self.revoke(sid)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis: a hash session:{sid} with the owner and the current jti, expiring with the refresh token,
+    and a set sessions:{email} with the session ids of every user.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._rotate = redis.register_script(ROTATE_SCRIPT)
+
+    @staticmethod
+    def key(sid: str) -> str:
+        return f"session:{sid}"
+
+    @staticmethod
+    def user_key(email: str) -> str:
+        return f"sessions:{email}"
+
+    async def create(self, email: str, jti: str, ttl: int) -> str:
+        """
+        The create function opens a new session for the user.
+
+        :param self: Represent the instance of the class
+        :param email: str: Owner of the session
+        :param jti: str: Id of the first refresh token of the session
+        :param ttl: int: Seconds until the session expires unless it is refreshed
+        :return: The id of the new session
+        """
+        sid = self.new_id()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.key(sid), mapping={"email": email, "jti": jti, "created_at": int(time.time())})
+            pipe.expire(self.key(sid), ttl)
+            pipe.sadd(self.user_key(email), sid)
+            pipe.expire(self.user_key(email), ttl)
+            await pipe.execute()
+        return sid
+
+    async def rotate(self, sid: str, jti: str, new_jti: str, ttl: int) -> str:
+        """
+        The rotate function replaces the current token id of the session in one atomic step.
+
+        :param self: Represent the instance of the class
+        :param sid: str: Id of the session
+        :param jti: str: Id of the presented refresh token
+        :param new_jti: str: Id of the refresh token issued in exchange
+        :param ttl: int: New lifetime of the session
+        :return: ROTATED, REUSED if jti is not the current token (the session is gone afterwards) or MISSING
+        """
+        result = await self._rotate(keys=[self.key(sid)], args=[jti, new_jti, ttl], client=self.redis)
+        return ROTATE_RESULTS[int(result)]
+
+    async def revoke(self, sid: str) -> None:
+        email = await self.redis.hget(self.key(sid), "email")
+        await self.redis.delete(self.key(sid))
+        if email is not None:
+            await self.redis.srem(self.user_key(email.decode() if isinstance(email, bytes) else email), sid)
+
+    async def sessions(self, email: str) -> list[str]:
+        """
+        The sessions function returns the ids of the live sessions of the user and forgets the expired ones.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: A list of session ids
+        """
+        sids = [sid.decode() if isinstance(sid, bytes) else sid
+                for sid in await self.redis.smembers(self.user_key(email))]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for sid in sids:
+                pipe.exists(self.key(sid))
+            alive = await pipe.execute()
+        expired = [sid for sid, exists in zip(sids, alive) if not exists]
+        if expired:
+            await self.redis.srem(self.user_key(email), *expired)
+        return [sid for sid, exists in zip(sids, alive) if exists]
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions in a dictionary of this process, for development and tests with a single worker.
+    """
+
+    def __init__(self):
+        self.data: dict[str, dict] = {}
+
+    def _get(self, sid: str) -> dict | None:
+        session = self.data.get(sid)
+        if session is not None and session["expires"] < time.monotonic():
+            del self.data[sid]
+            return None
+        return session
+
+    async def create(self, email: str, jti: str, ttl: int) -> str:
+        sid = self.new_id()
+        self.data[sid] = {"email": email, "jti": jti, "created_at": int(time.time()),
+                          "expires": time.monotonic() + ttl}
+        return sid
+
+    async def rotate(self, sid: str, jti: str, new_jti: str, ttl: int) -> str:
+        session = self._get(sid)
+        if session is None:
+            return MISSING
+        if session["jti"] != jti:
+            del self.data[sid]
+            return REUSED
+        session.update(jti=new_jti, expires=time.monotonic() + ttl)
+        return ROTATED
+
+    async def revoke(self, sid: str) -> None:
+        self.data.pop(sid, None)
+
+    async def sessions(self, email: str) -> list[str]:
+        return [sid for sid in list(self.data) if (session := self._get(sid)) and session["email"] == email]
+
+
+def build_session_store(kind: str) -> SessionStore:
+    """
+    The build_session_store function creates the session store named by the session_store setting.
+
+    :param kind: str: redis or memory
+    :return: A SessionStore
+    """
+    if kind == "redis":
+        return RedisSessionStore(Redis(host=settings.redis_host, port=settings.redis_port, db=0))
+    if kind == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"unknown session store {kind!r}, expected redis or memory")
@@ -0,0 +1,172 @@
+"""
+Queues a daily digest email for every user with the contacts whose birthday is coming up.
+Runs once from the command line, e.g. from cron, or as its own process that runs every day at birthday_digest_hour (UTC):
+
+    python -m src.workers.birthday_digest --once [--date 2024-03-14] [--after-user-id 1000]
+    python -m src.workers.birthday_digest
+
+The digests are written to the email outbox and sent by the outbox worker.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from datetime import date, datetime, timedelta
+from typing import List
+
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf.config import settings
+from src.database.connect_db import AsyncSessionLocal
+from src.repository import contacts as repository_contacts
+from src.repository import outbox as repository_outbox
+
+logger = logging.getLogger(__name__)
+
+
+class UserDigest:
+    """
+    The upcoming birthdays of one user, collected while the rows of the user stream by.
+    At most max_contacts contacts are kept, the others are only counted.
+    """
+
+    def __init__(self, user_id: int, email: str, username: str, first_ordinal: int, max_contacts: int):
+        self.user_id = user_id
+        self.email = email
+        self.username = username
+        self.first_ordinal = first_ordinal
+        self.max_contacts = max_contacts
+        self.this_year: List[dict] = []
+        self.next_year: List[dict] = []
+        self.total = 0
+
+    def add(self, row: Row) -> None:
+        # rows come in calendar order, so for a window crossing 31 December the January rows arrive first
+        # although their birthdays are the latest ones
+        self.total += 1
+        part = self.this_year if row.birthday_ordinal >= self.first_ordinal else self.next_year
+        if len(part) < self.max_contacts:
+            part.append({"first_name": row.first_name, "last_name": row.last_name,
+                         "birthday": row.birthday.isoformat()})
+
+    def payload(self, days: int) -> dict:
+        contacts = (self.this_year + self.next_year)[:self.max_contacts]
+        return {"username": self.username, "days": days, "contacts": contacts, "more": self.total - len(contacts)}
+
+
+class BirthdayDigestJob:
+    """
+    Reads the upcoming birthdays of all users in one pass over the contacts in (user_id, birthday_ordinal) order
+    and queues one digest per user in the email outbox, committing every batch_size digests.
+    Memory holds one fetch of rows and one batch of digests at a time, whatever the number of contacts.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, days: int, max_contacts: int, batch_size: int,
+                 fetch_size: int):
+        self.session_factory = session_factory
+        self.days = days
+        self.max_contacts = max_contacts
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self.digests = 0
+        self.contacts = 0
+        self.last_user_id = 0
+
+    async def _enqueue(self, digests: List[UserDigest], start: date) -> None:
+        if not digests:
+            return
+        async with self.session_factory() as db:
+            self.digests += await repository_outbox.enqueue_emails_once("birthday_digest", [
+                (f"birthday_digest:{digest.user_id}:{start.isoformat()}", digest.email, digest.payload(self.days))
+                for digest in digests
+            ], db)
+        self.contacts += sum(digest.total for digest in digests)
+        self.last_user_id = digests[-1].user_id
+        logger.info("birthday digest: %s digests queued, up to user %s", self.digests, self.last_user_id)
+        digests.clear()
+
+    async def run_once(self, today: date | None = None, after_user_id: int = 0) -> int:
+        """
+        The run_once function queues the digests of the window starting today.
+            The outbox rows are written by their own sessions, so the reading cursor stays open for the whole pass.
+            A digest is queued once per user and day, so running the job again for the same day, e.g. after it
+            stopped half way, only queues the missing digests; after_user_id set to the last_user_id it logged
+            saves reading the users done already.
+
+        :param self: Represent the instance of the class
+        :param today: date | None: The first day of the window, defaults to birthday_today
+        :param after_user_id: int: Skip the users up to this id
+        :return: The number of digests queued by this run, without those queued before
+        """
+        start = today or repository_contacts.birthday_today()
+        first_ordinal = repository_contacts.birthday_windows(start, self.days)[0][0]
+        queued = self.digests
+        self.last_user_id = after_user_id
+        pending: List[UserDigest] = []
+        current: UserDigest | None = None
+        async with self.session_factory() as db:
+            async for partition in repository_contacts.stream_upcoming_birthdays(start, self.days, db, after_user_id,
+                                                                                 self.fetch_size):
+                for row in partition:
+                    if current is None or row.user_id != current.user_id:
+                        if current is not None:
+                            pending.append(current)
+                            if len(pending) >= self.batch_size:
+                                await self._enqueue(pending, start)
+                        current = UserDigest(row.user_id, row.email, row.username, first_ordinal, self.max_contacts)
+                    current.add(row)
+        if current is not None:
+            pending.append(current)
+        await self._enqueue(pending, start)
+        return self.digests - queued
+
+    async def run(self, hour: int, stop: asyncio.Event) -> None:
+        """
+        The run function runs the job every day at hour UTC until stop is set.
+
+        :param self: Represent the instance of the class
+        :param hour: int: Hour of the day the digests are queued
+        :param stop: asyncio.Event: Set to finish
+        :return: None
+        """
+        while not stop.is_set():
+            now = datetime.utcnow()
+            next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=(next_run - now).total_seconds())
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run_once(next_run.date())
+            except Exception:
+                logger.exception("birthday digest: run failed after user %s", self.last_user_id)
+
+
+async def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="queue the digests now and exit")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="first day of the window, with --once")
+    parser.add_argument("--after-user-id", type=int, default=0, help="resume after this user, with --once")
+    parser.add_argument("--days", type=int, default=settings.birthday_digest_days)
+    args = parser.parse_args(argv)
+
+    job = BirthdayDigestJob(AsyncSessionLocal, days=args.days, max_contacts=settings.birthday_digest_max_contacts,
+                            batch_size=settings.birthday_digest_batch_size,
+                            fetch_size=settings.birthday_digest_fetch_size)
+    if args.once:
+        await job.run_once(args.date, args.after_user_id)
+        return
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await job.run(settings.birthday_digest_hour, stop)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""
+Sends the messages of the email outbox. Runs as its own process next to the web workers:
+
+    python -m src.workers.email_outbox
+"""
+import asyncio
+import logging
+import signal
+from collections import defaultdict
+from typing import List
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf.config import settings
+from src.database.connect_db import AsyncSessionLocal
+from src.database.models import EmailOutbox
+from src.repository import outbox as repository_outbox
+from src.services.email import MESSAGE_BUILDERS, SMTPPool, smtp_pool_from_settings
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxSender:
+    """
+    Claims due messages of the outbox in batches and sends every batch concurrently over a pool of SMTP connections.
+    A batch is leased for lease seconds and sent outside of a transaction, so no row stays locked while the SMTP
+    server answers; a batch of a worker that died is claimed again once the lease ran out.
+    A message that cannot be sent is retried with exponential backoff and marked failed after max_attempts.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, smtp: SMTPPool, batch_size: int, lease: float,
+                 max_attempts: int, backoff_base: float, backoff_max: float):
+        self.session_factory = session_factory
+        self.smtp = smtp
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sent = 0
+        self.failed_attempts = 0
+
+    async def deliver(self, messages: List[EmailOutbox]) -> List[BaseException | None]:
+        """
+        The deliver function renders the messages kind by kind and sends them concurrently.
+
+        :param self: Represent the instance of the class
+        :param messages: List[EmailOutbox]: The claimed outbox rows
+        :return: For every row None if it was sent, otherwise the error
+        """
+        results: List[BaseException | None] = [None] * len(messages)
+        by_kind = defaultdict(list)
+        for position, message in enumerate(messages):
+            by_kind[message.kind].append(position)
+        sends = {}
+        for kind, positions in by_kind.items():
+            try:
+                built = MESSAGE_BUILDERS[kind]([(messages[p].recipient, messages[p].payload) for p in positions])
+            except Exception as err:
+                for position in positions:
+                    results[position] = err
+                continue
+            sends.update({position: self.smtp.send(email) for position, email in zip(positions, built)})
+        outcomes = await asyncio.gather(*sends.values(), return_exceptions=True)
+        for position, outcome in zip(sends, outcomes):
+            results[position] = outcome
+        return results
+
+    async def run_once(self) -> int:
+        """
+        The run_once function sends one batch of due messages and records the outcome of each.
+
+        :param self: Represent the instance of the class
+        :return: The number of messages in the batch
+        """
+        async with self.session_factory() as db:
+            messages = await repository_outbox.claim_batch(self.batch_size, self.lease, db)
+        if not messages:
+            return 0
+        results = await self.deliver(messages)
+        async with self.session_factory() as db:
+            rows = {row.id: row for row in await repository_outbox.leased(messages, db)}
+            for message, result in zip(messages, results):
+                if result is not None:
+                    self.failed_attempts += 1
+                    logger.warning("outbox: message %s to %s failed: %r", message.id, message.recipient, result)
+                else:
+                    self.sent += 1
+                row = rows.get(message.id)
+                if row is None:
+                    logger.warning("outbox: lease of message %s ran out, another worker claimed it again", message.id)
+                elif result is not None:
+                    repository_outbox.mark_attempt_failed(row, repr(result), self.max_attempts,
+                                                          self.backoff_base, self.backoff_max)
+                else:
+                    repository_outbox.mark_sent(row)
+            await db.commit()
+        return len(messages)
+
+    async def run(self, poll_interval: float, stop: asyncio.Event) -> None:
+        """
+        The run function sends batches until stop is set. Full batches are followed by the next one right away,
+        otherwise the outbox is polled again after poll_interval seconds.
+
+        :param self: Represent the instance of the class
+        :param poll_interval: float: Seconds between polls of an empty outbox
+        :param stop: asyncio.Event: Set to finish after the current batch
+        :return: None
+        """
+        try:
+            while not stop.is_set():
+                try:
+                    count = await self.run_once()
+                except Exception:
+                    logger.exception("outbox: batch failed")
+                    count = 0
+                if count < self.batch_size:
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await self.smtp.close()
+
+
+async def main() -> None:
+    sender = OutboxSender(AsyncSessionLocal, smtp_pool_from_settings(), batch_size=settings.outbox_batch_size,
+                          lease=settings.outbox_lease, max_attempts=settings.outbox_max_attempts,
+                          backoff_base=settings.outbox_backoff_base, backoff_max=settings.outbox_backoff_max)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await sender.run(settings.outbox_poll_interval, stop)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
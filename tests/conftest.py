@@ -1,23 +1,38 @@
 import sys
 import os
+from unittest.mock import AsyncMock, MagicMock
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from redis.exceptions import ConnectionError
+from sqlalchemy.pool import NullPool
 sys.path.append(os.getcwd())
 
 from src.main import app
 from src.database.models import Base
 from src.database.connect_db import get_db
+from src.services.auth import auth_service
+from src.services.cache import contacts_cache
+from src.services.events import contact_events
+from src.services.sessions import MemorySessionStore
+from src.services.rate_limit import rate_limiter
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient runs every request on a fresh event loop, so connections must not be pooled between them
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 @pytest.fixture(scope="module")
 def session():
@@ -37,17 +52,39 @@ def session():
 def client(session):
     # Dependency override
 
-    def override_get_db():
-        try:
-            yield session
-        finally:
-            session.close()
+    async def override_get_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
 
     app.dependency_overrides[get_db] = override_get_db
+    auth_service.user_cache.local.clear()
+    auth_service.token_cache.entries.clear()
+    auth_service.session_store = MemorySessionStore()
+    # no test may reach a real Redis: the user cache always misses and no token is revoked
+    auth_service.user_cache.redis = AsyncMock()
+    auth_service.user_cache.redis.get.return_value = None
+    auth_service.revocations.redis = MagicMock(get=AsyncMock(return_value=None),
+                                               zrangebyscore=AsyncMock(return_value=[]),
+                                               zscore=AsyncMock(return_value=None))
+    auth_service.revocations.redis.pipeline.return_value.__aenter__.return_value = MagicMock(execute=AsyncMock())
+    # every lookup misses, the cache itself is covered by test_unit_service_cache
+    contacts_cache.redis = AsyncMock()
+    contacts_cache.redis.get.return_value = None
+    contact_events.redis = AsyncMock()
 
     yield TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def rate_limits():
+    # tests log in and list contacts far more often than the policies allow a single client
+    # and the limiter counts in process, as it does while Redis is down
+    rate_limiter.redis = AsyncMock()
+    rate_limiter.redis.evalsha.side_effect = ConnectionError("no redis in tests")
+    rate_limiter.local.clear()
+    yield
+
+
 @pytest.fixture(scope="module")
 def user():
     return {"username": "deadpool", "email": "deadpool@example.com", "password": "123456789"}
\ No newline at end of file
@@ -1,10 +1,13 @@
 import sys
 import os
-from unittest.mock import MagicMock
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 sys.path.append(os.getcwd())
 
-from src.database.models import User
-from src.conf.messages import ALREADY_EXISTS, EMAIL_NOT_CONFIRMED, INVALID_PASSWORD, INVALID_EMAIL
+from src.database.models import EmailOutbox, User
+from src.services.auth import auth_service
+from src.conf.messages import (ALREADY_EXISTS, EMAIL_NOT_CONFIRMED, INVALID_PASSWORD, INVALID_EMAIL, INVALID_TOKEN,
+    TOO_MANY_REQUESTS)
 
 def test_create_user(client, user, monkeypatch):
     mock_send_email = MagicMock()
@@ -19,6 +22,13 @@ def test_create_user(client, user, monkeypatch):
     assert "id" in data["user"]
 
 
+def test_create_user_queues_confirmation_email(client, session, user):
+    message = session.query(EmailOutbox).filter(EmailOutbox.recipient == user.get("email")).one()
+    assert message.kind == "confirm_email"
+    assert message.status == "pending"
+    assert message.payload == {"username": user.get("username"), "host": "http://testserver/"}
+
+
 def test_repeat_create_user(client, user):
     response = client.post(
         "/api/auth/signup",
@@ -69,4 +79,83 @@ def test_login_wrong_email(client, user):
     )
     assert response.status_code == 401, response.text
     data = response.json()
-    assert data["detail"] == INVALID_EMAIL
\ No newline at end of file
+    assert data["detail"] == INVALID_EMAIL
+
+
+def login(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["refresh_token"]
+
+
+def refresh(client, refresh_token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+
+
+def test_refresh_token_rotates(client, user):
+    first = login(client, user)
+    response = refresh(client, first)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["refresh_token"] != first
+    assert refresh(client, data["refresh_token"]).status_code == 200
+
+
+def test_refresh_token_reuse_revokes_session(client, user):
+    first = login(client, user)
+    second = refresh(client, first).json()["refresh_token"]
+    response = refresh(client, first)
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == INVALID_TOKEN
+    assert refresh(client, second).status_code == 401
+
+
+def test_sessions_of_devices_are_independent(client, user):
+    phone = login(client, user)
+    laptop = login(client, user)
+    second = refresh(client, phone).json()["refresh_token"]
+    assert refresh(client, phone).status_code == 401
+    assert refresh(client, second).status_code == 401
+    assert refresh(client, laptop).status_code == 200
+
+
+def test_access_token_is_not_a_refresh_token(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert refresh(client, response.json()["access_token"]).status_code == 401
+
+
+def test_logout_revokes_access_token_and_session(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    tokens = response.json()
+    redis_mock = MagicMock(get=AsyncMock(return_value=None), zrangebyscore=AsyncMock(return_value=[]),
+                           zscore=AsyncMock(return_value=time.time() + 3600))
+    redis_mock.pipeline.return_value.__aenter__.return_value = MagicMock(execute=AsyncMock())
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    with patch.object(auth_service.revocations, 'redis', redis_mock), \
+            patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        assert client.get("/api/users/me/", headers=headers).status_code == 200
+        response = client.post("/api/auth/logout", headers=headers)
+        assert response.status_code == 204, response.text
+        assert client.get("/api/users/me/", headers=headers).status_code == 401
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+
+
+def test_login_is_rate_limited_per_ip(client, user):
+    responses = [
+        client.post("/api/auth/login", data={"username": user.get('email'), "password": 'password'})
+        for _ in range(11)
+    ]
+    assert [r.status_code for r in responses[:10]] == [401] * 10
+    assert responses[10].status_code == 429, responses[10].text
+    assert responses[10].json()["detail"] == TOO_MANY_REQUESTS
+    assert int(responses[10].headers["Retry-After"]) > 0
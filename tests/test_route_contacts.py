@@ -1,13 +1,18 @@
 import sys
 import os
+import json
+from datetime import date, datetime, timedelta
 
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 
 sys.path.append(os.getcwd())
-from src.database.models import User
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import Contact, ContactTombstone, User
 from src.services.auth import auth_service
-from src.conf.messages import NOT_FOUND
+from src.conf.messages import NOT_FOUND, INVALID_CURSOR, UNSUPPORTED_IMPORT_FORMAT, UNKNOWN_FIELDS, INVALID_SYNC_TOKEN, \
+    SYNC_TOKEN_EXPIRED
 
 @pytest.fixture()
 def token(client, user, session, monkeypatch):
@@ -25,7 +30,7 @@ def token(client, user, session, monkeypatch):
     return data["access_token"]
 
 def test_get_contacts_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts",
@@ -37,7 +42,7 @@ def test_get_contacts_not_found(client, token):
 
 
 def test_create_contact(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.post(
             "/api/contacts",
@@ -59,7 +64,7 @@ def test_create_contact(client, token):
         assert "id" in data
 
 def test_get_contacts(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts",
@@ -71,8 +76,38 @@ def test_get_contacts(client, token):
         assert data[0]["first_name"] == "Cristiano"
         assert "id" in data[0]
 
+def test_get_contacts_by_cursor(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts",
+            params={"limit": 1},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(
+            "/api/contacts",
+            params={"limit": 1, "cursor": cursor},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404, response.text
+        assert "X-Next-Cursor" not in response.headers
+
+def test_get_contacts_invalid_cursor(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts",
+            params={"cursor": "garbage"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 400, response.text
+        data = response.json()
+        assert data["detail"] == INVALID_CURSOR
+
 def test_get_contact_by_id(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_id/1",
@@ -87,7 +122,7 @@ def test_get_contact_by_id(client, token):
         assert "id" in data
 
 def test_get_contact_by_id_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_id/2",
@@ -97,8 +132,72 @@ def test_get_contact_by_id_not_found(client, token):
         data = response.json()
         assert data["detail"] == NOT_FOUND
 
+def test_get_contacts_sparse_fields(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts",
+            params={"fields": "first_name,phone"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.json() == [{"id": 1, "first_name": "Cristiano", "phone": "123123123"}]
+
+def test_get_contact_by_id_sparse_fields(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/by_id/1",
+            params={"fields": "email"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.json() == {"id": 1, "email": "cr7@gmail.com"}
+
+def test_get_contacts_unknown_fields(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/search",
+            params={"q": "ronaldo", "fields": "first_name,user_id"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == f"{UNKNOWN_FIELDS}: user_id"
+
+def test_get_contacts_not_modified(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/api/contacts", headers=headers)
+        assert response.status_code == 200, response.text
+        etag = response.headers["ETag"]
+        assert etag.startswith('W/"')
+        response = client.get("/api/contacts", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304, response.text
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        response = client.get("/api/contacts", params={"limit": 5}, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200, response.text
+
+def test_get_contact_by_id_not_modified_until_changed(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {token}"}
+        etag = client.get("/api/contacts/by_id/1", headers=headers).headers["ETag"]
+        list_etag = client.get("/api/contacts", headers=headers).headers["ETag"]
+        response = client.get("/api/contacts/by_id/1", headers={**headers, "If-None-Match": f'"other", {etag}'})
+        assert response.status_code == 304, response.text
+        response = client.patch("/api/contacts/1", json={"phone": "123123123"}, headers=headers)
+        assert response.status_code == 200, response.text
+        response = client.get("/api/contacts/by_id/1", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200, response.text
+        assert response.headers["ETag"] != etag
+        response = client.get("/api/contacts", headers={**headers, "If-None-Match": list_etag})
+        assert response.status_code == 200, response.text
+
 def test_get_contacts_by_fname(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_fname/cristi",
@@ -113,7 +212,7 @@ def test_get_contacts_by_fname(client, token):
         assert data[0]["phone"] == "123123123"
 
 def test_get_contacts_by_fname_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_fname/putin_die_pls",
@@ -125,7 +224,7 @@ def test_get_contacts_by_fname_not_found(client, token):
         
         
 def test_get_contacts_by_lname(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_lname/ron",
@@ -140,7 +239,7 @@ def test_get_contacts_by_lname(client, token):
         assert data[0]["phone"] == "123123123"
 
 def test_get_contacts_by_lname_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_lname/putin_die_pls",
@@ -151,7 +250,7 @@ def test_get_contacts_by_lname_not_found(client, token):
         assert data["detail"] == NOT_FOUND
         
 def test_get_contacts_by_email(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_email/cr7",
@@ -166,7 +265,7 @@ def test_get_contacts_by_email(client, token):
         assert data[0]["phone"] == "123123123"
 
 def test_get_contacts_by_email_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/by_email/putin_die_pls@gmail.com",
@@ -176,8 +275,33 @@ def test_get_contacts_by_email_not_found(client, token):
         data = response.json()
         assert data["detail"] == NOT_FOUND 
 
+def test_search_contacts(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        for q in ("ronal", "cristiano RON", "gmail", "1231"):
+            response = client.get(
+                "/api/contacts/search",
+                params={"q": q},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            assert response.status_code == 200, response.text
+            data = response.json()
+            assert data[0]["first_name"] == "Cristiano"
+
+def test_search_contacts_not_found(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/search",
+            params={"q": "cristiano messi"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404, response.text
+        data = response.json()
+        assert data["detail"] == NOT_FOUND
+
 def test_update_contact(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.put(
             "/api/contacts/1",
@@ -199,7 +323,7 @@ def test_update_contact(client, token):
 
 
 def test_update_contact_not_found(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.put(
             "/api/contacts/2",
@@ -215,11 +339,56 @@ def test_update_contact_not_found(client, token):
         data = response.json()
         assert data["detail"] == NOT_FOUND
         
+def test_patch_contact(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.patch(
+            "/api/contacts/1",
+            json={"phone": "777"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["first_name"] == "Artur"
+        assert data["phone"] == "777"
+        response = client.patch(
+            "/api/contacts/1",
+            json={"phone": "123123123"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.json()["phone"] == "123123123"
+
+
+def test_patch_contact_null_field(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.patch(
+            "/api/contacts/1",
+            json={"first_name": None},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 422, response.text
+
+
+def test_patch_contact_not_found(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.patch(
+            "/api/contacts/2",
+            json={"phone": "777"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404, response.text
+        data = response.json()
+        assert data["detail"] == NOT_FOUND
+
+
 def test_get_contacts_with_birthday(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.get(
             "/api/contacts/birthday/",
+            params={"days": 366},
             headers={"Authorization": f"Bearer {token}"}
         )
         assert response.status_code == 200, response.text
@@ -231,8 +400,40 @@ def test_get_contacts_with_birthday(client, token):
         assert data[0]["phone"] == "123123123"
 
 
+def test_get_contacts_with_upcoming_birthday(client, token):
+    birthday = date.today() + timedelta(days=3)
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        client.post(
+            "/api/contacts",
+            json={
+                "first_name": "Lionel",
+                "last_name": "Messi",
+                "email": "lm10@gmail.com",
+                "phone": "321321321",
+                "birthday": birthday.isoformat()
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        response = client.get(
+            "/api/contacts/birthday",
+            params={"days": 3},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert "Lionel" in [contact["first_name"] for contact in data]
+        response = client.get(
+            "/api/contacts/birthday",
+            params={"days": 2},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        names = [contact["first_name"] for contact in response.json()] if response.status_code == 200 else []
+        assert "Lionel" not in names
+
+
 def test_delete_contact(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.delete(
             "/api/contacts/1",
@@ -242,7 +443,7 @@ def test_delete_contact(client, token):
 
 
 def test_repeat_delete_contact(client, token):
-    with patch.object(auth_service, 'redis_cache') as r_mock:
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
         r_mock.get.return_value = None
         response = client.delete(
             "/api/contacts/1",
@@ -250,4 +451,260 @@ def test_repeat_delete_contact(client, token):
         )
         assert response.status_code == 404, response.text
         data = response.json()
-        assert data["detail"] == NOT_FOUND
\ No newline at end of file
+        assert data["detail"] == NOT_FOUND
+
+def test_import_contacts_csv(client, token):
+    # with a byte order mark, CRLF line endings and a quoted field spanning two lines
+    content = (
+        "\ufefffirst_name,last_name,email,phone,birthday\r\n"
+        "Andriy,Shevchenko,sheva7@gmail.com,777,1976-09-29\r\n"
+        "Serhiy,\"Rebrov\r\njr\",rebrov@gmail.com,111,not a date\r\n"
+        "Oleh,Blokhin,blokhin@gmail.com,11,1952-11-05\r\n"
+    ).encode()
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.post(
+            "/api/contacts/import",
+            files={"file": ("contacts.csv", content, "text/csv")},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["imported"] == 2
+        assert data["failed"] == 1
+        assert data["errors"][0]["row"] == 2
+        assert data["errors"][0]["errors"][0]["loc"] == ["birthday"]
+        response = client.get(
+            "/api/contacts/by_lname/blokhin",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+
+
+def test_import_contacts_ndjson(client, token):
+    content = (
+        '{"first_name": "Ruslan", "last_name": "Rotan", "email": "rotan@gmail.com", "phone": "29", "birthday": "1981-10-29"}\n'
+        '\n'
+        '{"first_name": "Ruslan"\n'
+    )
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.post(
+            "/api/contacts/import",
+            params={"format": "ndjson"},
+            files={"file": ("contacts.txt", content)},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["imported"] == 1
+        assert data["failed"] == 1
+        assert data["errors"][0]["row"] == 2
+
+
+def test_import_contacts_unknown_format(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.post(
+            "/api/contacts/import",
+            files={"file": ("contacts.xlsx", b"PK")},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 400, response.text
+        data = response.json()
+        assert data["detail"] == UNSUPPORTED_IMPORT_FORMAT
+
+
+def test_export_contacts(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts/export",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert "Andriy" in [row["first_name"] for row in rows]
+        assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+
+        response = client.get(
+            "/api/contacts/export",
+            params={"format": "csv"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        lines = response.text.splitlines()
+        assert lines[0] == "id,first_name,last_name,email,phone,birthday"
+        assert len(lines) == len(rows) + 1
+
+        response = client.get(
+            "/api/contacts/export",
+            params={"format": "vcf"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.text.count("BEGIN:VCARD") == len(rows)
+        assert "N:Shevchenko;Andriy;;;\r\n" in response.text
+        assert "BDAY:1976-09-29\r\n" in response.text
+
+
+def test_bulk_update_contacts(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        ids = [contact["id"] for contact in response.json()]
+        response = client.post(
+            "/api/contacts/bulk/update",
+            json={"ids": ids + [99999], "changes": {"phone": "000"}},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.json()["affected"] == len(ids)
+        response = client.get(
+            "/api/contacts",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert {contact["phone"] for contact in response.json()} == {"000"}
+
+
+def test_bulk_delete_contacts(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get(
+            "/api/contacts",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        ids = [contact["id"] for contact in response.json()]
+        response = client.post(
+            "/api/contacts/bulk/delete",
+            json={"ids": ids},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert response.json()["affected"] == len(ids)
+        response = client.get(
+            "/api/contacts",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 404, response.text
+
+
+def test_contact_changes(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/api/contacts/changes", headers=headers)
+        assert response.status_code == 200, response.text
+        data = response.json()
+        # the earlier tests deleted every contact, only their tombstones are left
+        assert data["upserts"] == []
+        assert data["deleted"] and data["more"] is False
+        since = data["next"]
+
+        response = client.get("/api/contacts/changes", params={"since": since}, headers=headers)
+        assert response.json() == {"upserts": [], "deleted": [], "next": since, "more": False}
+
+        contact = client.post("/api/contacts", json={"first_name": "Serhiy", "last_name": "Rebrov",
+                                                     "email": "rebrov@example.com", "phone": "11",
+                                                     "birthday": "1974-06-03"}, headers=headers).json()
+        data = client.get("/api/contacts/changes", params={"since": since}, headers=headers).json()
+        assert [change["id"] for change in data["upserts"]] == [contact["id"]]
+        assert data["upserts"][0]["phone"] == "11" and "updated_at" in data["upserts"][0]
+        assert data["deleted"] == []
+
+        client.delete(f"/api/contacts/{contact['id']}", headers=headers)
+        data = client.get("/api/contacts/changes", params={"since": data["next"]}, headers=headers).json()
+        assert data["upserts"] == [] and data["deleted"] == [contact["id"]]
+
+
+def test_contact_changes_invalid_token(client, token):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        response = client.get("/api/contacts/changes", params={"since": "bogus"},
+                              headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == INVALID_SYNC_TOKEN
+
+
+def test_contact_changes_after_purge(client, token, user, session):
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {token}"}
+        since = client.get("/api/contacts/changes", headers=headers).json()["next"]
+        # a tombstone deleted after the position of since is purged
+        current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+        current_user.tombstones_purged_until = datetime.utcnow()
+        session.commit()
+        contact = client.post("/api/contacts", json={"first_name": "Andriy", "last_name": "Voronin",
+                                                     "email": "voronin@example.com", "phone": "12",
+                                                     "birthday": "1979-07-21"}, headers=headers).json()
+        response = client.get("/api/contacts/changes", params={"since": since}, headers=headers)
+        assert response.status_code == 410, response.text
+        assert response.json()["detail"] == SYNC_TOKEN_EXPIRED
+
+        # a token of a position after the purge is fine
+        since = client.get("/api/contacts/changes", headers=headers).json()["next"]
+        client.delete(f"/api/contacts/{contact['id']}", headers=headers)
+        data = client.get("/api/contacts/changes", params={"since": since}, headers=headers).json()
+        assert data["deleted"] == [contact["id"]]
+
+
+def test_contact_changes_with_commit_between_reads(client, token, user, session):
+    execute = AsyncSession.execute
+    interleaved = []
+
+    async def execute_then_commit(db, statement, *args, **kwargs):
+        result = await execute(db, statement, *args, **kwargs)
+        if not interleaved and "contacts.updated_at" in str(statement):
+            # another request commits a contact and then a later deletion while the changes are read
+            current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+            now = datetime.utcnow()
+            contact = Contact(first_name="Oleh", last_name="Luzhnyi", email="luzhnyi@example.com", phone="2",
+                              birthday=date(1968, 8, 5), user_id=current_user.id, updated_at=now)
+            session.add(contact)
+            session.flush()
+            session.add(ContactTombstone(contact_id=contact.id + 1000, user_id=current_user.id,
+                                         deleted_at=now + timedelta(seconds=1)))
+            current_user.contacts_version += 1
+            session.commit()
+            interleaved.append(contact.id)
+        return result
+
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock:
+        r_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {token}"}
+        since = client.get("/api/contacts/changes", headers=headers).json()["next"]
+        client.post("/api/contacts", json={"first_name": "Vitaliy", "last_name": "Kosovskyi",
+                                           "email": "kosovskyi@example.com", "phone": "3",
+                                           "birthday": "1973-07-14"}, headers=headers)
+        with patch.object(AsyncSession, "execute", execute_then_commit):
+            data = client.get("/api/contacts/changes", params={"since": since}, headers=headers).json()
+        upserts = [change["id"] for change in data["upserts"]]
+        for _ in range(3):
+            data = client.get("/api/contacts/changes", params={"since": data["next"]}, headers=headers).json()
+            upserts += [change["id"] for change in data["upserts"]]
+        # the contact committed before the deletion is not skipped by the position after the deletion
+        assert interleaved[0] in upserts
+
+
+def test_contact_events(client, token):
+    async def stream(user_id):
+        yield b"event: ready\ndata: {}\n\n"
+
+    with patch.object(auth_service.user_cache, 'redis', new_callable=AsyncMock) as r_mock, \
+            patch("src.routes.contacts.contact_events.stream", side_effect=stream) as stream_mock:
+        r_mock.get.return_value = None
+        response = client.get("/api/contacts/events", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text == "event: ready\ndata: {}\n\n"
+        stream_mock.assert_called_once()
+
+
+def test_contact_events_unauthorized(client):
+    response = client.get("/api/contacts/events")
+    assert response.status_code == 401, response.text
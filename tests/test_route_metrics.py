@@ -0,0 +1,36 @@
+import sys
+import os
+
+from unittest.mock import AsyncMock
+
+sys.path.append(os.getcwd())
+from src.conf.config import settings
+from src.conf.messages import NOT_FOUND, NOT_VALIDATE_CREDENTIALS
+from src.services.cache import contacts_cache
+
+
+def test_metrics_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_token", "")
+    response = client.get("/api/metrics/", headers={"Authorization": "Bearer anything"})
+    assert response.status_code == 404, response.text
+    assert response.json()["detail"] == NOT_FOUND
+
+
+def test_metrics_requires_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_token", "ops-secret")
+    response = client.get("/api/metrics/")
+    assert response.status_code == 403, response.text
+    response = client.get("/api/metrics/", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == NOT_VALIDATE_CREDENTIALS
+
+
+def test_metrics_with_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "metrics_token", "ops-secret")
+    monkeypatch.setattr(contacts_cache, "memory", AsyncMock(return_value={"used_memory": 1024, "maxmemory": 0}))
+    response = client.get("/api/metrics/", headers={"Authorization": "Bearer ops-secret"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert "stored_bytes" in data["contacts_cache"]
+    assert "used_memory" not in data["contacts_cache"]
+    assert data["redis_server_memory"] == {"used_memory": 1024, "maxmemory": 0}
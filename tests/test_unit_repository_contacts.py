@@ -4,99 +4,208 @@ from datetime import date, datetime
 sys.path.append(os.getcwd())
 
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact, User
-from src.schemas import ContactModel, ContactUpdate
+from src.schemas import ContactModel, ContactPatch, ContactUpdate
 from src.repository.contacts import (
+    CONTACT_COLUMNS,
+    contact_columns,
     get_contacts,
     get_contact,
+    encode_cursor,
+    decode_cursor,
     get_contacts_by_fname,
     get_contacts_by_lname,
     get_contacts_by_email,
     get_contacts_by_birthday,
+    search_contacts,
+    search_terms,
+    birthday_ordinal,
+    birthday_windows,
     create_contact,
+    create_contacts,
     update_contact,
-    remove_contact
+    patch_contact,
+    remove_contact,
+    update_contacts,
+    remove_contacts,
+    CHANGE_DELETE,
+    CHANGE_UPSERT,
+    ChangePosition,
+    ChangesPage,
+    SyncTokenExpired,
+    encode_sync_token,
+    decode_sync_token,
+    get_contact_changes,
 )
 
 
 class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.scalars.return_value = MagicMock()
+        self.session.execute.return_value = MagicMock()
         self.user = User(id=1)
+        invalidate = patch("src.repository.contacts.contacts_cache.invalidate", new_callable=AsyncMock)
+        self.invalidate = invalidate.start()
+        self.addCleanup(invalidate.stop)
+        publish = patch("src.repository.contacts.contact_events.publish", new_callable=AsyncMock)
+        self.publish = publish.start()
+        self.addCleanup(publish.stop)
     
     # get contacts test
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().offset().limit().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts(skip=0, limit=10, user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
+    async def test_get_contacts_after_cursor(self):
+        contacts = [Contact(), Contact()]
+        self.session.execute.return_value.all.return_value = contacts
+        result = await get_contacts(skip=0, limit=10, user=self.user, db=self.session, after_id=5)
+        self.assertEqual(result, contacts)
+        stmt = self.session.execute.call_args.args[0]
+        self.assertIsNone(stmt._offset_clause)
+        self.assertIn("contacts.id >", str(stmt))
+
+    # pagination cursor test
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+
+    def test_decode_invalid_cursor(self):
+        for cursor in ("garbage!", encode_cursor(1)[:-1], "eDox"):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
     # get contact test
     async def test_get_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.session.scalar.return_value = contact
         result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
     
     # get contact by first_name test
     async def test_get_contact_by_fname_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts_by_fname(first_name="art", user=self.user, db=self.session)
         self.assertEqual(result, contacts)
         
     async def test_get_contact_by_fname_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.session.execute.return_value.all.return_value = None
         result = await get_contacts_by_fname(first_name="art", user=self.user, db=self.session)
         self.assertIsNone(result)
     
     # get contact by last_name test
     async def test_get_contact_by_lname_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts_by_lname(last_name="enko", user=self.user, db=self.session)
         self.assertEqual(result, contacts)
         
     async def test_get_contact_by_lname_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.session.execute.return_value.all.return_value = None
         result = await get_contacts_by_lname(last_name="enko", user=self.user, db=self.session)
         self.assertIsNone(result)
     
     # get contact by email test
     async def test_get_contact_by_email_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts_by_email(email="gmail", user=self.user, db=self.session)
         self.assertEqual(result, contacts)
         
     async def test_get_contact_by_fname_not_found(self):
-        self.session.query().filter().all.return_value = None
+        self.session.execute.return_value.all.return_value = None
         result = await get_contacts_by_email(email="gmail", user=self.user, db=self.session)
         self.assertIsNone(result)
     
+    # sparse fields test
+    def test_contact_columns(self):
+        self.assertEqual(contact_columns(None), CONTACT_COLUMNS)
+        self.assertEqual([c.key for c in contact_columns(' phone,first_name,')], ['id', 'first_name', 'phone'])
+        with self.assertRaises(ValueError):
+            contact_columns('first_name,password')
+
+    async def test_get_contacts_selects_columns(self):
+        await get_contacts(skip=0, limit=10, user=self.user, db=self.session, columns=contact_columns('phone'))
+        stmt = self.session.execute.call_args.args[0]
+        self.assertEqual([c.key for c in stmt.selected_columns], ['id', 'phone'])
+
+    # search contacts test
+    def test_search_terms(self):
+        self.assertEqual(search_terms('Cr7@Gmail.com "ronaldo*'), ['cr7', 'gmail', 'com', 'ronaldo'])
+
+    async def test_search_contacts_found(self):
+        contacts = [Contact(), Contact()]
+        self.session.execute.return_value.all.return_value = contacts
+        result = await search_contacts(query="ronaldo", limit=10, user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+
+    async def test_search_contacts_empty_query(self):
+        result = await search_contacts(query="  ?! ", limit=10, user=self.user, db=self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_called()
+
     #  get contact by bitrhday test
     async def test_get_contact_by_byrthday_found(self):
         contacts = [Contact(birthday=date(2000, 3, 15))]
-        self.session.query().filter().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts_by_birthday(user=self.user, db=self.session)
         self.assertEqual(result, contacts)
         
     async def test_get_contact_by_byrthday_not_found(self):
         contacts = []
-        self.session.query().filter().all.return_value = contacts
+        self.session.execute.return_value.all.return_value = contacts
         result = await get_contacts_by_birthday(user=self.user, db=self.session)
         self.assertEqual(result, contacts)
         
+    async def test_get_contact_by_byrthday_window(self):
+        self.session.execute.return_value.all.return_value = []
+        await get_contacts_by_birthday(user=self.user, db=self.session, days=30)
+        stmt = str(self.session.execute.call_args.args[0])
+        self.assertIn("contacts.birthday_ordinal BETWEEN", stmt)
+        self.assertNotIn("EXTRACT", stmt.upper())
+
+    async def test_get_contact_by_byrthday_window_starts_today(self):
+        self.session.execute.return_value.all.return_value = []
+        await get_contacts_by_birthday(user=self.user, db=self.session, days=7, today=date(2023, 12, 28))
+        params = self.session.execute.call_args.args[0].compile().params
+        self.assertEqual(sorted(v for k, v in params.items() if k.startswith("birthday_ordinal")),
+                         [101, 104, 1228, 1228, 1231])
+
+    # birthday ordinal test
+    def test_birthday_ordinal(self):
+        self.assertEqual(birthday_ordinal(date(1985, 3, 14)), 314)
+        self.assertEqual(birthday_ordinal(date(2000, 12, 31)), 1231)
+        self.assertIsNone(birthday_ordinal(None))
+
+    def test_birthday_windows_inside_month(self):
+        self.assertEqual(birthday_windows(date(2023, 3, 10), 7), [(310, 317)])
+
+    def test_birthday_windows_across_month(self):
+        self.assertEqual(birthday_windows(date(2023, 4, 28), 7), [(428, 505)])
+
+    def test_birthday_windows_across_year(self):
+        self.assertEqual(birthday_windows(date(2023, 12, 28), 7), [(1228, 1231), (101, 104)])
+
+    def test_birthday_windows_leap_day(self):
+        low, high = birthday_windows(date(2023, 2, 27), 2)[0]
+        self.assertTrue(low <= birthday_ordinal(date(2024, 2, 29)) <= high)
+
+    def test_birthday_windows_whole_year(self):
+        self.assertEqual(birthday_windows(date(2023, 6, 1), 365), [(101, 1231)])
+
     # create contact test
     async def test_create_contact(self):
         body = ContactModel(
@@ -107,24 +216,62 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             birthday=date(2003, 2, 3)
         )
         result = await create_contact(body=body, user=self.user, db=self.session)
+        self.invalidate.assert_awaited_once_with(self.user.id)
         self.assertEqual(result.first_name, body.first_name)
         self.assertEqual(result.last_name, body.last_name)
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.phone, body.phone)
         self.assertEqual(result.birthday, body.birthday)
+        self.assertEqual(result.birthday_ordinal, 203)
         self.assertTrue(hasattr(result, "id"))
     
+    # create contacts test
+    async def test_create_contacts(self):
+        bodies = [
+            ContactModel(first_name="Cristiano", last_name="Ronaldo", email="cr7@gmail.com", phone="7",
+                         birthday=date(1985, 2, 5)),
+            ContactModel(first_name="Lionel", last_name="Messi", email="lm10@gmail.com", phone="10",
+                         birthday=date(1987, 6, 24)),
+        ]
+        self.session.scalars.return_value.all.return_value = [7, 8]
+        result = await create_contacts(bodies=bodies, user=self.user, db=self.session)
+        self.assertEqual(result, 2)
+        self.assertIn("RETURNING contacts.id", str(self.session.scalars.call_args.args[0]))
+        values = self.session.scalars.call_args.args[1]
+        self.assertEqual([value["birthday_ordinal"] for value in values], [205, 624])
+        self.assertTrue(all(value["user_id"] == self.user.id for value in values))
+        self.session.commit.assert_awaited_once()
+        self.publish.assert_awaited_once_with(self.user.id, "create", [7, 8])
+
+    async def test_create_contacts_without_returning(self):
+        bodies = [ContactModel(first_name="Lionel", last_name="Messi", email="lm10@gmail.com", phone="10",
+                               birthday=date(1987, 6, 24))]
+        self.session.get_bind.return_value.dialect.insert_executemany_returning = False
+        result = await create_contacts(bodies=bodies, user=self.user, db=self.session)
+        self.assertEqual(result, 1)
+        self.assertEqual(self.session.execute.call_args.args[1][0]["birthday_ordinal"], 624)
+        self.publish.assert_awaited_once_with(self.user.id, "create", [])
+
+    async def test_create_contacts_empty(self):
+        result = await create_contacts(bodies=[], user=self.user, db=self.session)
+        self.assertEqual(result, 0)
+        self.session.execute.assert_not_called()
+
     # remove contact test
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.session.scalar.return_value = contact
         result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
+        self.invalidate.assert_awaited_once_with(self.user.id)
+        self.publish.assert_awaited_once_with(self.user.id, "delete", [contact.id])
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
+        self.invalidate.assert_not_awaited()
+        self.publish.assert_not_awaited()
 
     # update contact test
     async def test_update_contact_found(self):
@@ -135,14 +282,14 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             phone="123123123",
             birthday=date(2003, 2, 3)
         )
-        contact = ContactModel(
+        contact = Contact(
             first_name="Artur",
             last_name="Ronaldo",
             email="cr7@gmail.com",
             phone="123123123",
             birthday=date(2000, 2, 3)
         )
-        self.session.query().filter().first.return_value = contact
+        self.session.scalar.return_value = contact
         self.session.commit.return_value = None
         result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertEqual(result, contact)
@@ -155,10 +302,166 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             phone="123123123",
             birthday=date(2003, 2, 3)
         )
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         self.session.commit.return_value = None
         result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertIsNone(result)
+        self.session.rollback.assert_awaited_once()
+        self.session.commit.assert_not_awaited()
+
+    async def test_update_contact_without_returning(self):
+        body = ContactUpdate(
+            first_name="Cristiano",
+            last_name="Ronaldo",
+            email="cr7@gmail.com",
+            phone="123123123",
+            birthday=date(2003, 2, 3)
+        )
+        contact = Contact()
+        self.session.get_bind.return_value.dialect.update_returning = False
+        self.session.execute.return_value.rowcount = 1
+        self.session.scalar.return_value = contact
+        result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
+        self.assertEqual(result, contact)
+        # the version is bumped first, its row lock orders the writes of the user
+        self.assertIn("UPDATE users SET contacts_version", str(self.session.execute.call_args_list[0].args[0]))
+        self.assertIn("UPDATE contacts", str(self.session.execute.call_args.args[0]))
+
+    # patch contact test
+    async def test_patch_contact_only_sent_fields(self):
+        contact = Contact()
+        self.session.scalar.return_value = contact
+        result = await patch_contact(contact_id=1, body=ContactPatch(phone="777"), user=self.user, db=self.session)
+        self.assertEqual(result, contact)
+        stmt = self.session.scalar.call_args.args[0]
+        self.assertEqual(set(stmt.compile().params) - {"user_id_1", "id_1"}, {"phone"})
+        # updated_at is stamped by the clock of the database
+        self.assertIn("updated_at=CURRENT_TIMESTAMP", str(stmt))
+
+    async def test_patch_contact_birthday(self):
+        self.session.scalar.return_value = Contact()
+        await patch_contact(contact_id=1, body=ContactPatch(birthday=date(2000, 12, 31)), user=self.user, db=self.session)
+        params = self.session.scalar.call_args.args[0].compile().params
+        self.assertEqual(params["birthday_ordinal"], 1231)
+
+    async def test_remove_contact_without_returning(self):
+        contact = Contact()
+        self.session.get_bind.return_value.dialect.delete_returning = False
+        self.session.scalar.return_value = contact
+        result = await remove_contact(contact_id=1, user=self.user, db=self.session)
+        self.assertEqual(result, contact)
+        self.assertIn("DELETE FROM contacts", str(self.session.execute.call_args_list[1].args[0]))
+        self.assertIn("INSERT INTO contact_tombstones", str(self.session.execute.call_args_list[2].args[0]))
+
+    # bulk update and delete test
+    async def test_update_contacts_in_chunks(self):
+        self.session.execute.return_value.scalars.return_value.all.return_value = [7, 8]
+        result = await update_contacts(ids=[5, 1, 3, 3, 2, 4], body=ContactPatch(phone="0"), user=self.user,
+                                       db=self.session, chunk_size=2)
+        self.assertEqual(result, 6)
+        self.publish.assert_awaited_with(self.user.id, "update", [7, 8])
+        # one UPDATE of the chunk and one of the contacts_version per chunk
+        self.assertEqual(self.session.execute.await_count, 6)
+        self.assertEqual(self.session.commit.await_count, 3)
+        first_chunk = self.session.execute.call_args_list[1].args[0].compile().params
+        self.assertEqual(first_chunk["id_1"], [1, 2])
+
+    async def test_update_contacts_without_changes(self):
+        result = await update_contacts(ids=[1, 2], body=ContactPatch(), user=self.user, db=self.session, chunk_size=2)
+        self.assertEqual(result, 0)
+        self.session.execute.assert_not_called()
+
+    async def test_remove_contacts_in_chunks(self):
+        self.session.execute.return_value.scalars.return_value.all.return_value = [1]
+        self.session.scalar.return_value = None
+        result = await remove_contacts(ids=[1, 2, 3], user=self.user, db=self.session, chunk_size=2)
+        self.assertEqual(result, 2)
+        # per chunk the version, the DELETE and the tombstones, no tombstone is past the retention
+        self.assertEqual(self.session.execute.await_count, 6)
+        self.assertEqual(self.invalidate.await_count, 2)
+        tombstones = self.session.execute.call_args_list[2].args[1]
+        self.assertEqual(tombstones, [{"contact_id": 1, "user_id": self.user.id}])
+
+    async def test_remove_contacts_purges_expired_tombstones(self):
+        self.session.execute.return_value.scalars.return_value.all.return_value = [1]
+        self.session.scalar.return_value = datetime(2023, 3, 1)
+        await remove_contacts(ids=[1], user=self.user, db=self.session, chunk_size=2)
+        purge, watermark = (call.args[0] for call in self.session.execute.call_args_list[3:])
+        self.assertIn("DELETE FROM contact_tombstones", str(purge))
+        self.assertEqual(watermark.compile().params["tombstones_purged_until"], datetime(2023, 3, 1))
+
+    async def test_remove_contacts_none_found(self):
+        self.session.execute.return_value.scalars.return_value.all.return_value = []
+        result = await remove_contacts(ids=[1, 2], user=self.user, db=self.session, chunk_size=2)
+        self.assertEqual(result, 0)
+        self.session.rollback.assert_awaited_once()
+        self.invalidate.assert_not_awaited()
+
+    # changes feed test
+    def test_sync_token_round_trip(self):
+        position = ChangePosition(7, datetime(2023, 4, 1, 12, 30, 5, 123456), CHANGE_DELETE, 42)
+        self.assertEqual(decode_sync_token(encode_sync_token(position)), position)
+
+    def test_decode_invalid_sync_token(self):
+        for token in ("%%%", encode_cursor(5), "c3luYzox"):
+            with self.assertRaises(ValueError):
+                decode_sync_token(token)
+
+    async def test_changes_unchanged_version(self):
+        since = ChangePosition(3, datetime(2023, 4, 1), CHANGE_UPSERT, 10)
+        self.session.scalar.return_value = 3
+        page = await get_contact_changes(since, 100, self.user, self.session)
+        self.assertEqual(page, ChangesPage([], [], since, False))
+        self.session.execute.assert_not_called()
+
+    async def test_changes_expired_token(self):
+        since = ChangePosition(3, datetime(2023, 4, 1), CHANGE_UPSERT, 10)
+        # version 4, and a tombstone deleted after the position was purged
+        self.session.scalar.side_effect = [4, datetime(2023, 4, 2)]
+        with self.assertRaises(SyncTokenExpired):
+            await get_contact_changes(since, 100, self.user, self.session)
+        self.session.execute.assert_not_called()
+
+    async def test_changes_old_token_without_purge_since(self):
+        since = ChangePosition(3, datetime(2020, 4, 1), CHANGE_UPSERT, 10)
+        self.session.scalar.side_effect = [4, datetime(2020, 3, 1)]
+        self.session.execute.return_value.all.return_value = []
+        page = await get_contact_changes(since, 100, self.user, self.session)
+        self.assertEqual(page, ChangesPage([], [], since._replace(version=4), False))
+
+    async def test_changes_merge_upserts_and_deletions(self):
+        at = datetime(2023, 4, 1)
+
+        def event(kind, row_id, contact_id, updated_at):
+            fields = dict(id=contact_id, first_name=None, last_name=None, email=None, phone=None, birthday=None,
+                          updated_at=updated_at)
+            return MagicMock(kind=kind, row_id=row_id, _mapping=fields, **fields)
+
+        # the union already returns the events in (changed_at, kind, id) order
+        events = [event(CHANGE_UPSERT, 1, 1, at), event(CHANGE_UPSERT, 2, 2, at.replace(hour=2)),
+                  event(CHANGE_DELETE, 9, 2, at.replace(hour=3)), event(CHANGE_DELETE, 10, 5, at.replace(hour=4))]
+        self.session.scalar.return_value = 6
+        self.session.execute.return_value.all.return_value = events
+        page = await get_contact_changes(None, 3, self.user, self.session)
+        # contact 2 was changed and then deleted within the page, only the deletion is reported
+        self.assertEqual(page.upserts, [events[0]._mapping])
+        self.assertEqual(page.deleted, [2])
+        self.assertEqual(page.position, ChangePosition(-1, at.replace(hour=3), CHANGE_DELETE, 9))
+        self.assertTrue(page.more)
+
+    async def test_changes_after_position(self):
+        since = ChangePosition(2, datetime(2023, 4, 1), CHANGE_UPSERT, 10)
+        self.session.scalar.side_effect = [3, None]
+        self.session.execute.return_value.all.return_value = []
+        page = await get_contact_changes(since, 100, self.user, self.session)
+        self.assertEqual(page, ChangesPage([], [], since._replace(version=3), False))
+        # upserts and deletions are read by one statement, from one snapshot
+        self.session.execute.assert_awaited_once()
+        changes = str(self.session.execute.call_args.args[0])
+        self.assertIn("UNION ALL", changes)
+        self.assertIn("contacts.updated_at > :updated_at_1 OR contacts.updated_at = :updated_at_2 AND contacts.id > :id_1",
+                      changes)
+        self.assertIn("contact_tombstones.deleted_at >= :deleted_at_1", changes)
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,16 +4,15 @@ from datetime import date, datetime
 sys.path.append(os.getcwd())
 
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
 from src.schemas import UserModel
 from src.repository.users import (
     get_user_by_email,
     create_user,
-    update_token,
     confirmed_email,
     update_avatar,
 )
@@ -22,7 +21,7 @@ from src.repository.users import (
 class TestUsers(unittest.IsolatedAsyncioTestCase):
     
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
         self.body = UserModel(
             username="debik",
             email="debik228@gmail.com",
@@ -32,7 +31,7 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
     # get user by email test
     async def test_get_user_by_email(self):
         user = User()
-        self.session.query().filter().first.return_value = user
+        self.session.scalar.return_value = user
         result = await get_user_by_email(email="test1222gmail.com", db=self.session)
         self.assertEqual(result, user)
         
@@ -53,6 +52,14 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
         await confirmed_email(email=body.email, db=self.session)
         result = await get_user_by_email(email=body.email, db=self.session)
         self.assertEqual(result.confirmed, True)
+    async def test_update_avatar_invalidates_cached_user(self):
+        user = User(email=self.body.email)
+        self.session.scalar.return_value = user
+        with patch("src.repository.users.user_cache.invalidate", new_callable=AsyncMock) as invalidate:
+            result = await update_avatar(email=self.body.email, url="https://example.com/a.png", db=self.session)
+        self.assertEqual(result.avatar, "https://example.com/a.png")
+        invalidate.assert_awaited_once_with(self.body.email)
+
 
 if __name__ == '__main__':
     unittest.main()
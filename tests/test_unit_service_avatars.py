@@ -0,0 +1,106 @@
+import sys
+import os
+import io
+import tempfile
+from pathlib import Path
+sys.path.append(os.getcwd())
+
+import unittest
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from src.services.avatars import AvatarPipeline, AvatarStorage, LocalStorage, resize_avatar
+from src.services.pool import WorkerPool
+
+
+def png(width: int, height: int, color: tuple = (200, 10, 10, 128)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGBA", (width, height), color).save(out, "PNG")
+    return out.getvalue()
+
+
+class TestResizeAvatar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "upload"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_crops_to_square_jpeg(self):
+        self.path.write_bytes(png(600, 300))
+        avatar = Image.open(io.BytesIO(resize_avatar(str(self.path), 250, 10 ** 6)))
+        self.assertEqual(avatar.format, "JPEG")
+        self.assertEqual(avatar.size, (250, 250))
+
+    def test_refuses_too_many_pixels(self):
+        self.path.write_bytes(png(600, 300))
+        with self.assertRaises(ValueError):
+            resize_avatar(str(self.path), 250, 1000)
+
+    def test_refuses_non_image(self):
+        self.path.write_bytes(b"not an image")
+        with self.assertRaises(ValueError):
+            resize_avatar(str(self.path), 250, 10 ** 6)
+
+
+class TestAvatarPipeline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name) / "avatars"
+        self.pool = WorkerPool("thread", workers=1, max_pending=4)
+        self.pipeline = AvatarPipeline(LocalStorage(self.root, "http://testserver/avatars/"), self.pool, size=64,
+                                       max_bytes=100_000, max_pixels=10 ** 6, chunk_size=1024)
+        self.spooled = set(os.listdir(tempfile.gettempdir()))
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.tmp.cleanup()
+
+    def assertNoSpooledFiles(self):
+        self.assertEqual({name for name in os.listdir(tempfile.gettempdir()) if name.startswith("avatar-")}
+                         - self.spooled, set())
+
+    async def test_stores_resized_avatar(self):
+        url = await self.pipeline.store(UploadFile(io.BytesIO(png(300, 200)), filename="a.png"), "ContactsApp/deadpool")
+        stored = self.root / "ContactsApp" / "deadpool.jpg"
+        self.assertTrue(url.startswith("http://testserver/avatars/ContactsApp/deadpool.jpg?v="))
+        self.assertEqual(Image.open(stored).size, (64, 64))
+        self.assertEqual(self.pool.completed, 1)
+        self.assertNoSpooledFiles()
+
+    async def test_new_image_gets_new_url(self):
+        first = await self.pipeline.store(UploadFile(io.BytesIO(png(300, 200))), "ContactsApp/deadpool")
+        second = await self.pipeline.store(UploadFile(io.BytesIO(png(100, 300, (10, 10, 200, 255)))), "ContactsApp/deadpool")
+        self.assertNotEqual(first, second)
+
+    async def test_too_large_upload(self):
+        with self.assertRaises(HTTPException) as err:
+            await self.pipeline.store(UploadFile(io.BytesIO(b"x" * 100_001)), "ContactsApp/deadpool")
+        self.assertEqual(err.exception.status_code, 413)
+        self.assertNoSpooledFiles()
+
+    async def test_invalid_image(self):
+        with self.assertRaises(HTTPException) as err:
+            await self.pipeline.store(UploadFile(io.BytesIO(b"not an image")), "ContactsApp/deadpool")
+        self.assertEqual(err.exception.status_code, 400)
+        self.assertFalse(self.root.exists())
+        self.assertNoSpooledFiles()
+
+    async def test_key_outside_root(self):
+        with self.assertRaises(ValueError):
+            await LocalStorage(self.root, "/avatars").save("../escape", b"data")
+
+    def test_storage_without_save(self):
+        class Incomplete(AvatarStorage):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import sys
+import os
+import json
+import time
+from datetime import datetime
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import FakeServer, aioredis
+from redis.exceptions import ConnectionError
+
+from src.database.models import User
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from src.services.cache import ContactsCache, LRUCache, TokenCache, UserCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_expires_entries(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        with patch("src.services.cache.time.monotonic", return_value=1000):
+            cache.set("a", 1)
+        with patch("src.services.cache.time.monotonic", return_value=1061):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_counts_hits_and_misses(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.stats(), {"size": 1, "maxsize": 2, "hits": 1, "misses": 1})
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def test_entry_expires_at_exp_claim(self):
+        cache = TokenCache(maxsize=10)
+        with patch("src.services.cache.time.time", return_value=1000), \
+                patch("src.services.cache.time.monotonic", return_value=50):
+            cache.set("token", {"sub": "deadpool@example.com", "exp": 1030})
+        with patch("src.services.cache.time.monotonic", return_value=79):
+            self.assertEqual(cache.get("token")["sub"], "deadpool@example.com")
+        with patch("src.services.cache.time.monotonic", return_value=81):
+            self.assertIsNone(cache.get("token"))
+
+    def test_expired_token_is_not_cached(self):
+        cache = TokenCache(maxsize=10)
+        cache.set("token", {"sub": "deadpool@example.com", "exp": 1})
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_revoke(self):
+        cache = TokenCache(maxsize=10)
+        cache.set("token", {"sub": "deadpool@example.com", "exp": 4102444800})
+        cache.revoke("token")
+        self.assertIsNone(cache.get("token"))
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(server=FakeServer())
+        self.cache = UserCache(self.redis, maxsize=10, local_ttl=60, redis_ttl=900)
+        self.user = User(id=1, username="deadpool", email="deadpool@example.com", password="secret",
+                         created_at=datetime(2023, 3, 1, 12, 0))
+
+    async def test_miss(self):
+        self.assertIsNone(await self.cache.get(self.user.email))
+        self.assertEqual(self.cache.stats()["redis"]["misses"], 1)
+
+    async def load(self):
+        self.loads += 1
+        return self.user
+
+    async def test_stores_json_without_secrets(self):
+        self.loads = 0
+        await self.cache.get_or_load(self.user.email, self.load)
+        data = json.loads(await self.redis.get("user:deadpool@example.com:v0"))
+        self.assertEqual(data["id"], 1)
+        self.assertNotIn("password", data)
+        self.assertGreater(await self.redis.ttl("user:deadpool@example.com:v0"), 0)
+
+    async def test_local_hit(self):
+        self.loads = 0
+        await self.cache.get_or_load(self.user.email, self.load)
+        user = await self.cache.get_or_load(self.user.email, self.load)
+        self.assertEqual((user.id, user.username, user.created_at), (1, "deadpool", self.user.created_at))
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats()["local"]["hits"], 1)
+
+    async def test_redis_hit_fills_local_tier(self):
+        self.loads = 0
+        await self.cache.get_or_load(self.user.email, self.load)
+        self.cache.local.clear()
+        user = await self.cache.get(self.user.email)
+        self.assertEqual(user.email, self.user.email)
+        self.assertEqual(self.cache.stats()["redis"]["hits"], 1)
+        self.assertIsNotNone(self.cache.local.get(self.user.email))
+
+    async def test_invalidate_forces_reload(self):
+        self.loads = 0
+        await self.cache.get_or_load(self.user.email, self.load)
+        self.user.avatar = "https://example.com/new.png"
+        await self.cache.invalidate(self.user.email)
+        self.assertIsNone(await self.cache.get(self.user.email))
+        user = await self.cache.get_or_load(self.user.email, self.load)
+        self.assertEqual(user.avatar, "https://example.com/new.png")
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(await self.redis.get("user:deadpool@example.com:version"), b"1")
+
+    async def test_racing_reader_cannot_restore_stale_copy(self):
+        stale = User(id=1, username="deadpool", email=self.user.email, avatar="old.png",
+                     created_at=self.user.created_at)
+
+        async def racing_load():
+            # the row is read, then a write commits and invalidates before the reader stores it
+            await self.cache.invalidate(self.user.email)
+            return stale
+
+        await self.cache.get_or_load(self.user.email, racing_load)
+        self.cache.local.clear()
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+    async def test_redis_errors_are_misses(self):
+        self.cache.redis = AsyncMock(get=AsyncMock(side_effect=ConnectionError()),
+                                     set=AsyncMock(side_effect=ConnectionError()),
+                                     incr=AsyncMock(side_effect=ConnectionError()))
+        self.loads = 0
+        user = await self.cache.get_or_load(self.user.email, self.load)
+        self.assertEqual(user.email, self.user.email)
+        await self.cache.invalidate(self.user.email)
+        self.assertIsNone(await self.cache.get(self.user.email))
+        self.assertEqual(self.cache.stats()["redis"]["errors"], 3)
+
+
+
+class TestContactsCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(server=FakeServer())
+        self.cache = ContactsCache(self.redis, ttl=300, max_entry_bytes=1024, retry_interval=5)
+        self.loads = 0
+
+    async def loader(self, body: bytes = b'[{"id":1}]') -> Response:
+        self.loads += 1
+        return Response(body, media_type="application/json", headers={"X-Next-Cursor": "abc"})
+
+    async def test_hit_returns_stored_response(self):
+        first = await self.cache.get_or_load(1, "read_contacts", {"limit": 10}, self.loader)
+        second = await self.cache.get_or_load(1, "read_contacts", {"limit": 10}, self.loader)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.headers["X-Next-Cursor"], "abc")
+        self.assertEqual(second.headers["content-type"], "application/json")
+        self.assertEqual(self.cache.stats()["hit_ratio"], 0.5)
+
+    async def test_keys_by_user_route_and_params(self):
+        await self.cache.get_or_load(1, "read_contacts", {"limit": 10, "skip": 0}, self.loader)
+        await self.cache.get_or_load(1, "read_contacts", {"skip": 0, "limit": 10}, self.loader)
+        await self.cache.get_or_load(1, "read_contacts", {"limit": 20, "skip": 0}, self.loader)
+        await self.cache.get_or_load(1, "by_fname", {"limit": 10, "skip": 0}, self.loader)
+        await self.cache.get_or_load(2, "read_contacts", {"limit": 10, "skip": 0}, self.loader)
+        self.assertEqual(self.loads, 4)
+
+    async def test_invalidate_starts_new_generation(self):
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        await self.cache.get_or_load(1, "by_email", {"email": "a"}, self.loader)
+        await self.cache.get_or_load(2, "read_contacts", {}, self.loader)
+        await self.cache.invalidate(1)
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        await self.cache.get_or_load(1, "by_email", {"email": "a"}, self.loader)
+        await self.cache.get_or_load(2, "read_contacts", {}, self.loader)
+        self.assertEqual(self.loads, 5)
+        self.assertEqual(await self.redis.get(ContactsCache.generation_key(1)), b"1")
+
+    async def test_does_not_store_errors_or_large_entries(self):
+        async def not_found():
+            raise HTTPException(status_code=404)
+
+        with self.assertRaises(HTTPException):
+            await self.cache.get_or_load(1, "read_contacts", {}, not_found)
+        await self.cache.get_or_load(1, "search", {}, lambda: self.loader(b"x" * 2000))
+        await self.cache.get_or_load(1, "search", {}, lambda: self.loader(b"x" * 2000))
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.cache.stats()["stored"], 0)
+
+    async def test_bypasses_redis_after_error(self):
+        self.cache.redis = AsyncMock(get=AsyncMock(side_effect=ConnectionError()))
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self.cache.redis.get.await_count, 1)
+        self.assertTrue(self.cache.stats()["redis_down"])
+
+    async def test_failed_invalidation_bypasses_user_until_retried(self):
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        await self.cache.get_or_load(2, "read_contacts", {}, self.loader)
+        with patch.object(self.redis, "incr", side_effect=ConnectionError()):
+            await self.cache.invalidate(1)
+            self.cache.redis_down_until = 0.0
+            # the retry fails again, the stale result of user 1 is still not served
+            await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        self.assertEqual(self.loads, 3)
+        self.assertEqual(self.cache.stats()["uninvalidated_users"], 1)
+
+        self.cache.redis_down_until = 0.0
+        await self.cache.get_or_load(2, "read_contacts", {}, self.loader)
+        self.assertEqual(self.loads, 3)
+        self.assertEqual(await self.redis.get(ContactsCache.generation_key(1)), b"1")
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        self.assertEqual(self.loads, 4)
+        self.assertEqual(self.cache.stats()["uninvalidated_users"], 0)
+
+    async def test_failed_invalidation_is_forgotten_after_ttl(self):
+        with patch.object(self.redis, "incr", side_effect=ConnectionError()):
+            await self.cache.invalidate(1)
+        self.cache.redis_down_until = 0.0
+        with patch("src.services.cache.time.monotonic", return_value=time.monotonic() + 301):
+            await self.cache.get_or_load(1, "read_contacts", {}, self.loader)
+        self.assertEqual(self.cache.uninvalidated, {})
+        self.assertIsNone(await self.redis.get(ContactsCache.generation_key(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import patch
+
+from src.services.email_render import EmailRenderer
+
+
+class TestEmailRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.renderer = EmailRenderer()
+        self.recipients = [
+            {"username": "deadpool", "token": "token-1"},
+            {"username": "<b>wolverine</b> & co", "token": "token-2"},
+        ]
+
+    def test_batch_matches_plain_render(self):
+        rendered = self.renderer.render_batch("email_template.html", {"host": "http://testserver/"}, self.recipients)
+        expected = [self.renderer.render("email_template.html", host="http://testserver/", **values)
+                    for values in self.recipients]
+        self.assertEqual(rendered, expected)
+        self.assertIn("&lt;b&gt;wolverine&lt;/b&gt; &amp; co", rendered[1])
+        self.assertIn("http://testserver/api/auth/confirmed_email/token-2", rendered[1])
+
+    def test_templates_from_both_folders(self):
+        rendered = self.renderer.render_batch("example_email.html", {}, [{"fullname": "Billy Jones"}])
+        self.assertIn("Hi Billy Jones,", rendered[0])
+
+    def test_template_is_compiled_once(self):
+        with patch.object(self.renderer.env.loader, "get_source", wraps=self.renderer.env.loader.get_source) as source:
+            for _ in range(3):
+                self.renderer.render("email_template.html", host="h", username="u", token="t")
+        self.assertEqual(source.call_count, 1)
+
+    def test_fragments_are_cached_per_shared_values(self):
+        with patch.object(self.renderer, "render", wraps=self.renderer.render) as render:
+            self.renderer.render_batch("email_template.html", {"host": "http://a/"}, self.recipients)
+            self.renderer.render_batch("email_template.html", {"host": "http://a/"}, self.recipients)
+            self.renderer.render_batch("email_template.html", {"host": "http://b/"}, self.recipients)
+        self.assertEqual(render.call_count, 2)
+
+    def test_empty_batch(self):
+        self.assertEqual(self.renderer.render_batch("email_template.html", {"host": "h"}, []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
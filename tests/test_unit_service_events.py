@@ -0,0 +1,108 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import AsyncMock
+
+import orjson
+from fakeredis import FakeServer, aioredis
+from redis.exceptions import ConnectionError
+
+from src.services.events import HEARTBEAT, READY, RESYNC, ContactEvents
+
+
+class TestContactEvents(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.events = ContactEvents(aioredis.FakeRedis(server=self.server), max_queue=2, heartbeat_interval=60,
+                                    retry_interval=0.01)
+
+    async def asyncTearDown(self):
+        await self.events.close()
+
+    async def next_frame(self, queue: asyncio.Queue) -> bytes | None:
+        return await asyncio.wait_for(queue.get(), 1)
+
+    async def test_delivers_to_streams_of_the_user(self):
+        async with self.events.subscribe(1) as first, self.events.subscribe(1) as second, \
+                self.events.subscribe(2) as other:
+            await self.events.publish(1, "update", [5])
+            expected = b'event: contacts\ndata: {"op":"update","ids":[5]}\n\n'
+            self.assertEqual(await self.next_frame(first), expected)
+            self.assertEqual(await self.next_frame(second), expected)
+            await asyncio.sleep(0.05)
+            self.assertTrue(other.empty())
+            self.assertEqual(self.events.stats()["streams"], 3)
+        self.assertEqual(self.events.stats()["streams"], 0)
+        # redis-py forgets a channel once the listener reads the confirmation of the unsubscribe
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.events.pubsub.channels, {})
+
+    async def test_stream_starts_with_ready(self):
+        stream = self.events.stream(3)
+        self.assertEqual(await stream.__anext__(), READY)
+        await self.events.publish(3, "delete", [1, 2])
+        frame = await asyncio.wait_for(stream.__anext__(), 1)
+        self.assertEqual(orjson.loads(frame.split(b"data: ")[1]), {"op": "delete", "ids": [1, 2]})
+        await stream.aclose()
+        self.assertEqual(self.events.streams, {})
+
+    async def test_slow_stream_is_cut_off(self):
+        async with self.events.subscribe(1) as queue:
+            for contact_id in range(3):
+                await self.events.publish(1, "create", [contact_id])
+            await asyncio.sleep(0.05)
+            self.assertEqual(await self.next_frame(queue), RESYNC)
+            self.assertIsNone(await self.next_frame(queue))
+        self.assertEqual(self.events.dropped, 1)
+
+    async def test_heartbeat(self):
+        self.events.heartbeat_interval = 0.01
+        async with self.events.subscribe(1) as queue:
+            self.assertEqual(await self.next_frame(queue), HEARTBEAT)
+
+    async def test_publish_without_redis(self):
+        self.events.redis = AsyncMock()
+        self.events.redis.publish.side_effect = ConnectionError("down")
+        await self.events.publish(1, "create", [1])
+        self.assertEqual(self.events.stats()["publish_errors"], 1)
+
+    async def test_resync_after_reconnect(self):
+        self.server.connected = False
+        asyncio.get_running_loop().call_later(0.05, setattr, self.server, "connected", True)
+        # the stream opens once the subscription is confirmed after the reconnect
+        async with self.events.subscribe(1) as queue:
+            self.assertEqual(await self.next_frame(queue), RESYNC)
+            await self.events.publish(1, "create", [9])
+            self.assertEqual(await self.next_frame(queue), b'event: contacts\ndata: {"op":"create","ids":[9]}\n\n')
+        self.assertGreaterEqual(self.events.errors, 1)
+
+    async def test_listener_stops_when_nothing_is_left_to_subscribe(self):
+        async def open_stream():
+            async with self.events.subscribe(1):
+                pass
+
+        # the only stream gives up while Redis is down
+        self.server.connected = False
+        opening = asyncio.create_task(open_stream())
+        await asyncio.sleep(0.05)
+        opening.cancel()
+        await asyncio.sleep(0.05)
+        self.server.connected = True
+        self.assertIsNone(self.events.pubsub)
+        self.assertTrue(self.events.listener.done())
+        errors = self.events.errors
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.events.errors, errors)
+
+        async with self.events.subscribe(1) as queue:
+            await self.events.publish(1, "update", [3])
+            self.assertEqual(await self.next_frame(queue), b'event: contacts\ndata: {"op":"update","ids":[3]}\n\n')
+        self.assertEqual(self.events.errors, errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import sys
+import os
+import threading
+sys.path.append(os.getcwd())
+
+import asyncio
+import unittest
+
+from fastapi import HTTPException
+
+from src.services.auth import Auth, check_password, hash_password
+from src.services.pool import PoolBusy, WorkerPool
+
+
+class TestWorkerPool(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool('thread', workers=1, max_pending=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    async def test_runs_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        worker_thread = await self.pool.run(threading.get_ident)
+        self.assertNotEqual(worker_thread, loop_thread)
+        stats = self.pool.stats()
+        self.assertEqual((stats["completed"], stats["pending"], stats["rejected"]), (1, 0, 0))
+
+    async def test_rejects_calls_beyond_max_pending(self):
+        release = threading.Event()
+        running = [asyncio.create_task(self.pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with self.assertRaises(PoolBusy):
+            await self.pool.run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+        self.assertEqual(self.pool.stats()["pending"], 0)
+
+    async def test_process_pool(self):
+        pool = WorkerPool('process', workers=1, max_pending=1)
+        try:
+            hashed = await pool.run(hash_password, "123456789")
+            self.assertTrue(await pool.run(check_password, "123456789", hashed))
+        finally:
+            pool.shutdown()
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            WorkerPool('fiber', workers=1, max_pending=1)
+
+
+class TestPasswordPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_hash_and_verify(self):
+        auth = Auth()
+        hashed = await auth.get_password_hash("123456789")
+        self.assertTrue(await auth.verify_password("123456789", hashed))
+        self.assertFalse(await auth.verify_password("987654321", hashed))
+
+    async def test_full_pool_is_503(self):
+        auth = Auth()
+        auth.password_pool = WorkerPool('thread', workers=1, max_pending=0)
+        with self.assertRaises(HTTPException) as cm:
+            await auth.get_password_hash("123456789")
+        self.assertEqual(cm.exception.status_code, 503)
+        auth.password_pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
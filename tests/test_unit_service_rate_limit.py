@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import FakeServer, aioredis
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.rate_limit import LocalBuckets, RateLimitPolicy, RateLimiter
+
+
+class TestRateLimitPolicy(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(RateLimitPolicy.parse("10/60/ip"), RateLimitPolicy(10, 60, "ip"))
+        self.assertEqual(RateLimitPolicy.parse("10/60").by, "user")
+
+    def test_parse_invalid(self):
+        for spec in ("10/60/host", "0/60", "10/0"):
+            with self.assertRaises(ValueError):
+                RateLimitPolicy.parse(spec)
+
+
+class TestLocalBuckets(unittest.TestCase):
+
+    def test_refill(self):
+        buckets = LocalBuckets(maxsize=10)
+        policy = RateLimitPolicy(2, 60)
+        self.assertEqual(buckets.hit("a", policy, now=0), 0)
+        self.assertEqual(buckets.hit("a", policy, now=0), 0)
+        self.assertAlmostEqual(buckets.hit("a", policy, now=0), 30)
+        self.assertEqual(buckets.hit("a", policy, now=31), 0)
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(server=FakeServer())
+        self.limiter = RateLimiter(self.redis, {"read": "3/60/user"}, local_maxsize=10, retry_interval=5)
+
+    async def test_limits_in_redis(self):
+        for _ in range(3):
+            self.assertEqual(await self.limiter.hit("read", "deadpool@example.com"), 0)
+        retry_after = await self.limiter.hit("read", "deadpool@example.com")
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 20)
+        self.assertEqual(await self.limiter.hit("read", "wolverine@example.com"), 0)
+        self.assertGreater(await self.redis.pttl("rate:read:deadpool@example.com"), 0)
+        self.assertEqual(self.limiter.stats()["local_fallbacks"], 0)
+
+    async def test_workers_share_the_bucket(self):
+        other = RateLimiter(self.redis, {"read": "3/60/user"}, local_maxsize=10, retry_interval=5)
+        await self.limiter.hit("read", "deadpool@example.com")
+        await other.hit("read", "deadpool@example.com")
+        await self.limiter.hit("read", "deadpool@example.com")
+        self.assertGreater(await other.hit("read", "deadpool@example.com"), 0)
+
+    async def test_check_raises_429(self):
+        for _ in range(3):
+            await self.limiter.check("read", "deadpool@example.com")
+        with self.assertRaises(HTTPException) as cm:
+            await self.limiter.check("read", "deadpool@example.com")
+        self.assertEqual(cm.exception.status_code, 429)
+        self.assertIn("Retry-After", cm.exception.headers)
+
+    async def test_falls_back_to_local_buckets(self):
+        self.limiter.redis = AsyncMock(evalsha=AsyncMock(side_effect=ConnectionError()))
+        for _ in range(3):
+            self.assertEqual(await self.limiter.hit("read", "deadpool@example.com"), 0)
+        self.assertGreater(await self.limiter.hit("read", "deadpool@example.com"), 0)
+        self.assertEqual(self.limiter.redis.evalsha.await_count, 1)
+        self.assertTrue(self.limiter.stats()["redis_down"])
+
+    async def test_retries_redis_after_interval(self):
+        self.limiter.redis_down_until = 100
+        with patch("src.services.rate_limit.time.monotonic", return_value=99):
+            await self.limiter.hit("read", "deadpool@example.com")
+        self.assertEqual(self.limiter.stats()["local_fallbacks"], 1)
+        with patch("src.services.rate_limit.time.monotonic", return_value=101):
+            await self.limiter.hit("read", "deadpool@example.com")
+        self.assertEqual(self.limiter.stats()["local_fallbacks"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import sys
+import os
+import time
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import FakeServer, aioredis
+from redis.exceptions import ConnectionError
+
+from src.services.revocation import BloomFilter, RevocationList
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        self.assertTrue(all(f"jti-{i}" in bloom for i in range(1000)))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocationList(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.redis = aioredis.FakeRedis(server=self.server)
+        self.revocations = RevocationList(self.redis, capacity=100, error_rate=0.001, sync_interval=5)
+
+    async def test_revoke(self):
+        await self.revocations.revoke("jti-1", time.time() + 60)
+        self.assertTrue(await self.revocations.is_revoked("jti-1"))
+        self.assertFalse(await self.revocations.is_revoked("jti-2"))
+
+    async def test_not_revoked_costs_no_round_trip(self):
+        await self.revocations.sync()
+        self.revocations.redis = AsyncMock()
+        self.assertFalse(await self.revocations.is_revoked("jti-1"))
+        self.revocations.redis.zscore.assert_not_awaited()
+        self.revocations.redis.get.assert_not_awaited()
+
+    async def test_other_worker_sees_revocation_after_sync(self):
+        other = RevocationList(aioredis.FakeRedis(server=self.server), capacity=100, error_rate=0.001, sync_interval=5)
+        self.assertFalse(await other.is_revoked("jti-1"))
+        await self.revocations.revoke("jti-1", time.time() + 60)
+        self.assertFalse(await other.is_revoked("jti-1"))
+        with patch("src.services.revocation.time.monotonic", return_value=time.monotonic() + 6):
+            self.assertTrue(await other.is_revoked("jti-1"))
+        self.assertEqual(other.stats()["syncs"], 1)
+
+    async def test_expired_revocation_is_dropped(self):
+        await self.revocations.revoke("jti-1", time.time() - 1)
+        self.assertFalse(await self.revocations.is_revoked("jti-1"))
+        self.assertEqual(await self.redis.zcard(RevocationList.key), 0)
+
+    async def test_unconfirmed_positive_is_revoked(self):
+        await self.revocations.revoke("jti-1", time.time() + 60)
+        await self.revocations.sync()
+        self.revocations.redis = AsyncMock(zscore=AsyncMock(side_effect=ConnectionError()))
+        self.assertTrue(await self.revocations.is_revoked("jti-1"))
+        self.assertEqual(self.revocations.stats()["redis_errors"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
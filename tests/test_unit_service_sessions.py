@@ -0,0 +1,80 @@
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import unittest
+from unittest.mock import patch
+
+from fakeredis import FakeServer, aioredis
+
+from src.services.sessions import (
+    MISSING, REUSED, ROTATED, MemorySessionStore, RedisSessionStore, SessionStore,
+)
+
+
+class SessionStoreTests:
+
+    async def test_rotate(self):
+        sid = await self.store.create("deadpool@example.com", "jti-1", ttl=60)
+        self.assertEqual(await self.store.rotate(sid, "jti-1", "jti-2", ttl=60), ROTATED)
+        self.assertEqual(await self.store.rotate(sid, "jti-2", "jti-3", ttl=60), ROTATED)
+
+    async def test_reuse_revokes_session(self):
+        sid = await self.store.create("deadpool@example.com", "jti-1", ttl=60)
+        await self.store.rotate(sid, "jti-1", "jti-2", ttl=60)
+        self.assertEqual(await self.store.rotate(sid, "jti-1", "jti-3", ttl=60), REUSED)
+        self.assertEqual(await self.store.rotate(sid, "jti-2", "jti-3", ttl=60), MISSING)
+        self.assertEqual(await self.store.sessions("deadpool@example.com"), [])
+
+    async def test_sessions_per_device(self):
+        phone = await self.store.create("deadpool@example.com", "jti-1", ttl=60)
+        laptop = await self.store.create("deadpool@example.com", "jti-2", ttl=60)
+        await self.store.create("wolverine@example.com", "jti-3", ttl=60)
+        self.assertEqual(sorted(await self.store.sessions("deadpool@example.com")), sorted([phone, laptop]))
+        await self.store.revoke(phone)
+        self.assertEqual(await self.store.sessions("deadpool@example.com"), [laptop])
+        await self.store.revoke_all("deadpool@example.com")
+        self.assertEqual(await self.store.rotate(laptop, "jti-2", "jti-4", ttl=60), MISSING)
+
+    async def test_unknown_session(self):
+        self.assertEqual(await self.store.rotate("nope", "jti-1", "jti-2", ttl=60), MISSING)
+
+
+class TestRedisSessionStore(SessionStoreTests, unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(server=FakeServer())
+        self.store = RedisSessionStore(self.redis)
+
+    async def test_session_expires(self):
+        sid = await self.store.create("deadpool@example.com", "jti-1", ttl=60)
+        self.assertLessEqual(await self.redis.ttl(RedisSessionStore.key(sid)), 60)
+        await self.store.rotate(sid, "jti-1", "jti-2", ttl=600)
+        self.assertGreater(await self.redis.ttl(RedisSessionStore.key(sid)), 60)
+
+
+class TestMemorySessionStore(SessionStoreTests, unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.store = MemorySessionStore()
+
+    async def test_session_expires(self):
+        with patch("src.services.sessions.time.monotonic", return_value=1000):
+            sid = await self.store.create("deadpool@example.com", "jti-1", ttl=60)
+        with patch("src.services.sessions.time.monotonic", return_value=1061):
+            self.assertEqual(await self.store.rotate(sid, "jti-1", "jti-2", ttl=60), MISSING)
+
+
+class TestSessionStore(unittest.TestCase):
+
+    def test_store_must_implement_every_method(self):
+        class Partial(SessionStore):
+            async def create(self, email: str, jti: str, ttl: int) -> str:
+                return self.new_id()
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import os
+import tempfile
+from datetime import date
+sys.path.append(os.getcwd())
+
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.database.models import Base, Contact, EmailOutbox, User
+from src.repository.contacts import birthday_ordinal
+from src.services.email import build_birthday_digests
+from src.workers.birthday_digest import BirthdayDigestJob
+
+
+class TestBirthdayDigestJob(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f'sqlite:///{self.tmp.name}/digest.db'
+        Base.metadata.create_all(create_engine(url))
+        self.engine = create_async_engine(url.replace('sqlite', 'sqlite+aiosqlite'), poolclass=NullPool)
+        self.SessionLocal = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.job = BirthdayDigestJob(self.SessionLocal, days=7, max_contacts=3, batch_size=2, fetch_size=4)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+        self.tmp.cleanup()
+
+    async def add_user(self, user_id: int, birthdays: list, confirmed: bool = True):
+        async with self.SessionLocal() as db:
+            db.add(User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com",
+                        password="secret", confirmed=confirmed))
+            for i, birthday in enumerate(birthdays):
+                db.add(Contact(first_name=f"first{i}", last_name=f"last{user_id}", birthday=birthday,
+                               birthday_ordinal=birthday_ordinal(birthday), user_id=user_id))
+            await db.commit()
+
+    async def outbox(self):
+        async with self.SessionLocal() as db:
+            return (await db.scalars(select(EmailOutbox).order_by(EmailOutbox.id))).all()
+
+    async def test_one_digest_per_user_with_upcoming_birthdays(self):
+        await self.add_user(1, [date(1990, 3, 16), date(1985, 3, 14), date(1990, 5, 1)])
+        await self.add_user(2, [date(2000, 6, 1)])
+        await self.add_user(3, [date(1970, 3, 20)])
+        await self.add_user(4, [date(1970, 3, 15)], confirmed=False)
+        await self.add_user(5, [date(1999, 3, 21)])
+
+        queued = await self.job.run_once(date(2024, 3, 14))
+
+        self.assertEqual(queued, 3)
+        messages = await self.outbox()
+        self.assertEqual([m.recipient for m in messages],
+                         ["user1@example.com", "user3@example.com", "user5@example.com"])
+        self.assertEqual({m.kind for m in messages}, {"birthday_digest"})
+        self.assertEqual(messages[0].payload["contacts"], [
+            {"first_name": "first1", "last_name": "last1", "birthday": "1985-03-14"},
+            {"first_name": "first0", "last_name": "last1", "birthday": "1990-03-16"},
+        ])
+        self.assertEqual(messages[0].payload["more"], 0)
+        self.assertEqual(self.job.last_user_id, 5)
+
+    async def test_window_across_new_year_lists_december_first(self):
+        await self.add_user(1, [date(1990, 1, 2), date(1990, 12, 30)])
+
+        await self.job.run_once(date(2023, 12, 28))
+
+        message, = await self.outbox()
+        self.assertEqual([c["birthday"] for c in message.payload["contacts"]], ["1990-12-30", "1990-01-02"])
+
+    async def test_caps_contacts_and_counts_the_rest(self):
+        await self.add_user(1, [date(1990, 3, 14 + i) for i in range(5)])
+
+        await self.job.run_once(date(2024, 3, 14))
+
+        message, = await self.outbox()
+        self.assertEqual([c["birthday"] for c in message.payload["contacts"]],
+                         ["1990-03-14", "1990-03-15", "1990-03-16"])
+        self.assertEqual(message.payload["more"], 2)
+
+    async def test_resumes_after_user(self):
+        for user_id in (1, 2, 3):
+            await self.add_user(user_id, [date(1990, 3, 15)])
+
+        queued = await self.job.run_once(date(2024, 3, 14), after_user_id=2)
+
+        self.assertEqual(queued, 1)
+        self.assertEqual([m.recipient for m in await self.outbox()], ["user3@example.com"])
+
+    async def test_queues_one_digest_per_user_and_day(self):
+        for user_id in (1, 2, 3):
+            await self.add_user(user_id, [date(1990, 3, 16)])
+        await self.job.run_once(date(2024, 3, 14), after_user_id=1)
+
+        self.assertEqual(await self.job.run_once(date(2024, 3, 14)), 1)
+        self.assertEqual(await self.job.run_once(date(2024, 3, 14)), 0)
+        self.assertEqual(await self.job.run_once(date(2024, 3, 15)), 3)
+        self.assertEqual(sorted(m.dedupe_key for m in await self.outbox()), [
+            "birthday_digest:1:2024-03-14", "birthday_digest:1:2024-03-15", "birthday_digest:2:2024-03-14",
+            "birthday_digest:2:2024-03-15", "birthday_digest:3:2024-03-14", "birthday_digest:3:2024-03-15",
+        ])
+
+    def test_build_birthday_digests(self):
+        email, = build_birthday_digests([("user1@example.com", {
+            "username": "Ann", "days": 7, "more": 2,
+            "contacts": [{"first_name": "Bob", "last_name": "<Smith>", "birthday": "1990-03-05"}],
+        })])
+        html = email.get_payload(decode=True).decode()
+        self.assertEqual(email["To"], "user1@example.com")
+        self.assertIn("Hi Ann", html)
+        self.assertIn("Bob &lt;Smith&gt; &mdash; 5 March", html)
+        self.assertIn("and 2 more", html)
+
+
+if __name__ == '__main__':
+    unittest.main()
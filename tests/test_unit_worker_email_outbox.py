@@ -0,0 +1,164 @@
+import sys
+import os
+import socket
+import tempfile
+from datetime import datetime, timedelta
+from email import message_from_bytes
+sys.path.append(os.getcwd())
+
+import unittest
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.database.models import Base, EmailOutbox
+from src.repository import outbox as repository_outbox
+from src.services.email import SMTPPool
+from src.workers.email_outbox import OutboxSender
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Mailbox:
+
+    def __init__(self):
+        self.messages = []
+        self.reject = False
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            return '451 Try again later'
+        self.messages.append(message_from_bytes(envelope.content))
+        return '250 OK'
+
+
+class TestOutboxSender(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.mailbox = Mailbox()
+        self.controller = Controller(self.mailbox, hostname='127.0.0.1', port=free_port())
+        self.controller.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f'sqlite:///{self.tmp.name}/outbox.db'
+        Base.metadata.create_all(create_engine(url))
+        self.engine = create_async_engine(url.replace('sqlite', 'sqlite+aiosqlite'), poolclass=NullPool)
+        self.SessionLocal = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.smtp = SMTPPool(1, hostname='127.0.0.1', port=self.controller.port,
+                             use_tls=False, start_tls=False)
+        self.sender = OutboxSender(self.SessionLocal, self.smtp, batch_size=10, lease=60, max_attempts=2,
+                                   backoff_base=30, backoff_max=3600)
+
+    async def asyncTearDown(self):
+        await self.smtp.close()
+        await self.engine.dispose()
+        self.controller.stop()
+        self.tmp.cleanup()
+
+    async def enqueue(self, count: int):
+        async with self.SessionLocal() as db:
+            for i in range(count):
+                repository_outbox.enqueue_email("confirm_email", f"user{i}@example.com",
+                                                {"username": f"user{i}", "host": "http://testserver/"}, db)
+            await db.commit()
+
+    async def outbox(self):
+        async with self.SessionLocal() as db:
+            return (await db.scalars(select(EmailOutbox).order_by(EmailOutbox.id))).all()
+
+    async def test_sends_batch_over_one_connection(self):
+        await self.enqueue(3)
+        self.assertEqual(await self.sender.run_once(), 3)
+        self.assertEqual(sorted(m["To"] for m in self.mailbox.messages),
+                         ["user0@example.com", "user1@example.com", "user2@example.com"])
+        self.assertIn("api/auth/confirmed_email/", self.mailbox.messages[0].get_payload(decode=True).decode())
+        self.assertEqual(self.smtp.stats()["connects"], 1)
+        self.assertEqual(self.mailbox.connections, 1)
+        self.assertTrue(all(m.status == repository_outbox.SENT and m.sent_at for m in await self.outbox()))
+        self.assertEqual(await self.sender.run_once(), 0)
+
+    async def test_retries_with_backoff_then_fails(self):
+        await self.enqueue(1)
+        self.mailbox.reject = True
+        self.assertEqual(await self.sender.run_once(), 1)
+        message, = await self.outbox()
+        self.assertEqual((message.status, message.attempts), (repository_outbox.PENDING, 1))
+        self.assertGreater(message.next_attempt_at, datetime.utcnow() + timedelta(seconds=20))
+        self.assertIn("451", message.last_error)
+        self.assertEqual(await self.sender.run_once(), 0)
+
+        async with self.SessionLocal() as db:
+            message = await db.get(EmailOutbox, message.id)
+            message.next_attempt_at = datetime.utcnow()
+            await db.commit()
+        self.assertEqual(await self.sender.run_once(), 1)
+        message, = await self.outbox()
+        self.assertEqual((message.status, message.attempts), (repository_outbox.FAILED, 2))
+
+    async def test_reconnects_after_server_closed_connection(self):
+        await self.enqueue(1)
+        await self.sender.run_once()
+        self.controller.stop()
+        self.controller = Controller(self.mailbox, hostname='127.0.0.1', port=self.controller.port)
+        self.controller.start()
+        await self.enqueue(1)
+        self.assertEqual(await self.sender.run_once(), 1)
+        self.assertEqual(len(self.mailbox.messages), 2)
+
+    async def test_claim_leases_messages_until_the_lease_runs_out(self):
+        await self.enqueue(2)
+        now = datetime.utcnow()
+        async with self.SessionLocal() as db:
+            claimed = await repository_outbox.claim_batch(10, 60, db, now=now)
+        self.assertEqual(len(claimed), 2)
+        # committed, so the rows are not locked while the batch is sent
+        self.assertTrue(all(m.status == repository_outbox.SENDING and m.locked_until == now + timedelta(seconds=60)
+                            for m in await self.outbox()))
+        async with self.SessionLocal() as db:
+            self.assertEqual(await repository_outbox.claim_batch(10, 60, db, now=now + timedelta(seconds=59)), [])
+        async with self.SessionLocal() as db:
+            reclaimed = await repository_outbox.claim_batch(10, 60, db, now=now + timedelta(seconds=60))
+        self.assertEqual([m.id for m in reclaimed], [m.id for m in claimed])
+
+    async def test_outcome_after_lease_ran_out_is_not_recorded(self):
+        await self.enqueue(1)
+        deliver = self.sender.deliver
+
+        async def slow_deliver(messages):
+            # another worker claims the message again while this one is still sending it
+            async with self.SessionLocal() as db:
+                await repository_outbox.claim_batch(10, 60, db, now=datetime.utcnow() + timedelta(seconds=61))
+            return await deliver(messages)
+
+        self.sender.deliver = slow_deliver
+        self.assertEqual(await self.sender.run_once(), 1)
+        message, = await self.outbox()
+        self.assertEqual((message.status, message.attempts), (repository_outbox.SENDING, 0))
+        self.assertEqual(len(self.mailbox.messages), 1)
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_delay_doubles_up_to_max(self):
+        message = EmailOutbox(attempts=0)
+        now = datetime(2023, 3, 1)
+        delays = []
+        for _ in range(5):
+            repository_outbox.mark_attempt_failed(message, "error", 10, backoff_base=30, backoff_max=100, now=now)
+            delays.append((message.next_attempt_at - now).total_seconds())
+        self.assertEqual(delays, [30, 60, 100, 100, 100])
+
+
+if __name__ == '__main__':
+    unittest.main()